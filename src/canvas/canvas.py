@@ -2,11 +2,15 @@ import json
 import logging
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from threading import Lock
 
 import requests
 
 from .. import sheet
+from ..supervisor import Backoff
+from . import progress, trigger
 
 # Change directory to repository root
 path = os.path.abspath(
@@ -39,163 +43,320 @@ ch.setFormatter(formatter)
 logger.addHandler(fh)
 logger.addHandler(ch)
 
+# Create a new directory for cached Canvas data if it doesn't exist
+if not os.path.exists(path + "/data/canvas"):
+    os.makedirs(path + "/data/canvas")
 
-# Function to list all modules in a course
-def list_modules():
-    # Load keys from json file
-    keys = json.load(open("common/canvas.json"))
+# Canvas API auth token and course IDs (see get_course_ids())
+KEYS_FILE = "common/canvas.json"
 
-    # get Canvas API auth token and course ID
-    token = keys["auth_token"]
-    course_id = keys["course_id"]
+# completion cache - maps each student's Canvas ID to a bitset of their completed modules and when they were last seen
+CACHE_FILE = "data/canvas/cache.json"
+CACHE_EXPIRY_DAYS = 30  # forget students that haven't been on the roster for 30 days
 
-    # Canvas API endpoint for modules & auth header
-    url = f"https://canvas.ucsc.edu/api/v1/courses/{course_id}/modules"
-    headers = {"Authorization": f"Bearer {token}"}
+# checkpoint of an in-progress sync - roster snapshot, fetched completions, and which sheet writes are done
+CHECKPOINT_FILE = "data/canvas/checkpoint.json"
+CHECKPOINT_INTERVAL = 25  # save the checkpoint every 25 students
+CHECKPOINT_EXPIRY_HOURS = 12  # roster is stale after 12 hours, start over
 
-    # Parameters for the request (shouldn't need to apply since there aren't more than 1000 modules)
-    params = {
-        "per_page": 1000,
-    }
 
-    # Send GET request to Canvas API, record response
-    response = requests.request("GET", url, headers=headers, params=params)
+# convert a list of completed module positions (1-indexed) into a bitset - bit 0 is module 1
+def completed_to_bits(completed_modules):
+    bits = 0
+    for m in completed_modules:
+        bits |= 1 << (m - 1)
+    return bits
 
-    # Print the response in a pretty format
-    print(json.dumps(response.json(), indent=4))
 
+# write a json file atomically - a crash mid-write leaves the previous file intact
+def write_json(file, data):
+    with open(file + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(file + ".tmp", file)
 
-# Function to perform a full Canvas update (pull all staff and student data, evaluate modules, and write to sheets)
-def update():
-    # try/except to exit nicely if a keyboard interrupt is received
+
+# convert a bitset back into a list of completed module positions
+def bits_to_completed(bits):
+    return [i + 1 for i in range(bits.bit_length()) if bits >> i & 1]
+
+
+# load the completion cache, or an empty cache if there isn't one yet
+def load_cache():
     try:
-        # Get the current sheet data
-        sheet.get_sheet_data(limited=False)
-        logger.info("Successfully retrieved sheet data")
+        return json.load(open(CACHE_FILE))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"rules": None, "students": {}}
 
-        # Load keys from json file
-        keys = json.load(open("common/canvas.json"))
 
-        # get Canvas API auth token and course ID
-        token = keys["auth_token"]
-        course_id = keys["course_id"]
+# get the list of course IDs from the Canvas keys - "course_ids" lists several courses, "course_id" is a single course
+# the first course is the primary course - unqualified module numbers in the Modules sheet refer to it
+def get_course_ids(keys):
+    return [str(c) for c in keys.get("course_ids", [keys.get("course_id")])]
 
-        # Canvas API endpoint root & auth header
-        url = f"https://canvas.ucsc.edu/api/v1/courses/{course_id}/"
-        headers = {"Authorization": f"Bearer {token}"}
 
-        # specify users endpoint
-        endpoint = "users"
+# load the checkpoint of an interrupted sync, or None if there isn't one (or it has expired)
+def load_checkpoint():
+    try:
+        checkpoint = json.load(open(CHECKPOINT_FILE))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
-        # Initialize lists for staff and students
-        staff_json = []
-        students_json = []
+    if datetime.now() - datetime.fromisoformat(checkpoint["started"]) > timedelta(
+        hours=CHECKPOINT_EXPIRY_HOURS
+    ):
+        logger.info("Discarding expired sync checkpoint")
+        os.remove(CHECKPOINT_FILE)
+        return None
+    return checkpoint
+
+
+# Function to list all modules in each course
+def list_modules():
+    # Load keys from json file
+    keys = json.load(open(KEYS_FILE))
+
+    # get Canvas API auth token
+    token = keys["auth_token"]
 
-        # Parameters for the request - search only for Teachers
+    for course_id in get_course_ids(keys):
+        # Canvas API endpoint for modules & auth header
+        url = f"https://canvas.ucsc.edu/api/v1/courses/{course_id}/modules"
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # Parameters for the request (shouldn't need to apply since there aren't more than 1000 modules)
         params = {
-            "enrollment_type[]": "teacher",
             "per_page": 1000,
         }
 
-        # counter to keep track of & print how many requests are made
-        staff_count = 0
+        # Send GET request to Canvas API, record response
+        response = requests.request("GET", url, headers=headers, params=params)
 
-        # make initial request to Canvas API for teacher data
-        response = requests.request(
-            "GET", url + endpoint, headers=headers, params=params
-        )
+        # Print the response in a pretty format - modules from this course are referenced as "course_id:position"
+        print(f"Course {course_id}:")
+        print(json.dumps(response.json(), indent=4))
 
-        # convert response to json and add to staff_json list
-        staff_json = response.json()
 
-        # log success & counter
-        logger.info(f"Successfully retrieved staff data part {staff_count} from Canvas")
+# make a request to the Canvas API, counting it for the sync progress
+def canvas_request(*args, **kwargs):
+    progress.request()
+    return requests.request(*args, **kwargs)
 
-        # while there are more pages of teacher data to retrieve
-        while "next" in response.links:
-            # make request for next page of teacher data
-            response = requests.request(
-                "GET", response.links["next"]["url"], headers=headers
-            )
-            # convert response to json and add to staff_json list
-            staff_json += response.json()
-            # increment counter
-            staff_count += 1
-            # log success & counter
-            logger.info(
-                f"Successfully retrieved staff data part {staff_count} from Canvas"
-            )
 
-        # Parameters for the request - search only for TAs
-        params = {
-            "enrollment_type[]": "ta",
-            "per_page": 1000,
-        }
+# Function to pull all staff (teachers and TAs) and student data for a course from Canvas
+# url: str: the course's Canvas API endpoint root
+# headers: dict: the auth header for the request
+# returns the staff and student json lists
+def get_roster(url, headers):
+    # specify users endpoint
+    endpoint = "users"
 
-        # make initial request to Canvas API for TA data
-        response = requests.request(
-            "GET", url + endpoint, headers=headers, params=params
-        )
+    # Initialize lists for staff and students
+    staff_json = []
+    students_json = []
+
+    # Parameters for the request - search only for Teachers
+    params = {
+        "enrollment_type[]": "teacher",
+        "per_page": 1000,
+    }
+
+    # counter to keep track of & print how many requests are made
+    staff_count = 0
+
+    # make initial request to Canvas API for teacher data
+    response = canvas_request("GET", url + endpoint, headers=headers, params=params)
+
+    # convert response to json and add to staff_json list
+    staff_json = response.json()
+
+    # log success & counter
+    logger.info(f"Successfully retrieved staff data part {staff_count} from Canvas")
+
+    # while there are more pages of teacher data to retrieve
+    while "next" in response.links:
+        # make request for next page of teacher data
+        response = canvas_request("GET", response.links["next"]["url"], headers=headers)
         # convert response to json and add to staff_json list
         staff_json += response.json()
-        # if there was any data, increment counter and log success
-        if len(response.json()) > 0:
-            staff_count += 1
-            logger.info(
-                f"Successfully retrieved staff data part {staff_count} from Canvas"
-            )
+        # increment counter
+        staff_count += 1
+        # log success & counter
+        logger.info(f"Successfully retrieved staff data part {staff_count} from Canvas")
 
-        # while there are more pages of TA data to retrieve
-        while "next" in response.links:
-            # make request for next page of TA data
-            response = requests.request(
-                "GET", response.links["next"]["url"], headers=headers
-            )
-            # convert response to json and add to staff_json list
-            staff_json += response.json()
-            # increment counter
-            staff_count += 1
-            # log success and counter
-            logger.info(
-                f"Successfully retrieved staff data part {staff_count} from Canvas"
-            )
+    # Parameters for the request - search only for TAs
+    params = {
+        "enrollment_type[]": "ta",
+        "per_page": 1000,
+    }
 
-        # Parameters for the request - search only for Students
-        params = {
-            "enrollment_type[]": "student",
-            "per_page": 1000,
-        }
+    # make initial request to Canvas API for TA data
+    response = canvas_request("GET", url + endpoint, headers=headers, params=params)
+    # convert response to json and add to staff_json list
+    staff_json += response.json()
+    # if there was any data, increment counter and log success
+    if len(response.json()) > 0:
+        staff_count += 1
+        logger.info(f"Successfully retrieved staff data part {staff_count} from Canvas")
 
-        # counter to keep track of & print how many requests are made
-        student_count = 0
+    # while there are more pages of TA data to retrieve
+    while "next" in response.links:
+        # make request for next page of TA data
+        response = canvas_request("GET", response.links["next"]["url"], headers=headers)
+        # convert response to json and add to staff_json list
+        staff_json += response.json()
+        # increment counter
+        staff_count += 1
+        # log success and counter
+        logger.info(f"Successfully retrieved staff data part {staff_count} from Canvas")
 
-        # make initial request to Canvas API for student data
-        response = requests.request(
-            "GET", url + endpoint, headers=headers, params=params
-        )
+    # Parameters for the request - search only for Students
+    params = {
+        "enrollment_type[]": "student",
+        "per_page": 1000,
+    }
+
+    # counter to keep track of & print how many requests are made
+    student_count = 0
+
+    # make initial request to Canvas API for student data
+    response = canvas_request("GET", url + endpoint, headers=headers, params=params)
+    # convert response to json and add to students_json list
+    students_json = response.json()
+    # log success & counter
+    logger.info(f"Successfully retrieved student data part {student_count} from Canvas")
+    # while there are more pages of student data to retrieve
+    while "next" in response.links:
+        # make request for next page of student data
+        response = canvas_request("GET", response.links["next"]["url"], headers=headers)
         # convert response to json and add to students_json list
-        students_json = response.json()
+        students_json += response.json()
+        # increment counter
+        student_count += 1
         # log success & counter
         logger.info(
             f"Successfully retrieved student data part {student_count} from Canvas"
         )
-        # while there are more pages of student data to retrieve
-        while "next" in response.links:
-            # make request for next page of student data
-            response = requests.request(
-                "GET", response.links["next"]["url"], headers=headers
-            )
-            # convert response to json and add to students_json list
-            students_json += response.json()
-            # increment counter
-            student_count += 1
-            # log success & counter
+
+    # log success for all staff and student data
+    logger.info("Successfully retrieved all staff and student data from Canvas")
+
+    return staff_json, students_json
+
+
+# Function to pull a student's module data for a course from Canvas
+# url: str: the course's Canvas API endpoint root
+# headers: dict: the auth header for the request
+# canvas_id: int: the student's Canvas ID
+# num_modules: int: the number of modules in the course, or -1 if not yet known
+# returns the bitset and list of completed modules, and the number of modules in the course
+def get_completed_modules(url, headers, canvas_id, num_modules):
+    # specify modules endpoint
+    endpoint = "modules"
+
+    # data for the request - student_id is the Canvas ID
+    data = {"student_id": canvas_id}
+    # parameters for the request - set per_page to 1000 to get all modules (shouldn't need to apply since there aren't more than 1000 modules)
+    params = {"per_page": 1000}
+    # make request to Canvas API for module data
+    response = canvas_request(
+        "GET", url + endpoint, headers=headers, data=data, params=params
+    )
+    # convert response to json
+    modules_json = json.loads(response.text)
+
+    # if num_modules is -1, set it to the length of the modules_json - indicates number of modules in the course (needed for evaluation)
+    if num_modules == -1:
+        num_modules = len(modules_json)
+
+    # initialize list of completed modules
+    completed_modules = []
+    # for each module in the modules_json
+    for m in modules_json:
+        # if the module is completed, add its position (the module number) to the completed_modules list
+        if m["state"] == "completed":
+            completed_modules.append(int(m["position"]))
+
+    return completed_to_bits(completed_modules), completed_modules, num_modules
+
+
+# Function to perform a Canvas update, publishing its progress to the control app and saving its phase durations
+# full: bool: if True, re-evaluate and rewrite every student regardless of the completion cache
+# returns True if the update succeeded, or False if it did not
+def update(full=False):
+    progress.start(full)
+    success = False
+    try:
+        success = sync(full)
+        return success
+    finally:
+        progress.finish(success)
+
+
+# Function to sync Canvas data (pull all staff and student data, evaluate modules, and write to sheets)
+# every course is pulled concurrently and completions are merged per CruzID
+# by default only students whose completed modules changed since the last sync are re-evaluated and rewritten
+# full: bool: if True, re-evaluate and rewrite every student regardless of the completion cache
+def sync(full=False):
+    # try/except to exit nicely if a keyboard interrupt is received
+    try:
+        progress.phase("roster fetch")
+
+        # Get the current sheet data
+        sheet.get_sheet_data(limited=False)
+        logger.info("Successfully retrieved sheet data")
+
+        # Load keys from json file
+        keys = json.load(open(KEYS_FILE))
+
+        # get Canvas API auth token and course IDs
+        token = keys["auth_token"]
+        course_ids = get_course_ids(keys)
+
+        # Canvas API endpoint root for each course & auth header
+        urls = {c: f"https://canvas.ucsc.edu/api/v1/courses/{c}/" for c in course_ids}
+        headers = {"Authorization": f"Bearer {token}"}
+
+        # resume from the checkpoint if a previous sync was interrupted (with the same courses), otherwise pull the rosters from Canvas
+        checkpoint = load_checkpoint()
+        if checkpoint and list(checkpoint["rosters"]) == course_ids:
             logger.info(
-                f"Successfully retrieved student data part {student_count} from Canvas"
+                f"Resuming sync started at {checkpoint['started']}, {sum(len(c) for c in checkpoint['completed'].values())} completions already fetched"
             )
+            full = checkpoint["full"]
+        else:
+            # pull every course's roster at once - takes as long as the slowest course
+            with ThreadPoolExecutor(len(course_ids)) as executor:
+                rosters = list(
+                    executor.map(lambda c: get_roster(urls[c], headers), course_ids)
+                )
+
+            checkpoint = {
+                "started": str(datetime.now()),
+                "full": full,
+                "rosters": {
+                    c: {"staff": r[0], "students": r[1]}
+                    for c, r in zip(course_ids, rosters)
+                },
+                "new_students": [],
+                "roster_changed": False,
+                "num_modules": {},
+                "completed": {c: {} for c in course_ids},
+                "written": [],
+            }
+            write_json(CHECKPOINT_FILE, checkpoint)
+
+        progress.phase("reconcile")
+
+        # merge the rosters - a user who is staff in any course is staff
+        staff_json = []
+        students_json = []
+        for c in course_ids:
+            staff_json += checkpoint["rosters"][c]["staff"]
+            students_json += checkpoint["rosters"][c]["students"]
 
-        # log success for all staff and student data
-        logger.info("Successfully retrieved all staff and student data from Canvas")
+        # record the current staff and student rosters - any change means the whole sheets need rewriting
+        staff_before = set(sheet.staff_data["CruzID"].values)
+        students_before = set(sheet.student_data["CruzID"].values)
 
         # parse staff data from json into list - indicates staff cruzids that have already been processed
         staff = []
@@ -271,64 +432,184 @@ def update():
         # log success for student data
         logger.info("Successfully processed student data")
 
-        # for each student, pull their module data and evaluate it to determine their accesses
+        # students that were just added to the sheet have no accesses yet and always need evaluating
+        # (including any added before an interrupted sync - if the student sheet was already written, they're no longer new)
+        new_students = (set(students) - students_before) | set(
+            checkpoint["new_students"]
+        )
+
+        # whether any staff or students were added or removed - rows have moved, so the sheets must be rewritten in full
+        roster_changed = checkpoint["roster_changed"] or (
+            set(sheet.staff_data["CruzID"].values) != staff_before
+            or set(sheet.student_data["CruzID"].values) != students_before
+        )
+
+        # record the roster changes in the checkpoint
+        checkpoint["new_students"] = list(new_students)
+        checkpoint["roster_changed"] = roster_changed
 
-        # specify modules endpoint
-        endpoint = "modules"
+        # load the completion cache - if the module rules changed since it was saved, every student needs re-evaluating
+        cache = load_cache()
+        rules = sheet.module_data.values.tolist()
+        if cache["rules"] != rules:
+            logger.info("Module rules changed, evaluating all students")
+            full = True
+        cache["rules"] = rules
 
-        # initialize number of modules to -1
-        num_modules = -1
+        # list of students whose accesses were re-evaluated
+        changed = []
+
+        # time this sync saw each student
+        now = str(datetime.now())
+
+        # for each student, pull their module data and evaluate it to determine their accesses
+
+        # completions fetched so far for each course ({course: {cruzid: bitset}}) and number of modules in each course
+        completed = checkpoint["completed"]
+        num_modules = checkpoint["num_modules"]
+
+        # lock for the checkpoint - each course is fetched in its own thread
+        lock = Lock()
+
+        # students to pull module data for in each course - those enrolled in the course
+        # (skipping any whose completions were fetched before the sync was interrupted)
+        to_fetch = {}
+        for c in course_ids:
+            enrolled = {s["id"] for s in checkpoint["rosters"][c]["students"]}
+            to_fetch[c] = [
+                cruzid
+                for cruzid in students
+                if students[cruzid] in enrolled and cruzid not in completed[c]
+            ]
+
+        progress.phase("module fetch", sum(len(v) for v in to_fetch.values()))
+
+        # pull module data for every student to fetch in a course
+        def fetch_course(c):
+            for i, cruzid in enumerate(to_fetch[c]):
+                bits, _, n = get_completed_modules(
+                    urls[c], headers, students[cruzid], num_modules.get(c, -1)
+                )
+
+                # record the student in the checkpoint, saving it every CHECKPOINT_INTERVAL students
+                with lock:
+                    completed[c][cruzid] = bits
+                    num_modules[c] = n
+                    if (
+                        sum(len(v) for v in completed.values()) % CHECKPOINT_INTERVAL
+                        == 0
+                    ):
+                        write_json(CHECKPOINT_FILE, checkpoint)
+
+                progress.step()
+                logger.info(
+                    f"Successfully retrieved modules for {cruzid} in course {c}, ({i+1}/{len(to_fetch[c])})"
+                )
+
+        # pull every course's module data at once - takes as long as the slowest course
+        with ThreadPoolExecutor(len(course_ids)) as executor:
+            # list() waits for every course and re-raises any error
+            list(executor.map(fetch_course, course_ids))
+
+        progress.phase("evaluation", len(students))
 
         # for each student in the students dictionary
         for i, cruzid in enumerate(students):
-            # data for the request - student_id is the Canvas ID
-            data = {"student_id": students[cruzid]}
-            # parameters for the request - set per_page to 1000 to get all modules (shouldn't need to apply since there aren't more than 1000 modules)
-            params = {"per_page": 1000}
-            # make request to Canvas API for module data
-            response = requests.request(
-                "GET", url + endpoint, headers=headers, data=data, params=params
-            )
-            # convert response to json
-            modules_json = json.loads(response.text)
-
-            # if num_modules is -1, set it to the length of the modules_json - indicates number of modules in the course (needed for evaluation)
-            if num_modules == -1:
-                num_modules = len(modules_json)
-
-            # initialize list of completed modules
-            completed_modules = []
-            # for each module in the modules_json
-            for m in modules_json:
-                # if the module is completed, add its position (the module number) to the completed_modules list
-                if m["state"] == "completed":
-                    completed_modules.append(int(m["position"]))
-
-            # evaluate the modules for the student given the completed_modules list and the number of modules
-            sheet.evaluate_modules(
-                completed_modules, cruzid=cruzid, num_modules=num_modules
-            )
-
-            # log success for the student
-            logger.info(
-                f"Successfully evaluated modules for {cruzid}, ({i+1}/{len(students)})"
-            )
+            # the student's completions in each of their courses
+            bits = {
+                c: completed[c][cruzid] for c in course_ids if cruzid in completed[c]
+            }
+
+            # completed modules - plain positions for the primary course, "course:position" for every course
+            completed_modules = bits_to_completed(bits.get(course_ids[0], 0)) + [
+                f"{c}:{m}" for c in bits for m in bits_to_completed(bits[c])
+            ]
+
+            # compare the student's completions to the cache (json keys are strings)
+            canvas_id = str(students[cruzid])
+            cached = cache["students"].get(canvas_id)
+
+            # only evaluate the student if this is a full sync, they are new, or their completions changed
+            if (
+                full
+                or cruzid in new_students
+                or cached is None
+                or cached["completed"] != bits
+            ):
+                # evaluate the modules for the student given the completed_modules list and the number of modules
+                sheet.evaluate_modules(
+                    completed_modules,
+                    cruzid=cruzid,
+                    num_modules=num_modules.get(course_ids[0]),
+                )
+                changed.append(cruzid)
+
+                # log success for the student
+                logger.info(
+                    f"Successfully evaluated modules for {cruzid}, ({i+1}/{len(students)})"
+                )
+            else:
+                logger.info(
+                    f"Completions unchanged for {cruzid}, ({i+1}/{len(students)})"
+                )
+
+            # update the cache entry for the student
+            cache["students"][canvas_id] = {"completed": bits, "last_seen": now}
+            progress.step()
 
         # log success for all students
-        logger.info("\nSuccessfully evaluated modules for all students")
-
-        # attempt to write the student and staff sheets to Google Sheets, return errors if they fail
-        if sheet.write_student_sheet():
-            logger.info("Successfully wrote student sheet")
-        else:
-            logger.error("Failed to write student sheet")
-            return False
+        logger.info(
+            f"\nSuccessfully evaluated modules for {len(changed)}/{len(students)} students"
+        )
 
-        if sheet.write_staff_sheet():
-            logger.info("Successfully wrote staff sheet")
+        progress.phase("sheet write")
+
+        # save the checkpoint - all completions are fetched, only the sheet writes are left
+        write_json(CHECKPOINT_FILE, checkpoint)
+
+        # writes already done before the sync was interrupted are skipped
+        if "students" in checkpoint["written"]:
+            logger.info("Student sheet already written, skipping")
+        elif full or roster_changed:
+            # attempt to write the student and staff sheets to Google Sheets, return errors if they fail
+            if sheet.write_student_sheet():
+                logger.info("Successfully wrote student sheet")
+            else:
+                logger.error("Failed to write student sheet")
+                return False
+        elif changed:
+            # rows haven't moved, so only write the students that were re-evaluated
+            if sheet.write_student_rows(changed):
+                logger.info(f"Successfully wrote {len(changed)} student rows")
+            else:
+                logger.error("Failed to write student rows")
+                return False
         else:
-            logger.error("Failed to write staff sheet")
-            return False
+            logger.info("No completions changed, nothing to write")
+
+        # record the student sheet write in the checkpoint
+        if "students" not in checkpoint["written"]:
+            checkpoint["written"].append("students")
+            write_json(CHECKPOINT_FILE, checkpoint)
+
+        if "staff" in checkpoint["written"]:
+            logger.info("Staff sheet already written, skipping")
+        elif full or roster_changed:
+            if sheet.write_staff_sheet():
+                logger.info("Successfully wrote staff sheet")
+                checkpoint["written"].append("staff")
+                write_json(CHECKPOINT_FILE, checkpoint)
+            else:
+                logger.error("Failed to write staff sheet")
+                return False
+
+        # forget students that haven't been seen in CACHE_EXPIRY_DAYS, then save the cache
+        # saved only after the sheet writes succeed, so changes from a failed sync are re-evaluated next time
+        expiry = str(datetime.now() - timedelta(CACHE_EXPIRY_DAYS))
+        cache["students"] = {
+            k: v for k, v in cache["students"].items() if v["last_seen"] > expiry
+        }
+        write_json(CACHE_FILE, cache)
 
         # log the canvas update
         if sheet.log("Canvas Update", "", False, 0):
@@ -337,6 +618,9 @@ def update():
             logger.error("Failed to log canvas update")
             return False
 
+        # the sync is complete, remove the checkpoint
+        os.remove(CHECKPOINT_FILE)
+
         return True
     # except to exit nicely if a keyboard interrupt is received
     except KeyboardInterrupt:
@@ -348,8 +632,20 @@ def update():
 # Constants
 CANVAS_UPDATE_HOUR = 2  # update at 2am
 CHECKIN_TIMEOUT = 5  # check in every 5 minutes
+CANVAS_POLL_TIMEOUT = 10  # check the Canvas Status sheet every 10 minutes - fallback for the control app's trigger
+LOOP_TIMEOUT = 60  # seconds to wait for a trigger before checking the time again
 
 if __name__ == "__main__":
+    # listen for update requests from the control app
+    trigger_sock = trigger.listen()
+    # whether the control app requested an update
+    triggered = False
+    # last time the Canvas Status sheet was checked
+    last_status_poll = None
+
+    # errors wait before the loop retries - doubling with each error in a row, from 5 seconds up to 10 minutes
+    backoff = Backoff("canvas", initial=5, maximum=600)
+
     logger.info("Initialization complete")
     # try/except to exit nicely if a keyboard interrupt is received
     try:
@@ -357,12 +653,22 @@ if __name__ == "__main__":
         while True:
             # try/except to log error and continue if an error occurs - unless a keyboard interrupt is received
             try:
-                # get the status of the canvas update
-                sheet.get_canvas_status_sheet()
+                # get the status of the canvas update - only every CANVAS_POLL_TIMEOUT minutes, since the control app triggers updates directly
+                if (
+                    not last_status_poll
+                    or datetime.now() - last_status_poll
+                    > timedelta(minutes=CANVAS_POLL_TIMEOUT)
+                ):
+                    sheet.get_canvas_status_sheet()
+                    last_status_poll = datetime.now()
 
                 if (
-                    sheet.canvas_needs_update  # canvas needs an update
+                    triggered  # the control app requested an update
+                    or sheet.canvas_needs_update  # canvas needs an update
                     or not sheet.last_canvas_update_time  # or the last update time is None - first run
+                    or os.path.exists(
+                        CHECKPOINT_FILE
+                    )  # or a previous update was interrupted - resume it
                     or (  # or it's a new day and past the update hour
                         (
                             datetime.now().date() > sheet.last_canvas_update_time.date()
@@ -371,13 +677,19 @@ if __name__ == "__main__":
                     )
                 ):
                     logger.info("Canvas update...")
+                    full = (
+                        triggered or sheet.canvas_needs_update
+                    )  # a full update if requested from the dashboard, otherwise only changed students
                     sheet.set_canvas_status_sheet(
                         True
                     )  # set the canvas updating status to True - currently in the process of updating (will prevent multiple updates at once and other devices from writing to the sheet)
                     tmp_time = (
                         datetime.now()
                     )  # store the time - indicates when the update started
-                    update()  # perform the update
+                    # perform the update - a failed update keeps its checkpoint, so raise to retry it after backing off
+                    # (and without recording it as done)
+                    if not update(full):
+                        raise RuntimeError("Canvas update failed")
                     sheet.get_sheet_data(
                         limited=False
                     )  # get the updated sheet data (the data that was just written)
@@ -395,17 +707,24 @@ if __name__ == "__main__":
                 else:
                     # log that it's waiting for the next update - indicates that it hasn't crashed yet
                     logger.info("Waiting for next update...")
-                # sleep for 60 seconds - prevents the loop from running too quickly
-                time.sleep(60)
+                # wait up to LOOP_TIMEOUT seconds for the control app to request an update - prevents the loop from running too quickly
+                triggered = trigger.wait(trigger_sock, LOOP_TIMEOUT)
+                if triggered:
+                    logger.info("Update requested by control app")
+                backoff.success()
 
             except Exception as e:
                 # if an error occurs
                 if type(e) == KeyboardInterrupt:  # if it's a keyboard interrupt, exit
                     raise e
-                # otherwise, log the error, sleep for 60 seconds, and mark the canvas status as no longer updating
-                logger.error(f"Error: {e}")
-                time.sleep(60)
+                # otherwise, log the error, back off, and mark the canvas status as no longer updating
+                delay = backoff.failure(e)
+                logger.error(
+                    f"Error: {e} - retrying in {delay:.0f}s ({backoff.consecutive} in a row)"
+                )
+                time.sleep(delay)
                 sheet.set_canvas_status_sheet(False)
+                triggered = False
 
     except KeyboardInterrupt:
         # if error was a keyboard interrupt, log and exit
@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+import socket
+import time
+from datetime import datetime
+from threading import Lock
+
+# repository root
+path = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+)
+
+# Unix datagram socket the control app listens on - the canvas process sends progress updates to it while a sync runs
+SOCKET_FILE = path + "/data/canvas/progress.sock"
+
+# per-phase durations of every sync, one row per sync
+TIMINGS_FILE = path + "/logs/canvas/timings.csv"
+
+# phases of a sync, in order
+PHASES = ["roster fetch", "reconcile", "module fetch", "evaluation", "sheet write"]
+
+PUBLISH_INTERVAL = 0.5  # seconds between progress updates
+
+# state of the current sync
+started = None  # time the sync started
+full = False  # whether this is a full sync
+phase_name = None  # current phase
+phase_start = None  # time the current phase started
+durations = {}  # durations of the completed phases in seconds
+done = 0  # students done in the current phase
+total = 0  # students to do in the current phase
+requests = 0  # Canvas API requests made in the current phase
+last_publish = 0  # time of the last progress update
+
+# lock for the state - module data is fetched from several threads
+lock = Lock()
+
+# socket used to send progress updates
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+sock.setblocking(False)
+
+
+def start(full_sync=False):
+    """
+    Start tracking a sync.
+
+    full_sync: bool: whether this is a full sync.
+    """
+    global started, full, durations
+    started = datetime.now()
+    full = full_sync
+    durations = {}
+
+
+def phase(name, count=0):
+    """
+    Start a new phase of the sync, ending the current one.
+
+    name: str: the phase name (one of PHASES).
+    count: int: the number of students to do in this phase (0 if not counted).
+    """
+    global phase_name, phase_start, done, total, requests
+    with lock:
+        if phase_name:
+            durations[phase_name] = time.monotonic() - phase_start
+        phase_name = name
+        phase_start = time.monotonic()
+        done = 0
+        total = count
+        requests = 0
+    publish(force=True)
+
+
+def step(count=1):
+    """
+    Record students done in the current phase.
+
+    count: int: the number of students done.
+    """
+    global done
+    with lock:
+        done += count
+    publish()
+
+
+def request():
+    """
+    Record a Canvas API request in the current phase.
+    """
+    global requests
+    with lock:
+        requests += 1
+
+
+def finish(success):
+    """
+    End the sync - send a final update and save the phase durations.
+
+    success: bool: whether the sync succeeded.
+    """
+    global phase_name
+    with lock:
+        if phase_name:
+            durations[phase_name] = time.monotonic() - phase_start
+        phase_name = None
+    publish(force=True, status="done" if success else "failed")
+
+    # write a header row if the file is new
+    new_file = not os.path.exists(TIMINGS_FILE)
+    with open(TIMINGS_FILE, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["started", "full", "success"] + PHASES + ["total"])
+        writer.writerow(
+            [str(started), full, success]
+            + [round(durations.get(p, 0), 2) for p in PHASES]
+            + [round(sum(durations.values()), 2)]
+        )
+
+
+def publish(force=False, status="running"):
+    """
+    Send the current progress to the control app (at most every PUBLISH_INTERVAL seconds unless forced).
+
+    force: bool: send even if the last update was less than PUBLISH_INTERVAL ago.
+    status: str: "running", "done", or "failed".
+    """
+    global last_publish
+    with lock:
+        now = time.monotonic()
+        if not force and now - last_publish < PUBLISH_INTERVAL:
+            return
+        last_publish = now
+
+        elapsed = now - phase_start if phase_name else 0
+        # estimate the time left in the phase from the rate so far
+        eta = (total - done) * elapsed / done if phase_name and total and done else None
+        message = {
+            "status": status,
+            "phase": phase_name,
+            "phase_index": PHASES.index(phase_name) if phase_name else len(PHASES),
+            "phases": len(PHASES),
+            "done": done,
+            "total": total,
+            "requests_per_sec": round(requests / elapsed, 1) if elapsed else 0,
+            "eta_sec": round(eta) if eta is not None else None,
+            "durations": {p: round(d, 1) for p, d in durations.items()},
+        }
+
+    try:
+        sock.sendto(json.dumps(message).encode(), SOCKET_FILE)
+    except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+        # the control app isn't listening (or is behind) - progress is best effort
+        pass
+
+
+def listen():
+    """
+    Create the progress socket (control app only).
+
+    Returns the socket to pass to receive().
+    """
+    # Create a new directory for the socket if it doesn't exist
+    if not os.path.exists(os.path.dirname(SOCKET_FILE)):
+        os.makedirs(os.path.dirname(SOCKET_FILE))
+
+    # remove the socket left behind by a previous run
+    if os.path.exists(SOCKET_FILE):
+        os.remove(SOCKET_FILE)
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    s.bind(SOCKET_FILE)
+    return s
+
+
+def receive(s, timeout):
+    """
+    Wait for a progress update.
+
+    s: socket: the socket returned by listen().
+    timeout: float: the maximum time to wait in seconds.
+
+    Returns the progress dictionary, or None if the timeout passed first.
+    """
+    s.settimeout(timeout)
+    try:
+        return json.loads(s.recv(4096))
+    except socket.timeout:
+        return None
@@ -0,0 +1,75 @@
+import os
+import socket
+
+# repository root
+path = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+)
+
+# Unix datagram socket the canvas process listens on - the control app sends to it to start a Canvas update immediately
+# (the Canvas Status sheet is still checked as a fallback, ex. if the canvas process is restarting)
+SOCKET_FILE = path + "/data/canvas/trigger.sock"
+
+# message sent to request an update
+UPDATE = b"update"
+
+
+def listen():
+    """
+    Create the trigger socket (canvas process only).
+
+    Returns the socket to pass to wait().
+    """
+    # Create a new directory for the socket if it doesn't exist
+    if not os.path.exists(os.path.dirname(SOCKET_FILE)):
+        os.makedirs(os.path.dirname(SOCKET_FILE))
+
+    # remove the socket left behind by a previous run
+    if os.path.exists(SOCKET_FILE):
+        os.remove(SOCKET_FILE)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(SOCKET_FILE)
+    return sock
+
+
+def wait(sock, timeout):
+    """
+    Wait for a trigger message.
+
+    sock: socket: the socket returned by listen().
+    timeout: float: the maximum time to wait in seconds.
+
+    Returns True if an update was requested, or False if the timeout passed first.
+    """
+    sock.settimeout(timeout)
+    try:
+        message = sock.recv(64)
+    except socket.timeout:
+        return False
+
+    # drain any other requests that arrived at the same time - one update covers them all
+    sock.setblocking(False)
+    try:
+        while True:
+            sock.recv(64)
+    except BlockingIOError:
+        pass
+
+    return message == UPDATE
+
+
+def send():
+    """
+    Ask the canvas process to start an update now.
+
+    Returns True if the message was sent, or False if the canvas process isn't listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(UPDATE, SOCKET_FILE)
+        return True
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    finally:
+        sock.close()
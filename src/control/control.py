@@ -7,8 +7,9 @@ from threading import Event, Thread
 from flask import Flask, redirect, render_template, request, url_for
 from flask_socketio import SocketIO
 
-from .. import sheet
-from ..nfc import nfc_control as nfc
+from .. import metrics, sheet
+from ..canvas import progress, trigger
+from ..nfc import backend
 
 # Change directory to repository root
 path = os.path.abspath(
@@ -50,9 +51,15 @@ socketio = SocketIO(app, cors_allowed_origins="*")
 # create a background thread to update data
 thread = None
 thread_stop_event = Event()
+# create a background thread to forward Canvas update progress
+progress_thread = None
+
+# NFC reader used to read cards for setup/identify - the RFID-B1 unless common/ID.json selects another backend
+nfc = backend.load("b1")
 
 # Get the data from the Google Sheet
 sheet.get_sheet_data(limited=False)
+sheet.get_canvas_status_sheet()
 
 # names and colors used by the Google Sheet
 alarm_enable_names = ["ENABLE", "DISABLE"]
@@ -115,14 +122,34 @@ def assign_uid(cruzid, overwrite, uid):
 
 
 UPDATE_TIMEOUT = 30  # seconds - how often to update
+CANVAS_POLL_TIMEOUT = 10  # minutes between reads of the Canvas Status sheet (every UPDATE_TIMEOUT while Canvas updates)
+
+# time the Canvas Status sheet was last read - None to read it on the next update
+last_canvas_poll = datetime.datetime.now()
+
+
+# function to read the Canvas update status if it is due - Canvas progress (see canvas_progress_thread) says when an update runs and ends, so the sheet is only a slow fallback
+def poll_canvas_status():
+    global last_canvas_poll
+    timeout = (
+        datetime.timedelta(seconds=UPDATE_TIMEOUT)
+        if sheet.canvas_is_updating
+        else datetime.timedelta(minutes=CANVAS_POLL_TIMEOUT)
+    )
+    if not last_canvas_poll or datetime.datetime.now() - last_canvas_poll > timeout:
+        sheet.get_canvas_status_sheet()
+        last_canvas_poll = datetime.datetime.now()
 
 
 # function to update the data in the Google Sheet if needed
 def update_data():
+    poll_canvas_status()
     if (
         not sheet.last_update_time  # never updated
-        or sheet.last_canvas_update_time
-        > sheet.last_update_time  # canvas updated since last data update
+        or (
+            sheet.last_canvas_update_time
+            and sheet.last_canvas_update_time > sheet.last_update_time
+        )  # canvas updated since last data update
         or datetime.datetime.now() - sheet.last_update_time
         > datetime.timedelta(
             0, UPDATE_TIMEOUT, 0, 0, 0, 0, 0
@@ -145,12 +172,35 @@ def background_thread():
             logger.debug("Background thread updating data...")
             update_data()
             socketio.emit("update", {"message": "Data updated"})
+            # write the card read latency histograms every metrics.DUMP_INTERVAL seconds
+            metrics.dump_if_due()
             logger.info("Data updated and event emitted.")
             time.sleep(UPDATE_TIMEOUT / 3)  # wait for the timeout
         except Exception as e:
             logger.error(f"Error during background update: {e}")
 
 
+# background thread to forward Canvas update progress to the frontend
+def canvas_progress_thread():
+    global last_canvas_poll
+    # listen for progress updates from the canvas process
+    sock = progress.listen()
+    # run until the stop event is set
+    while not thread_stop_event.is_set():
+        try:
+            # wait up to a second for an update, then check the stop event again
+            data = progress.receive(sock, 1)
+            if data:
+                socketio.emit("canvas_progress", data)
+                if data["status"] == "running":
+                    sheet.canvas_is_updating = True
+                else:
+                    # the update ended - read its status and time on the next update
+                    last_canvas_poll = None
+        except Exception as e:
+            logger.error(f"Error forwarding canvas progress: {e}")
+
+
 # route for the main page
 @app.route("/")
 def index():
@@ -276,7 +326,11 @@ def dashboard():
                 # return to the dashboard - redirect produces a GET request so a reload by the user doesn't resubmit the POST request
                 return redirect("/dashboard")
             elif request.form["label"] == "update-canvas":  # start canvas update
-                sheet.update_canvas()  # update the canvas
+                # update the canvas - mark it pending in the sheet and wake the canvas process
+                if sheet.update_canvas() and not trigger.send():
+                    logger.warning(
+                        "Canvas process not listening, update will start on its next sheet check"
+                    )
                 logger.info("Updating canvas")
                 return redirect("/dashboard")
             elif request.form["label"] == "update-all":  # update all readers
@@ -317,6 +371,8 @@ def setup():
                 )
                 # get the UID of the card - read from the NFC reader
                 uid = nfc.read_card()
+                if uid:
+                    metrics.finish(uid)
 
                 # if the CruzID is not provided or the card is not detected, display an error message
                 if not cruzid:
@@ -386,6 +442,8 @@ def identify():
                     accesses = sheet.get_all_accesses(cruzid=cruzid)
                 else:  # if the CruzID is not provided, read the card from the NFC reader
                     uid = nfc.read_card()
+                    if uid:
+                        metrics.finish(uid)
                     # look up the user data and accesses from the sheet
                     user_data = dict(
                         zip(
@@ -426,12 +484,17 @@ def identify():
 # start background thread when the site is loaded
 @socketio.on("connect")
 def handle_connect():
-    global thread
+    global thread, progress_thread
     # start the background thread if it is not already running
     if thread is None or not thread.is_alive():
         logger.info("Starting background thread...")
         thread = Thread(target=background_thread)
         thread.start()
+    # start the canvas progress thread if it is not already running
+    if progress_thread is None or not progress_thread.is_alive():
+        logger.info("Starting canvas progress thread...")
+        progress_thread = Thread(target=canvas_progress_thread)
+        progress_thread.start()
 
 
 if __name__ == "__main__":
@@ -10,6 +10,32 @@ document.addEventListener('DOMContentLoaded', (event) => {
         location.reload();
     });
 
+    socket.on('canvas_progress', function(data) {
+        var el = document.getElementById('canvas-progress');
+        if (!el) {
+            return;
+        }
+        if (data.status !== 'running') {
+            // show how long each phase took
+            var durations = Object.keys(data.durations).map(function(phase) {
+                return phase + ' ' + data.durations[phase] + 's';
+            });
+            el.textContent = 'Canvas update ' + data.status + ' (' + durations.join(', ') + ')';
+            return;
+        }
+        var text = 'Phase ' + (data.phase_index + 1) + '/' + data.phases + ': ' + data.phase;
+        if (data.total) {
+            text += ' - ' + data.done + '/' + data.total + ' students';
+        }
+        if (data.requests_per_sec) {
+            text += ', ' + data.requests_per_sec + ' requests/s';
+        }
+        if (data.eta_sec !== null) {
+            text += ', ~' + data.eta_sec + 's left';
+        }
+        el.textContent = text;
+    });
+
     socket.on('disconnect', function() {
         console.log('WebSocket disconnected');
     });
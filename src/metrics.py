@@ -0,0 +1,283 @@
+import json
+import os
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+
+# repository root
+path = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# tap latency histograms of this device (per reader ID - a reader can drive several doors), written every DUMP_INTERVAL
+# seconds (see dump()) - the control app collects these
+METRICS_FILE = path + "/data/metrics/taps.json"
+DUMP_INTERVAL = 60  # seconds between writes
+
+# config file (or the one named by the ACCESS_CARDS_CONFIG environment variable - see sheet.py)
+CONFIG_FILE = os.path.join(
+    path, os.environ.get("ACCESS_CARDS_CONFIG", "common/ID.json")
+)
+
+# stages of a tap, in order - latencies are measured from the first stage (the frame with the card arriving)
+STAGES = ["frame", "uid", "debounce", "decision", "led"]
+
+MAX_PENDING = 64  # taps in progress kept at once - taps that never finish (ex. debounced) are dropped oldest first
+
+
+class Histogram:
+    """
+    HDR-style histogram of latencies - log-linear buckets with a fixed relative error (< 1%) over microseconds to minutes,
+    so recording is O(1) and memory is fixed no matter how many values are recorded.
+    """
+
+    # 128 values per power of 2 - the first 128 microseconds are exact
+    SUB_BUCKET_BITS = 7
+    HALF = 1 << (SUB_BUCKET_BITS - 1)
+    BUCKETS = 64 * HALF  # enough for over an hour
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.max = 0
+
+    def index(self, us):
+        # values under 128 get their own bucket, then each power of 2 is split into 64 buckets
+        shift = max(us.bit_length() - self.SUB_BUCKET_BITS, 0)
+        return min(shift * self.HALF + (us >> shift), self.BUCKETS - 1)
+
+    def value(self, index):
+        # middle of the bucket
+        if index < 2 * self.HALF:
+            return index
+        shift = index // self.HALF - 1
+        return ((index - shift * self.HALF) << shift) + (1 << shift) // 2
+
+    def record(self, seconds):
+        """
+        Record a latency.
+
+        seconds: float: the latency in seconds.
+        """
+        us = max(int(seconds * 1_000_000), 0)
+        self.counts[self.index(us)] += 1
+        self.count += 1
+        self.max = max(self.max, us)
+
+    def percentile(self, p):
+        """
+        Get a percentile of the recorded latencies.
+
+        p: float: the percentile (0-100).
+
+        Returns the latency in seconds, or None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        target = max(round(self.count * p / 100), 1)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return min(self.value(i), self.max) / 1_000_000
+        return self.max / 1_000_000
+
+    def summary(self):
+        """
+        Returns the count, percentiles and max (in milliseconds), and the non-empty buckets (so histograms can be merged).
+        """
+
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        return {
+            "count": self.count,
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "max_ms": ms(self.max / 1_000_000 if self.count else None),
+            "buckets": {i: c for i, c in enumerate(self.counts) if c},
+        }
+
+
+# reader ID -> latency from the first stage to each later stage
+histograms = {}
+
+# other latencies (ex. Sheets calls, LED frames) and counters (ex. NFC polls), by name - see timing() and count()
+timings = {}
+counters = {}
+
+# (reader ID, card ID) -> {stage: time} for taps in progress, oldest first
+pending = {}
+
+last_dump = monotonic()  # time of the last write
+
+# lock for the state - stages are recorded from the NFC worker thread and the main loop
+lock = Lock()
+
+
+def tap(uid, reader):
+    # key of a tap in pending - the same card can be tapped on several doors of a reader at once
+    return (device_id if reader is None else reader, uid)
+
+
+def stage(uid, name, at=None, reader=None):
+    """
+    Record that a tap reached a stage.
+
+    uid: str: the card ID.
+    name: str: the stage (one of STAGES).
+    at: float: the time of the stage (time.monotonic()), or None for now.
+    reader: int: the reader ID of the door tapped, or None for this device's reader ID.
+    """
+    if at is None:
+        at = monotonic()
+    key = tap(uid, reader)
+    with lock:
+        # a new frame starts a new tap
+        if name == STAGES[0] or key not in pending:
+            pending.pop(key, None)
+            pending[key] = {}
+            if len(pending) > MAX_PENDING:
+                pending.pop(next(iter(pending)))
+        pending[key][name] = at
+
+
+def discard(uid, reader=None):
+    """
+    Drop a tap without recording it (ex. a repeat read that was debounced).
+
+    uid: str: the card ID.
+    reader: int: the reader ID of the door tapped, or None for this device's reader ID.
+    """
+    with lock:
+        pending.pop(tap(uid, reader), None)
+
+
+def finish(uid, reader=None):
+    """
+    Record the latencies of a finished tap.
+
+    uid: str: the card ID.
+    reader: int: the reader ID of the door tapped, or None for this device's reader ID.
+    """
+    key = tap(uid, reader)
+    with lock:
+        stages = pending.pop(key, None)
+        if stages and STAGES[0] in stages:
+            if key[0] not in histograms:
+                histograms[key[0]] = {stage: Histogram() for stage in STAGES[1:]}
+            start = stages[STAGES[0]]
+            for name, at in stages.items():
+                if name in histograms[key[0]]:
+                    histograms[key[0]][name].record(at - start)
+
+
+def timing(name, seconds):
+    """
+    Record a latency other than a tap stage.
+
+    name: str: what was timed (ex. "led_frame").
+    seconds: float: the latency in seconds.
+    """
+    with lock:
+        if name not in timings:
+            timings[name] = Histogram()
+        timings[name].record(seconds)
+
+
+def count(name, n=1):
+    """
+    Add to a counter.
+
+    name: str: what is counted (ex. "nfc_polls").
+    n: int: the amount to add.
+    """
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def exposition(gauges=None):
+    """
+    Get the metrics in the Prometheus text format - the tap stages, timings and counters, and any gauges.
+
+    gauges: dict: metric (name, with labels if any - ex. 'errors{subsystem="sheet"}') -> value.
+
+    Returns the text.
+    """
+    lines = []
+
+    def summary(name, labels, h):
+        # percentiles as quantiles, plus the count and max
+        for p in (50, 90, 99):
+            value = h.percentile(p)
+            if value is not None:
+                quantile = ",".join(labels + [f'quantile="{p / 100}"'])
+                lines.append(f"{name}{{{quantile}}} {value}")
+        labels = f"{{{','.join(labels)}}}" if labels else ""
+        lines.append(f"{name}_count{labels} {h.count}")
+        lines.append(f"{name}_max{labels} {h.max / 1_000_000}")
+
+    with lock:
+        lines.append("# TYPE tap_latency_seconds summary")
+        for reader, stages in histograms.items():
+            for stage, h in stages.items():
+                summary(
+                    "tap_latency_seconds", [f'reader="{reader}"', f'stage="{stage}"'], h
+                )
+        for name, h in timings.items():
+            lines.append(f"# TYPE {name}_seconds summary")
+            summary(f"{name}_seconds", [], h)
+        for name, value in counters.items():
+            lines.append(f"# TYPE {name}_total counter")
+            lines.append(f"{name}_total {value}")
+
+    for name, value in (gauges or {}).items():
+        if value is not None:
+            lines.append(f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def dump():
+    """
+    Write the histograms to METRICS_FILE - called every DUMP_INTERVAL seconds (see dump_if_due()), so the file is
+    current even when no taps finish.
+    """
+    global last_dump
+    with lock:
+        last_dump = monotonic()
+        data = {
+            "updated": str(datetime.now()),
+            "reader_id": device_id,
+            "readers": {
+                reader: {name: h.summary() for name, h in stages.items()}
+                for reader, stages in histograms.items()
+            },
+        }
+
+    # Create a new directory for the metrics if it doesn't exist
+    if not os.path.exists(os.path.dirname(METRICS_FILE)):
+        os.makedirs(os.path.dirname(METRICS_FILE))
+
+    # write to a temporary file first so a collector never reads a partial file
+    with open(METRICS_FILE + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(METRICS_FILE + ".tmp", METRICS_FILE)
+
+
+def dump_if_due():
+    """
+    Write the histograms if DUMP_INTERVAL has passed since the last write - for loops that run more often.
+    """
+    if monotonic() - last_dump >= DUMP_INTERVAL:
+        dump()
+
+
+def reader_id():
+    # reader id of this device (see sheet.py), or None if it isn't set
+    try:
+        return json.load(open(CONFIG_FILE)).get("id")
+    except FileNotFoundError:
+        return None
+
+
+# reader ID of this device - taps recorded without a reader ID are this reader's
+device_id = reader_id()
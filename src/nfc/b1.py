@@ -0,0 +1,387 @@
+# RFID-B1 binary protocol - frame encoding and parsing, and a driver for the B1 over a serial port
+# https://eccel.co.uk/wp-content/downloads/RFID-B1-User-Manual.pdf - RFID-B1 manual, section 4.5 for the frame format
+
+import logging
+import time
+from typing import List, Tuple
+
+logger = logging.getLogger("b1")
+
+# every frame starts with 0x02 - RFID-B1 manual 4.5.1.1
+STX = 0x02
+
+
+# build the CCITT CRC table (polynomial 0x1021) - CRC of each byte from 0x00 to 0xFF, same table as in the B1 manual
+def build_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+    return tuple(table)
+
+
+CCITT_CRC_TABLE = build_crc_table()
+
+
+def crc(data):
+    """
+    Calculate the CCITT CRC of some bytes (as in the B1 manual's GetCCITTCRC).
+
+    data: bytes: the data.
+
+    Returns the CRC as an int, or 0 for no data.
+    """
+    if not data:
+        return 0
+    c = 0xFFFF
+    for b in data:
+        c = CCITT_CRC_TABLE[(c >> 8) ^ b] ^ ((c << 8) & 0xFFFF)
+    return c
+
+
+def encode(data):
+    """
+    Build a frame to send to the B1 - header (0x02, length, header CRC) followed by the data and data CRC.
+
+    data: bytes: the frame data (command byte followed by its parameters).
+
+    Returns the frame as bytes.
+    """
+    data = bytes(data)
+    data_crc = crc(data)
+
+    # length of the data and its CRC, LSB first
+    length = len(data) + 2
+    header = bytes((STX, length & 0xFF, length >> 8))
+    header_crc = crc(header)
+
+    return (
+        header
+        + bytes((header_crc & 0xFF, header_crc >> 8))
+        + data
+        + bytes((data_crc & 0xFF, data_crc >> 8))
+    )
+
+
+# length of a frame header - 0x02, data length (LSB, MSB), header CRC (LSB, MSB) - RFID-B1 manual 4.5.1.1
+HEADER_LEN = 5
+
+
+class FrameParser:
+    """
+    Incremental parser for frames received from the B1.
+
+    Bytes are fed in as they arrive - each frame is returned once its header and data are complete and both CRCs check out,
+    and any bytes past the end of a frame are kept for the next one.
+    """
+
+    def __init__(self):
+        # bytes received but not yet parsed into a frame
+        self.buffer = bytearray()
+
+    def needed(self):
+        """
+        Returns the number of bytes still needed to complete the frame at the start of the buffer.
+        """
+        if len(self.buffer) < HEADER_LEN:
+            return HEADER_LEN - len(self.buffer)
+        length = self.buffer[1] | self.buffer[2] << 8
+        return max(HEADER_LEN + length - len(self.buffer), 0)
+
+    def feed(self, data=b""):
+        """
+        Add received bytes and parse any complete frames.
+
+        data: bytes: the bytes received.
+
+        Returns a list of (response code, data) tuples, one per complete frame - the response code is the first data byte (0x00 for ACK),
+        and the data is the rest of the frame's data (without its CRC).
+        """
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER_LEN:
+            # find the start of a frame - skip anything before it
+            if self.buffer[0] != STX:
+                start = self.buffer.find(STX)
+                del self.buffer[: start if start >= 0 else len(self.buffer)]
+                continue
+
+            with memoryview(self.buffer) as view:
+                # check the header CRC - if it's wrong, this 0x02 wasn't the start of a frame
+                if crc(view[:3]) != view[3] | view[4] << 8:
+                    length = None
+                else:
+                    length = view[1] | view[2] << 8
+
+                    # split the data from its CRC (last 2 bytes) and check it, once the whole frame has arrived
+                    end = HEADER_LEN + length
+                    if length >= 3 and len(view) >= end:
+                        data = bytes(view[HEADER_LEN : end - 2])
+                        if crc(data) == view[end - 2] | view[end - 1] << 8:
+                            frames.append((data[0], data[1:]))
+
+            if length is None:
+                # skip this 0x02 and look for the next frame
+                del self.buffer[0]
+            elif len(self.buffer) < HEADER_LEN + length:
+                # wait for the rest of the frame
+                break
+            else:
+                # remove the frame from the buffer - even if its data was invalid, its length was
+                del self.buffer[: HEADER_LEN + length]
+        return frames
+
+
+# types used by the driver - a received frame is its response code and the rest of its data
+Frame = Tuple[int, bytes]
+
+# protocol commands (first byte of the frame data) - RFID-B1 manual 5.3
+CMD_DUMMY = 0x00
+CMD_WRITE = 0x01
+CMD_READ = 0x02
+
+# response codes - RFID-B1 manual 5.2
+ACK = 0x00
+ASYNC_EVENT = 0x08
+
+# event bits in the data byte of an asynchronous packet - RFID-B1 manual 5.6
+# (EVENT_CARD_PRESENT/EVENT_CARD_REMOVED, ASYNC_MASK_ADDR and RFID_START_POLLING are not yet checked against a real B1 -
+# autonomous polling is opt-in until they are, see nfc_control.AUTONOMOUS_POLLING)
+EVENT_CARD_PRESENT = 0x02
+EVENT_CARD_REMOVED = 0x04
+EVENT_COMMAND_END = 0x20
+
+# memory addresses - RFID-B1 manual 3.3
+COMMAND_ADDR = 0x0001
+UID_ADDR = 0x0014  # 10 bytes, followed by the tag type
+TAG_TYPE_ADDR = 0x001E
+BAUD_RATE_ADDR = 0x0038
+ASYNC_MASK_ADDR = 0x003C
+UID_LEN = 10
+
+# RFID commands written to the command register - RFID-B1 manual 5.4
+RFID_GET_UID_TYPE = 0x01
+RFID_START_POLLING = 0x0B
+
+# tag types - RFID-B1 manual 3.3.5
+NO_TAG = 0x00
+MIFARE_1K = 0x06
+
+# UART baud rates and their values in the baud rate register - RFID-B1 manual 3.3
+# not yet checked against a real B1 (nor is BAUD_RATE_ADDR), so nfc_control only switches baud rate if asked to
+BAUD_RATES = {9600: 0x00, 19200: 0x01, 38400: 0x02, 57600: 0x03, 115200: 0x04}
+DEFAULT_BAUD = 9600  # baud rate of the B1 out of the box
+
+RESPONSE_TIMEOUT = 0.1  # maximum time to wait for a response in seconds
+
+
+# data of the commands sent on every card read - see B1.dummy(), B1.run_command() and B1.read_uid_type()
+DUMMY = bytes((CMD_DUMMY,))
+GET_UID_TYPE = (
+    bytes((CMD_WRITE,))
+    + COMMAND_ADDR.to_bytes(2, "little")
+    + (1).to_bytes(2, "little")
+    + bytes((RFID_GET_UID_TYPE,))
+)
+READ_UID_TYPE = (
+    bytes((CMD_READ,))
+    + UID_ADDR.to_bytes(2, "little")
+    + (UID_LEN + 1).to_bytes(2, "little")
+)
+
+# their frames, built once at import - data -> frame
+FRAMES = {data: encode(data) for data in (DUMMY, GET_UID_TYPE, READ_UID_TYPE)}
+
+
+def frame(data: bytes) -> bytes:
+    """
+    Get the frame for some data - the frames in FRAMES are not built again.
+
+    data: bytes: the frame data.
+
+    Returns the frame as bytes.
+    """
+    return FRAMES.get(data) or encode(data)
+
+
+class B1:
+    """
+    Driver for an RFID-B1 connected over a serial port.
+
+    ser: serial.Serial: the open serial port (pyserial).
+    """
+
+    def __init__(self, ser) -> None:
+        self.ser = ser
+        # keeps any partial frame between reads
+        self.parser = FrameParser()
+
+    def receive(self, timeout: float = RESPONSE_TIMEOUT) -> List[Frame]:
+        """
+        Read frames from the B1, returning as soon as at least one complete frame has arrived.
+
+        timeout: float: the maximum time to wait in seconds (0 to only return frames already received).
+
+        Returns a list of (response code, data) frames - empty if no complete frame arrived in time.
+        """
+        # frames left over from the last read (ex. the asynchronous response arriving with the ACK), and anything already received
+        waiting = self.ser.in_waiting
+        frames = self.parser.feed(self.ser.read(waiting) if waiting else b"")
+        deadline = time.monotonic() + timeout
+        while not frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.ser.timeout = remaining
+            # read the rest of the current frame (or whatever has already arrived, if more)
+            data = self.ser.read(max(self.parser.needed(), self.ser.in_waiting, 1))
+            if not data:
+                break
+            frames = self.parser.feed(data)
+        return frames
+
+    def send(self, data: bytes, timeout: float = RESPONSE_TIMEOUT) -> List[Frame]:
+        """
+        Send a frame to the B1 and get the response.
+
+        data: bytes: the frame data (command byte followed by its parameters).
+        timeout: float: the maximum time to wait for the response in seconds.
+
+        Returns the frames received (see receive()).
+        """
+        self.ser.write(frame(data))
+        return self.receive(timeout)
+
+    def dummy(self) -> bool:
+        """
+        Send the dummy command - RFID-B1 manual 5.3.1.
+
+        Returns True if the B1 ACKed it.
+        """
+        frames = self.send(DUMMY)
+        return len(frames) == 1 and frames[0] == (ACK, b"")
+
+    def read_memory(self, address: int, length: int) -> List[Frame]:
+        """
+        Read from the B1's memory - RFID-B1 manual 5.3.3.
+
+        address: int: the memory address.
+        length: int: the number of bytes to read.
+
+        Returns the frames received - the ACK's data is the memory read.
+        """
+        return self.send(
+            bytes((CMD_READ,))
+            + address.to_bytes(2, "little")
+            + length.to_bytes(2, "little")
+        )
+
+    def write_memory(self, address: int, data: bytes) -> List[Frame]:
+        """
+        Write to the B1's memory - RFID-B1 manual 5.3.2.
+
+        address: int: the memory address.
+        data: bytes: the bytes to write.
+
+        Returns the frames received.
+        """
+        return self.send(
+            bytes((CMD_WRITE,))
+            + address.to_bytes(2, "little")
+            + len(data).to_bytes(2, "little")
+            + bytes(data)
+        )
+
+    def run_command(self, command: int) -> List[Frame]:
+        """
+        Run an RFID command by writing it to the command register (for commands without parameters) - RFID-B1 manual 5.4.
+
+        command: int: the RFID command.
+
+        Returns the frames received - the command's ACK, and the asynchronous packet when the command ends if it was quick enough.
+        """
+        return self.write_memory(COMMAND_ADDR, bytes((command,)))
+
+    def read_uid_type(self) -> List[Frame]:
+        """
+        Read the UID and tag type of the last card found in one read.
+
+        Returns the frames received - the ACK's data is the UID (UID_LEN bytes) followed by the tag type.
+        """
+        return self.send(READ_UID_TYPE)
+
+    def use_baud_rate(self, baud: int) -> None:
+        """
+        Switch the serial port (not the B1) to a baud rate, dropping anything received at the old one.
+
+        baud: int: the baud rate.
+        """
+        self.ser.baudrate = baud
+        self.ser.reset_input_buffer()
+        self.parser = FrameParser()
+
+    def set_baud_rate(self, baud: int) -> bool:
+        """
+        Switch the B1 and the serial port to a different baud rate, switching back if the B1 doesn't respond at the new one.
+
+        baud: int: the baud rate (one of BAUD_RATES).
+
+        Returns True if the B1 is responding at the new baud rate, or False if it is at the old one
+        (or not responding at either - the serial port is then left at the old one).
+        """
+        old_baud = self.ser.baudrate
+        frames = self.write_memory(BAUD_RATE_ADDR, bytes((BAUD_RATES[baud],)))
+        if not frames or frames[0][0] != ACK:
+            return False
+
+        # the B1 switches once it has ACKed the write
+        self.use_baud_rate(baud)
+        if self.dummy():
+            return True
+
+        # fall back to the old baud rate - only if the B1 is still there, since it most likely switched after the ACK
+        self.use_baud_rate(old_baud)
+        if self.dummy():
+            return False
+
+        # the B1 may have been slow to switch - try the new baud rate once more
+        self.use_baud_rate(baud)
+        if self.dummy():
+            return True
+
+        logger.error(
+            f"B1 not responding at {baud} or {old_baud} baud after switching baud rate"
+        )
+        self.use_baud_rate(old_baud)
+        return False
+
+    def negotiate_baud_rate(self, baud: int) -> int:
+        """
+        Get the B1 and the serial port to the fastest working baud rate, up to baud.
+
+        baud: int: the baud rate to try (one of BAUD_RATES).
+
+        Returns the baud rate in use.
+        """
+        # the B1 may already be at the faster baud rate (ex. if only this program restarted)
+        for rate in (baud, DEFAULT_BAUD):
+            self.use_baud_rate(rate)
+            if self.dummy():
+                break
+        else:
+            logger.error("B1 not responding")
+            return self.ser.baudrate
+
+        if self.ser.baudrate != baud and not self.set_baud_rate(baud):
+            logger.warning(
+                f"B1 did not switch to {baud} baud, staying at {self.ser.baudrate}"
+            )
+        return self.ser.baudrate
+
+    def close(self) -> None:
+        """
+        Close the serial port.
+        """
+        self.ser.close()
@@ -0,0 +1,269 @@
+# simulated RFID-B1 on a pseudo-terminal - speaks the B1 wire protocol (see b1.py) so nfc_control can run and be benchmarked without hardware
+# run from the repository root: python3 -m src.nfc.b1_sim [--taps N] [--idle SECONDS] [--autonomous-polling] [--baud 115200]
+# or point a backend at it by adding "nfc_port": "<pty path>" to common/ID.json
+
+import argparse
+import os
+import random
+import select
+import statistics
+import time
+import tty
+from threading import Lock, Thread, Timer
+
+from . import b1
+
+# response code for a command the simulator doesn't know
+NAK = 0x01
+
+
+class Simulator:
+    """
+    Simulated RFID-B1 - answers dummy, memory read/write and the RFID commands used by nfc_control,
+    and sends asynchronous packets for cards arriving and leaving while polling.
+
+    The pseudo-terminal path to open is in port.
+    """
+
+    def __init__(self):
+        self.master, self.slave = os.openpty()
+        # raw mode - the line discipline must not change any bytes
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.parser = b1.FrameParser()
+        self.memory = bytearray(0x100)  # RFID memory - RFID-B1 manual 3.3
+        self.polling = False  # whether the RFID command "start polling" has been run
+        self.card = None  # UID (bytes) of the card in the field
+        self.frames = 0  # frames received from the host
+        self.running = False
+        self.thread = None
+
+        # lock for the state - cards are tapped from other threads
+        self.lock = Lock()
+
+    def start(self):
+        """
+        Answer the host in a background thread.
+        """
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            for command, data in self.parser.feed(os.read(self.master, 1024)):
+                with self.lock:
+                    self.frames += 1
+                    self.handle(command, data)
+
+    def send(self, data):
+        os.write(self.master, b1.encode(bytes(data)))
+
+    def handle(self, command, data):
+        """
+        Answer one frame from the host.
+
+        command: int: the protocol command (first data byte).
+        data: bytes: its parameters.
+        """
+        if command == b1.CMD_DUMMY:
+            self.send((b1.ACK,))
+        elif command == b1.CMD_READ and len(data) == 4:
+            address = int.from_bytes(data[:2], "little")
+            length = int.from_bytes(data[2:], "little")
+            self.send(bytes((b1.ACK,)) + self.memory[address : address + length])
+        elif command == b1.CMD_WRITE and len(data) >= 4:
+            address = int.from_bytes(data[:2], "little")
+            length = int.from_bytes(data[2:4], "little")
+            self.memory[address : address + length] = data[4 : 4 + length]
+            self.send((b1.ACK,))
+            if address == b1.COMMAND_ADDR and length:
+                self.run_command(data[4])
+        else:
+            self.send((NAK,))
+
+    def run_command(self, command):
+        if command == b1.RFID_GET_UID_TYPE:
+            self.update_tag()
+            self.send((b1.ASYNC_EVENT, b1.EVENT_COMMAND_END))
+        elif command == b1.RFID_START_POLLING:
+            self.polling = True
+            self.update_tag()
+            if self.card:
+                self.event(b1.EVENT_CARD_PRESENT)
+
+    def update_tag(self):
+        """
+        Put the UID and tag type of the card in the field into memory (zeros if there is none).
+        """
+        uid = self.card or b""
+        self.memory[b1.UID_ADDR : b1.UID_ADDR + b1.UID_LEN] = uid.ljust(
+            b1.UID_LEN, b"\x00"
+        )
+        self.memory[b1.TAG_TYPE_ADDR] = b1.MIFARE_1K if self.card else b1.NO_TAG
+
+    def event(self, bit):
+        """
+        Send an asynchronous packet, if the host enabled that event.
+        """
+        if self.memory[b1.ASYNC_MASK_ADDR] & bit:
+            self.send((b1.ASYNC_EVENT, bit))
+
+    def set_card(self, uid):
+        """
+        Put a card in the field, or take it away.
+
+        uid: bytes: the card's UID, or None to remove the card.
+        """
+        with self.lock:
+            if self.card and self.polling:
+                self.event(b1.EVENT_CARD_REMOVED)
+            self.card = uid
+            if self.polling:
+                self.update_tag()
+                if uid:
+                    self.event(b1.EVENT_CARD_PRESENT)
+
+    def tap(self, uid, hold=0.2):
+        """
+        Hold a card in the field for a while.
+
+        uid: bytes: the card's UID.
+        hold: float: the time to hold it in seconds.
+        """
+        self.set_card(uid)
+        Timer(hold, self.set_card, (None,)).start()
+
+    def close(self):
+        self.stop()
+        if self.thread:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def benchmark(taps, hold, gap, idle, autonomous_polling, baud):
+    """
+    Measure nfc_control's read path against the simulator, as the control app uses it - the worker thread polls
+    while read_card_queue_timeout() waits for cards.
+
+    First nothing is in the field for idle seconds, to measure the cost of polling. Then cards are tapped from a
+    timer at random times, so they arrive at any point in a poll, and the time until each is read is measured.
+
+    taps: int: the number of taps.
+    hold: float: the time each card is held in seconds.
+    gap: float: the most time before each tap in seconds (the time is random, from 0 to gap).
+    idle: float: the time to poll with no card in seconds.
+    autonomous_polling: bool: use the B1's autonomous polling instead of polling from the host (the simulator's polling
+    follows the same constants as nfc_control, so this doesn't check them against a real B1).
+    baud: int: the baud rate for nfc_control to switch the B1 to (the simulator accepts any).
+    """
+    from . import nfc_control
+
+    sim = Simulator()
+    sim.start()
+    nfc_control.AUTONOMOUS_POLLING = autonomous_polling
+    nfc_control.BAUD = baud
+    nfc_control.connect(sim.port)
+
+    # idle - the CPU time is the whole process, so it includes the simulator answering the polls
+    frames = sim.frames
+    cpu = time.process_time()
+    nfc_control.read_card_queue_timeout(idle)
+    idle_frames = sim.frames - frames
+    idle_cpu = time.process_time() - cpu
+
+    latencies = []
+    missed = 0
+    for _ in range(taps):
+        uid = os.urandom(4)
+        tapped = []
+
+        def tap():
+            tapped.append(time.perf_counter())
+            sim.tap(uid, hold)
+
+        timer = Timer(random.uniform(0, gap), tap)
+        timer.start()
+        # wait for this card until it has left the field - earlier cards may still be queued
+        deadline = time.perf_counter() + gap + hold
+        while time.perf_counter() < deadline:
+            card = nfc_control.read_card_queue_timeout(deadline - time.perf_counter())
+            if tapped and card == uid.hex().upper():
+                latencies.append(time.perf_counter() - tapped[0])
+                break
+        else:
+            missed += 1
+        timer.join()
+        # let the card leave the field before the next tap
+        time.sleep(max(tapped[0] + hold - time.perf_counter(), 0))
+
+    print(f"taps: {taps}, missed: {missed}")
+    if len(latencies) >= 2:
+        ms = sorted(l * 1000 for l in latencies)
+        print(
+            f"latency ms - p50: {statistics.median(ms):.2f}, p99: {ms[int(len(ms) * 0.99) - 1]:.2f}, max: {ms[-1]:.2f}"
+        )
+    print(
+        f"idle - frames from host: {idle_frames / idle:.1f}/s, CPU: {idle_cpu / idle:.1%} of a core"
+    )
+    # the worker thread polls until the program exits, so the serial port and the simulator are left open
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulated RFID-B1")
+    parser.add_argument("--taps", type=int, default=100, help="number of taps")
+    parser.add_argument("--hold", type=float, default=0.2, help="seconds per tap")
+    parser.add_argument(
+        "--gap", type=float, default=0.3, help="most seconds before each tap"
+    )
+    parser.add_argument(
+        "--idle", type=float, default=2, help="seconds to poll with no card"
+    )
+    parser.add_argument(
+        "--autonomous-polling",
+        action="store_true",
+        help="use the B1's autonomous polling instead of polling from the host",
+    )
+    parser.add_argument(
+        "--baud",
+        type=int,
+        default=b1.DEFAULT_BAUD,
+        choices=b1.BAUD_RATES,
+        help="baud rate to switch the B1 to",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="only run the simulator (tap cards by typing UIDs) instead of the benchmark",
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        sim = Simulator()
+        sim.start()
+        print(f"Simulated B1 on {sim.port}")
+        while True:
+            try:
+                sim.tap(bytes.fromhex(input("Card UID (hex): ")), args.hold)
+            except ValueError:
+                print("Not a hex UID")
+            except (KeyboardInterrupt, EOFError):
+                sim.close()
+                break
+    else:
+        benchmark(
+            args.taps,
+            args.hold,
+            args.gap,
+            args.idle,
+            args.autonomous_polling,
+            args.baud,
+        )
@@ -0,0 +1,106 @@
+import importlib
+import importlib.util
+import json
+import os
+from typing import Optional, Protocol, Union
+
+# repository root
+path = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+)
+
+# config file (or the one named by the ACCESS_CARDS_CONFIG environment variable - see sheet.py) - the "nfc" key selects
+# the backend, "nfc_port" optionally sets the serial port of the B1 (and "nfc_polling" turns on its autonomous polling,
+# "nfc_baud" the baud rate to switch it to), "nfc_poll_interval" optionally sets the time between checks for a card,
+# and "nfc_trace"/"nfc_speed" optionally set a scan trace for the fake backend to replay (and its speed)
+CONFIG_FILE = os.path.join(
+    path, os.environ.get("ACCESS_CARDS_CONFIG", "common/ID.json")
+)
+
+# NFC backends (modules in this package with the interface below), by the name used in the config file
+BACKENDS = {
+    "b1": "nfc_control",  # RFID-B1 over USB serial (control app)
+    "mfrc522": "nfc_reader",  # MFRC522 over SPI (readers)
+    "fake": "nfc_fake",  # card IDs typed into the console
+}
+
+
+class Backend(Protocol):
+    """
+    Interface shared by the NFC backends.
+
+    A card read returns the card's UID as an uppercase hex string (2 characters per byte),
+    None if there was no card (or it was scanned too soon), or False if there was an error.
+    """
+
+    def read_card(self) -> Union[str, bool, None]:
+        """Read a card now (may wait for one, depending on the backend)."""
+        ...
+
+    def read_card_queue_timeout(self, time: float) -> Union[str, bool, None]:
+        """Wait up to time seconds for a card."""
+        ...
+
+    def clear_timestamps(self) -> None:
+        """Clear the backend's own debouncing, if any - called whenever sheet data is refreshed."""
+        ...
+
+    def close(self) -> None:
+        """Release the device - called when the program exits."""
+        ...
+
+
+def load(
+    default: str,
+    name: Optional[str] = None,
+    config: Optional[dict] = None,
+    separate: bool = False,
+) -> Backend:
+    """
+    Import the NFC backend selected in the config file.
+
+    default: str: the backend to use if the config file doesn't select one (one of BACKENDS).
+    name: str: the backend to use, overriding the config file.
+    config: dict: the settings to use instead of the config file (ex. one door of a reader with several - see reader.py).
+    separate: bool: load a separate copy of the backend, with its own state and device - for several NFC readers in one process.
+
+    Returns the backend module.
+    """
+    if config is None:
+        try:
+            config = json.load(open(CONFIG_FILE))
+        except FileNotFoundError:
+            config = {}
+
+    name = name or config.get("nfc", default)
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown NFC backend {name!r}, expected one of {list(BACKENDS)}"
+        )
+    if separate:
+        # a fresh module object from the same source - its module-level state (device, worker, queue) is its own
+        spec = importlib.util.find_spec(f"{__package__}.{BACKENDS[name]}")
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(f"{__package__}.{BACKENDS[name]}")
+
+    # taps read by the backend are recorded under its reader ID
+    module.reader_id = config.get("id")
+    # the B1 backend can use the B1's autonomous polling, and a faster baud rate
+    if "nfc_polling" in config and hasattr(module, "AUTONOMOUS_POLLING"):
+        module.AUTONOMOUS_POLLING = bool(config["nfc_polling"])
+    if "nfc_baud" in config and hasattr(module, "BAUD"):
+        module.BAUD = int(config["nfc_baud"])
+    # backends that poll for cards can poll more or less often
+    if "nfc_poll_interval" in config and hasattr(module, "POLL_INTERVAL"):
+        module.POLL_INTERVAL = float(config["nfc_poll_interval"])
+    # serial backends can be pointed at a different port (ex. the pseudo-terminal of b1_sim)
+    if "nfc_port" in config and hasattr(module, "connect"):
+        module.connect(config["nfc_port"])
+    # the fake backend can replay a scan trace (path relative to the repository root)
+    if "nfc_trace" in config and hasattr(module, "replay"):
+        module.replay(
+            os.path.join(path, config["nfc_trace"]), config.get("nfc_speed", 1.0)
+        )
+    return module
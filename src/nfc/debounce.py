@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class Debouncer:
+    """
+    Suppresses repeat reads of the same card within a time window, shared by the NFC backends and the reader.
+
+    A card held on the reader keeps being suppressed - every read restarts its window, so it only counts as a new tap
+    once it has been away for the whole window. Cards are kept in order of their last read, so expired cards are dropped
+    from the front and at most max_size cards are remembered (all operations are O(1)).
+
+    window: float: the time a card is suppressed after it was last read in seconds.
+    max_size: int: the maximum number of cards remembered - the least recently read are forgotten first.
+    """
+
+    def __init__(self, window, max_size=1024):
+        self.window = window
+        self.max_size = max_size
+        # card ID -> time it was last read, least recently read first
+        self.last_read = OrderedDict()
+        # lock for last_read - cards can be read from a worker thread and a web request at the same time
+        self.lock = Lock()
+
+    def check(self, uid, now=None):
+        """
+        Record a read of a card and check whether it is a new tap.
+
+        uid: str: the card ID.
+        now: float: the time of the read (time.monotonic()), or None for now.
+
+        Returns True if the card is a new tap, or False if it was read within the window.
+        """
+        if now is None:
+            now = monotonic()
+        with self.lock:
+            last = self.last_read.get(uid)
+            self.last_read[uid] = now
+            self.last_read.move_to_end(uid)
+
+            # forget cards whose window has passed (or the least recently read, if there are too many)
+            while self.last_read:
+                oldest = next(iter(self.last_read.values()))
+                if now - oldest < self.window and len(self.last_read) <= self.max_size:
+                    break
+                self.last_read.popitem(last=False)
+
+            return last is None or now - last >= self.window
+
+    def snapshot(self, now=None):
+        """
+        Get the cards still in their window, for restoring after a restart (see restore()).
+
+        now: float: the current time (time.monotonic()), or None for now.
+
+        Returns a dict of card ID -> seconds since it was last read, least recently read first.
+        """
+        if now is None:
+            now = monotonic()
+        with self.lock:
+            return {uid: now - t for uid, t in self.last_read.items()}
+
+    def restore(self, ages, elapsed=0, now=None):
+        """
+        Remember the cards from a snapshot() - times are relative, since time.monotonic() restarts with the machine.
+
+        ages: dict: card ID -> seconds since it was last read, when the snapshot was taken.
+        elapsed: float: the time since the snapshot was taken in seconds.
+        now: float: the current time (time.monotonic()), or None for now.
+        """
+        if now is None:
+            now = monotonic()
+        with self.lock:
+            # oldest first, so the least recently read are still at the front
+            for uid, age in sorted(ages.items(), key=lambda item: -item[1]):
+                if age + elapsed < self.window:
+                    self.last_read[uid] = now - age - elapsed
+                    self.last_read.move_to_end(uid)
+
+    def clear(self):
+        """
+        Forget all cards.
+        """
+        with self.lock:
+            self.last_read.clear()
+
+    def __len__(self):
+        return len(self.last_read)
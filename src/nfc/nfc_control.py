@@ -1,10 +1,14 @@
 import logging
-import subprocess
-import time
-from multiprocessing import Process, Queue
+from time import monotonic, sleep
+from queue import Empty, Queue
+from threading import Thread
 
 import serial  # type: ignore
 
+from .. import metrics
+from . import b1
+from .debounce import Debouncer
+
 # https://eccel.co.uk/product/chilli-usb-b1/ - product page for the USB NFC reader
 # https://eccel.co.uk/wp-content/downloads/USB-B1-v2-User-manual.pdf - user manual for the USB NFC reader
 # https://eccel.co.uk/wp-content/downloads/RFID-B1-User-Manual.pdf - user manual for a different NFC reader, contains all the commands for the USB NFC reader
@@ -12,255 +16,329 @@ import serial  # type: ignore
 # delay between reads for the same card
 DELAY = 0.1
 
-# open the serial port w/ 9600 baud rate and 0.1 second timeout
-ser = serial.Serial("/dev/ttyUSB0", 9600, timeout=0.1)
+# time between checks for a card in seconds (while no new card is found)
+POLL_INTERVAL = 0.05
+
+# time to wait after a read error in seconds, for each error in a row - the B1 is reconnected after RECONNECT_ERRORS
+ERROR_DELAY = 0.2
+
+# serial port of the NFC reader
+PORT = "/dev/ttyUSB0"
+
+# baud rate to switch the NFC reader to at startup - it starts at 9600 baud, which makes every command round trip slow,
+# but the baud rate register in b1.py hasn't been checked against a real B1 yet, so switching is opt-in ("nfc_baud" in common/ID.json)
+BAUD = b1.DEFAULT_BAUD
+
+# reader ID of the door this backend reads for (set by backend.load()) - labels the tap latency metrics
+reader_id = None
 
 # maintain the last scanned time for each card id so that we can prevent multiple scans within a short time
-timestamps = {}
+debouncer = Debouncer(DELAY)
 
 logger = logging.getLogger("nfc_control")
 logger.setLevel(logging.DEBUG)
 
+# the B1 driver - opened by connect(), which read_card() calls on first use
+reader = None
 
-# use the command.c file to get the hex string for the command to send to the NFC reader
-def get_command(data):
-    # convert data to bytes (from hex-formatted string)
-    return bytes.fromhex(
-        subprocess.run(
-            ["src/nfc/command"] + data, capture_output=True
-        )  # run command.c with command data as the arguments
-        .stdout.decode("utf-8")  # decode the output from bytes to string
-        .strip()  # remove leading/trailing whitespace
-    )
+# serial port of the B1 driver (see connect())
+reader_port = PORT
 
 
-#
-def get_response():
-    # get string response from nfc reader over serial connection (max 1000 bytes)
-    # this is read as a hex string
-    response_str = ser.read(1000).hex()
+def connect(port=None):
+    """
+    Open the serial port and switch the B1 to BAUD if it is set higher (or stay at 9600 if that fails).
 
-    # if the response is empty, return an empty list
-    # first char is the response type, second char onward is the response data
-    if len(response_str) < 2:
-        return []
+    port: str: the serial port of the B1 (ex. the pseudo-terminal of b1_sim), or None for the last one opened (PORT at first).
+    """
+    global reader, reader_port, polling
+    if port is not None:
+        reader_port = port
+    if reader is not None:
+        reader.close()
+    # open the serial port at the B1's default baud rate, then switch both to BAUD
+    reader = b1.B1(
+        serial.Serial(reader_port, b1.DEFAULT_BAUD, timeout=b1.RESPONSE_TIMEOUT)
+    )
+    if BAUD != b1.DEFAULT_BAUD:
+        reader.negotiate_baud_rate(BAUD)
+    # try autonomous polling again on the next read
+    polling = None
 
-    # split the response into 2-character chunks
-    response_split = []
-    for i in range(0, len(response_str), 2):
-        response_split.append(response_str[i : i + 2])
 
-    # packet must start with 0x02 - reference RFID-B1 manual 4.5.1.1
-    if response_split[0] != "02":
-        logger.error("Invalid response: ", response_split)
-        return []
+# given a response, return the UID of a Mifare 1k card and update the timestamp
+def get_mifare_1k_uid(response, frame_time=None):
+    # the UID is the first 4 bytes of the data
+    response = response[1][:4].hex().upper()
+    metrics.stage(response, "frame", frame_time, reader_id)
+    metrics.stage(response, "uid", reader=reader_id)
 
-    # get length of the response data
-    length = len(response_split)
+    # if the card was scanned less than DELAY ago, return None
+    if not debouncer.check(response):
+        metrics.discard(response, reader_id)
+        return None
+    metrics.stage(response, "debounce", reader=reader_id)
 
-    responses = []
+    return response
 
-    # loop through the response data - in case multiple scans occur at once
-    while length > 0:
-        # if the first byte is 0x02, then the response is valid
-        if response_split[0] == "02":
-            # get the length of the data - second and third bytes (should only be 1 byte)
-            data_len = int(response_split[1], 16)
 
-            # get this response - data_len + 5 bytes (0x02, data_len LSB, data_len MSB, Header CRC LSB, Header CRC MSB, data_len bytes of data) - RFID-B1 manual 4.5.1.1
-            r = response_split[: data_len + 5]
+# check if the NFC device is connected
+def check_connection():
+    if reader is None:
+        connect()
+    # dummy command to check if the device is connected - should return ACK
+    if not reader.dummy():
+        # TODO: log NFC device not connected
+        return False
+    return True
 
-            # remove this response from the serial data
-            response_split = response_split[data_len + 5 :]
 
-            # update the length of the serial data
-            length = len(response_split)
+# use the B1's autonomous polling (see start_polling()) instead of polling from the host - opt-in ("nfc_polling" in
+# common/ID.json) until the polling command, events mask address and event bits in b1.py are checked against a real B1
+AUTONOMOUS_POLLING = False
 
-            # if the response does not start with 0x02, then it is invalid
-            if r[0] != "02":
-                logger.error("Invalid response: ", r)
-            else:
-                # the first byte of the data is the error code, the rest is the data
-                # TODO: why are the last 2 bytes dropped?
-                responses.append((r[5], r[6:-2]))
-        else:
-            # if the response does not start with 0x02, then it is invalid
-            logger.error("Invalid response: ", response_split)
-            break
-    return responses
+# whether the B1 is polling for cards itself - None until the first read decides
+polling = None
 
+# whether a card is in the field, from the asynchronous packets received while polling
+card_present = False
 
-# given an array response, return the UID of a Mifare 1k card and update the timestamp
-def get_mifare_1k_uid(response):
-    # the UID is the first 4 bytes of the data
-    response = "".join(response[1][0:4])
 
-    # if the response is in the timestamps and the time since the last scan is less than the delay, return False
-    if response in timestamps and time.time() - timestamps[response] < DELAY:
-        return False
+def start_polling():
+    """
+    Switch the B1 to autonomous polling, so it reports cards arriving and leaving with asynchronous packets - RFID-B1 manual 5.4 & 5.6.
 
-    # update the timestamp
-    timestamps[response] = time.time()
+    Returns True if the B1 is polling, or False if it didn't ACK the commands - read_card() then polls from the host instead.
+    """
+    global polling, card_present
+    polling = True
+    card_present = False
+
+    # enable the card present and card removed events, then start polling
+    responses = handle_events(
+        reader.write_memory(
+            b1.ASYNC_MASK_ADDR,
+            bytes((b1.EVENT_CARD_PRESENT | b1.EVENT_CARD_REMOVED,)),
+        )
+    )
+    if responses and responses[0][0] == b1.ACK:
+        responses = handle_events(reader.run_command(b1.RFID_START_POLLING))
 
-    # return the UID in uppercase
-    return response.upper()
+    if not responses or responses[0][0] != b1.ACK:
+        logger.warning(f"B1 did not start polling ({responses}), polling from the host")
+        polling = False
+    return polling
 
 
-# get the type of the card from the response
-def get_type(response):
-    return response[1][0]
+def handle_events(responses):
+    """
+    Update card_present from any asynchronous packets in a list of responses.
 
+    responses: list: the responses from the reader.
 
-# send a command to the NFC reader and get the response
-def send_command(data):
-    ser.write(get_command(data))
-    return get_response()
+    Returns the other (command) responses.
+    """
+    global card_present
+    other = []
+    for code, data in responses:
+        if (
+            code == b1.ASYNC_EVENT
+            and data
+            and data[0] & (b1.EVENT_CARD_PRESENT | b1.EVENT_CARD_REMOVED)
+        ):
+            # a new card can arrive in the same packet as the last one leaving
+            if data[0] & b1.EVENT_CARD_REMOVED:
+                card_present = False
+            if data[0] & b1.EVENT_CARD_PRESENT:
+                card_present = True
+        else:
+            other.append((code, data))
+    return other
 
 
-# check if the NFC device is connected
-def check_connection():
-    # dummy command to check if the device is connected - should return ACK
-    dummy = ["00"]
+def read_uid(responses, frame_time=None):
+    """
+    Get the UID of a Mifare 1k card from the responses to reader.read_uid_type().
 
-    # check if the response is the expected ACK
-    r = send_command(dummy)
+    responses: list: the responses from the reader.
+    frame_time: float: the time the frame reporting the card was received (time.monotonic()), for the tap latency metrics.
 
-    # if the response is not the expected ACK, then the NFC device is not connected (ACK is 0x00)
-    if len(r) != 1 or r[0][0] != "00" or len(r[0][1]) != 0:
-        # TODO: log NFC device not connected
+    Returns the UID, None if there is no supported card or it was scanned too soon, or False if there was an error.
+    """
+    # if no response is received yet, wait up to 1 second more for it
+    if len(responses) == 0:
+        responses = reader.receive(timeout=1)
+        if polling:
+            responses = handle_events(responses)
+
+    # if no response was received or the response was not an ACK
+    if len(responses) == 0:
+        logger.error("No response to UID read")
         return False
-    return True
+    if responses[0][0] != b1.ACK:
+        logger.error(
+            f"Error Code: {responses[0][0]:02X}\nError Data: {responses[0][1].hex()}"
+        )
+        return False
+
+    # the UID is followed by the card type
+    data = responses[0][1]
+    card_type = data[b1.UID_LEN] if len(data) > b1.UID_LEN else None
+    # if the card type is 06, then the card is a Mifare Classic 1k card
+    if card_type == b1.MIFARE_1K:
+        return get_mifare_1k_uid(responses[0], frame_time)
+
+    # if the card type is not 06, then the card is not supported
+    if card_type != b1.NO_TAG:
+        # TODO log unsupported card type
+        pass
+    # if the card type is 00, then no card was scanned
+    return None
 
 
-# full process of reading the card and returning the UID
+# full process of reading the card - returns the UID, None if there is no card (or it was scanned too soon), or False if there was an error
 def read_card():
-    # command to read the card data
-    # 01: write to rfid memory - RFID-B1 manual 5.3.2
-    # 00 01: memory address for command register - RFID-B1 manual 3.3
-    # 00 01: length of data to write (command is only 1 byte long) - RFID-B1 manual 3.3
-    # 01: command for "get uid and type" - RFID-B1 manual 5.4 (this command has no parameters, so we don't need to write to the command parameters register)
-    read_card_data = ["01", "01", "00", "01", "00", "01"]
-    # send the command to the NFC reader
-    responses = send_command(read_card_data)
+    global polling
+    metrics.count("nfc_polls")
+    if reader is None:
+        connect()
+    # try autonomous polling (if enabled) the first time a card is read
+    if polling is None:
+        if AUTONOMOUS_POLLING:
+            start_polling()
+        else:
+            polling = False
+    if polling:
+        return read_card_polling()
+    return poll_card()
+
+
+def read_card_polling():
+    """
+    Read a card while the B1 is polling - waits up to b1.RESPONSE_TIMEOUT for a card to arrive if none is present.
+
+    Returns the UID, None if there is no card or it was scanned too soon, or False if there was an error.
+    """
+    # process the asynchronous packets received since the last read - nothing is sent until there is a card
+    handle_events(reader.receive(0 if card_present else b1.RESPONSE_TIMEOUT))
+    if not card_present:
+        return None
+    frame_time = monotonic()
+
+    # read the UID and card type
+    return read_uid(handle_events(reader.read_uid_type()), frame_time)
+
+
+# process of polling for a card from the host (if the B1 can't poll itself) and returning the UID
+def poll_card():
+    # run the "get uid and type" command - RFID-B1 manual 5.4
+    responses = reader.run_command(b1.RFID_GET_UID_TYPE)
 
     # if only the command was responded to and the response is not the expected ACK, then there was an error
-    if len(responses) == 1 and responses[0][0] != "00":
+    if len(responses) == 1 and responses[0][0] != b1.ACK:
         # TODO log "Error Code:", responses[0][0]
         # TODO log "Error Data:", responses[0][1]
-        return None
+        return False
     elif len(responses) == 1:
         # if only the command was responded to and the response was an ACK, read again for the asynchronous response - RFID-B1 manual 5.4 & 4.3
         # once the command is ACKed, the NFC reader will asynchronously respond to indicate the command is complete
-        responses += get_response()
+        responses += reader.receive()
     # if the command ACK and the asynchronous response were both read, then continue
     # presumably, if the command was not ACKed, then the asynchronous response was not read
 
     if (
         len(responses)
         < 2  # if the command ACK and the asynchronous response were not both read, then there was an error
-        or responses[1][0] != "08"  # response type for asynchronous response
+        or responses[1][0] != b1.ASYNC_EVENT  # response type for asynchronous response
         or len(responses[1][1]) < 1  # asynchronous response should have 1 byte of data
         or responses[1][1][0]
-        != "20"  # asynchronous response's data byte should have the 5th bit set to indicate RFID command end - RFID-B1 manual 5.6
+        != b1.EVENT_COMMAND_END  # asynchronous response's data byte should have the 5th bit set to indicate RFID command end - RFID-B1 manual 5.6
     ):
-        logger.error("RFID Command did not end? " + str(responses))
-        return None
+        logger.error(f"RFID Command did not end? {responses}")
+        return False
 
-    # command to read the card type
-    # 02: read from rfid memory - RFID-B1 manual 5.3.3
-    # 00 1E: memory address for tag type - RFID-B1 manual 3.3
-    # 00 01: length of data to read (type is only 1 byte long) - RFID-B1 manual 3.3
-    read_type_data = ["02", "1E", "00", "01", "00"]
-    responses = send_command(read_type_data)
-
-    # if a response was received and the response was an ACK
-    if len(responses) > 0 and responses[0][0] == "00":
-        # get the card type from the response
-        card_type = get_type(responses[0])
-        # if the card type is 06, then the card is a Mifare Classic 1k card - RFID-B1 manual 3.3.5
-        if card_type == "06":
-            # command to output UID of the scanned card
-            # 02: read from rfid memory - RFID-B1 manual 5.3.3
-            # 14: memory address for tag UID - RFID-B1 manual 3.3
-            # 00 0A: length of data to read (UID saved by reader is 10 bytes long) - RFID-B1 manual 3.3
-            read_uid_data = ["02", "14", "00", "0A", "00"]
-            # send the command to the NFC reader - get responses back
-            responses = send_command(read_uid_data)
-
-            # if no response is received, try again up to 10 times, 0.1 seconds apart
-            for _ in range(10):
-                if len(responses) > 0:
-                    break
-                responses += get_response()
-                time.sleep(0.1)
-
-            # if a response was received and the response was an ACK
-            if responses[0][0] == "00":
-                # return the UID of the card
-                return get_mifare_1k_uid(responses[0])
-            else:
-                logger.error(
-                    "Error Code: "
-                    + responses[0][0]
-                    + "\nError Data: "
-                    + responses[0][1]
-                )
-                return None
-        else:
-            # if the card type is not 06, then the card is not supported
-            if card_type != "00":
-                # TODO log unsupported card type
-                pass
-            # if the card type is 00, then no card was scanned
-            return False
-    else:
-        # some error occurred in reading the card type
-        # TODO log error
-        return None
+    frame_time = monotonic()
+
+    # read the card UID and type
+    return read_uid(reader.read_uid_type(), frame_time)
+
+
+# maximum number of reads waiting in the queue - the worker waits for the queue to be read once it is full
+QUEUE_SIZE = 5
+
+# reads from the worker thread - see read_card_worker()
+results = Queue(QUEUE_SIZE)
 
+# worker thread reading cards in the background - started by the first read_card_queue_timeout() call
+worker = None
 
-# put output of read_card() in a queue - needed for timeout
-def read_card_queue(q):
-    q.put(read_card())
+# errors in a row after which the worker reopens the serial port and sets up the B1 again (ex. it was unplugged)
+RECONNECT_ERRORS = 5
+
+
+# read cards continuously and put the results in the queue (run in the worker thread)
+def read_card_worker():
+    errors = 0
+    while True:
+        try:
+            card = read_card()
+        except Exception as e:
+            logger.error(f"Error reading card: {e}")
+            card = False
+        # only queue cards and errors - None means no card (or scanned too soon)
+        if card is not None:
+            results.put(card)
+
+        errors = errors + 1 if card is False else 0
+        if card is None:
+            # no new card - wait before checking again so the worker doesn't keep the B1 (and a core) busy
+            sleep(POLL_INTERVAL)
+        elif card is False:
+            # back off a little more for each error in a row
+            sleep(ERROR_DELAY * errors)
+        if errors >= RECONNECT_ERRORS:
+            logger.warning(f"{errors} NFC reader errors in a row, reconnecting")
+            errors = 0
+            try:
+                connect()
+            except Exception as e:
+                logger.error(f"Error reconnecting NFC reader: {e}")
+
+
+# start the worker thread if it is not already running
+def start_worker():
+    global worker
+    if worker is None or not worker.is_alive():
+        worker = Thread(target=read_card_worker, daemon=True)
+        worker.start()
 
 
 def read_card_queue_timeout(time):
     """
-    Call read_card() with a timeout
+    Get the next card read by the worker thread, with a timeout
 
     time: float: the time limit in seconds
 
-    Returns None if there was an error, or passes through the return value of read_card()
+    Returns None if no card was read in time, False if there was an error, or the UID of the card
     """
-    # multiprocessing is used to place a timeout on a synchronous function
-    # a queue is used to pass the return value of the function back to the main process
-    q = Queue()  # create a queue
-    p = Process(
-        target=read_card_queue, args=(q,)
-    )  # create a process to run the function, passing the queue as an argument
-    p.start()  # start the process
-    p.join(time)  # join the process for the specified time
-    # if the process does not finish in time, the main process leaves the subprocess running "asynchronously"
-    # if the process finishes in time, the main process continues
-
-    if p.is_alive():  # if the process is still running (i.e. it did not finish in time)
-        p.terminate()  # terminate the process
-        return None  # return None
-
-    # if the process finished in time, get the return value from the queue and return it as uppercase
-    return q.get().upper()
-
-
-# clear timestamps dictionary - called whenever sheet data is refreshed
+    # a single long-lived worker thread reads cards - this only waits on its queue
+    start_worker()
+    try:
+        return results.get(timeout=time)
+    except Empty:
+        return None
+
+
+# clear the debouncer - called whenever sheet data is refreshed
 def clear_timestamps():
-    global timestamps
-    timestamps = {}
+    debouncer.clear()
 
 
 # close serial connection - necessary to not cause issues when we try to reopen the serial connection
 # this is called when the main program exits
 def close():
-    ser.close()
+    if reader is not None:
+        reader.close()
 
 
 if __name__ == "__main__":
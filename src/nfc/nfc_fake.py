@@ -1,35 +1,178 @@
-from multiprocessing import Process, Queue
+import argparse
+import csv
+import random
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic, sleep
+
+from .. import metrics
+
+# fake NFC reader - card IDs are typed into the console, or replayed from a scan trace (see replay())
+# a trace is a CSV file of "seconds since start,card ID" rows - make one with:
+# python3 -m src.nfc.nfc_fake trace.csv --rate 0.33 --duration 120 --cards 40 (a class letting out - 40 taps in 2 minutes)
+
+# scan trace to replay instead of reading the console - list of (seconds since start, card ID), set by replay()
+trace = None
+
+# replay speed - 2 replays the trace twice as fast
+speed = 1.0
+
+# reader ID of the door this backend reads for (set by backend.load()) - labels the tap latency metrics
+reader_id = None
 
 
 def read_card():
-    return input("Enter card ID: ")
+    """
+    read a card ID from the console, or None if nothing was entered
+    """
+    r = input("Enter card ID: ")
+    return r.upper() if r else None
+
+
+def load_trace(file):
+    """
+    Load a scan trace from a CSV file.
+
+    file: str: the path of the file - rows of "seconds since start,card ID" (lines starting with # are skipped).
+
+    Returns the trace as a list of (seconds, card ID) sorted by time.
+    """
+    with open(file, newline="") as f:
+        rows = [row for row in csv.reader(f) if row and not row[0].startswith("#")]
+    return sorted((float(t), uid.strip().upper()) for t, uid in rows)
+
+
+def generate(
+    rate, duration, cards=40, repeat=0.0, repeat_delay=0.5, uids=None, seed=None
+):
+    """
+    Generate a scan trace with random (Poisson) arrivals.
+
+    rate: float: average taps per second.
+    duration: float: length of the trace in seconds.
+    cards: int: number of different cards tapping (ignored if uids is given).
+    repeat: float: chance that a tap is repeated (ex. someone tapping twice because the door didn't open fast enough).
+    repeat_delay: float: time between a tap and its repeat in seconds.
+    uids: list: the card IDs to use (ex. real UIDs from the sheet, so taps get real decisions), or None for random IDs.
+    seed: int: random seed, for a reproducible trace.
+
+    Returns the trace as a list of (seconds, card ID) sorted by time.
+    """
+    rng = random.Random(seed)
+    if not uids:
+        uids = [f"{rng.getrandbits(32):08X}" for _ in range(cards)]
 
+    taps = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        uid = rng.choice(uids)
+        taps.append((t, uid))
+        if rng.random() < repeat:
+            taps.append((t + repeat_delay, uid))
+        t += rng.expovariate(rate)
+    return sorted(taps)
 
-def read_card_queue(q):
-    q.put(read_card())
+
+def replay(scans, replay_speed=1.0):
+    """
+    Replay a scan trace instead of reading card IDs from the console - must be called before the first read.
+
+    scans: str or list: the trace file, or a trace from load_trace() or generate().
+    replay_speed: float: replay speed - 2 replays the trace twice as fast, 0.5 half as fast.
+    """
+    global trace, speed
+    trace = load_trace(scans) if isinstance(scans, str) else list(scans)
+    speed = replay_speed
+
+
+# card IDs entered, read by a worker thread so input() doesn't block the caller
+results = Queue()
+
+# worker thread reading card IDs - started by the first read_card_queue_timeout() call
+worker = None
+
+
+def card(uid):
+    # a card ID arriving is both its frame and its UID (for the tap latency metrics)
+    if uid:
+        metrics.stage(uid, "frame", reader=reader_id)
+        metrics.stage(uid, "uid", reader=reader_id)
+    return uid
+
+
+def read_card_worker():
+    if trace is None:
+        while True:
+            results.put(card(read_card()))
+
+    # release each card ID at its time in the trace (scaled by the speed)
+    start = monotonic()
+    for t, uid in trace:
+        delay = start + t / speed - monotonic()
+        if delay > 0:
+            sleep(delay)
+        results.put(card(uid))
+
+
+def start_worker():
+    global worker
+    if worker is None:
+        worker = Thread(target=read_card_worker, daemon=True)
+        worker.start()
 
 
 def read_card_queue_timeout(time):
     """
-    Call read_card() with a timeout
+    Get the next card ID entered (or replayed), with a timeout
 
     time: float: the time limit in seconds
 
-    Returns None if there was an error, or passes through the return value of read_card()
+    Returns None if no card ID was entered in time, or the card ID
     """
-    q = Queue()
-    p = Process(target=read_card_queue, args=(q,))
-    p.start()
-    p.join(time)
-    if p.is_alive():
-        p.terminate()
+    start_worker()
+    try:
+        return results.get(timeout=time)
+    except Empty:
         return None
 
-    r = q.get()
-    return r if not r else r.upper()
 
 def clear_timestamps():
     pass
 
+
 def close():
     pass
+
+
+if __name__ == "__main__":
+    # generate a scan trace file
+    parser = argparse.ArgumentParser(description="Generate a scan trace for nfc_fake")
+    parser.add_argument("file", help="trace file to write")
+    parser.add_argument("--rate", type=float, default=1 / 3, help="taps per second")
+    parser.add_argument("--duration", type=float, default=120, help="seconds")
+    parser.add_argument("--cards", type=int, default=40, help="different cards")
+    parser.add_argument("--repeat", type=float, default=0.0, help="repeat chance")
+    parser.add_argument(
+        "--repeat-delay", type=float, default=0.5, help="seconds before a repeat"
+    )
+    parser.add_argument("--uids", help="file of card IDs to use, one per line")
+    parser.add_argument("--seed", type=int, help="random seed")
+    args = parser.parse_args()
+
+    uids = None
+    if args.uids:
+        with open(args.uids) as f:
+            uids = [line.strip().upper() for line in f if line.strip()]
+
+    with open(args.file, "w", newline="") as f:
+        writer = csv.writer(f)
+        for t, uid in generate(
+            args.rate,
+            args.duration,
+            args.cards,
+            args.repeat,
+            args.repeat_delay,
+            uids,
+            args.seed,
+        ):
+            writer.writerow([round(t, 3), uid])
@@ -1,66 +1,152 @@
-from multiprocessing import Process, Queue
+from queue import Empty, Queue
+from threading import Thread
+from time import monotonic, sleep
 
 import RPi.GPIO as GPIO  # type: ignore
 from mfrc522 import SimpleMFRC522  # type: ignore
 
+from .. import metrics
+
 # https://github.com/pimylifeup/MFRC522-python
 # https://www.nxp.com/docs/en/data-sheet/MFRC522.pdf
 
 # delay between reads for the same card
 DELAY = 1
 
+# time between checks for a card in seconds ("nfc_poll_interval" in common/ID.json, set by backend.load())
+POLL_INTERVAL = 0.05
+
+# reader ID of the door this backend reads for (set by backend.load()) - labels the tap latency metrics
+reader_id = None
+
 # initialize the NFC reader object and GPIO pins (pins by the library)
 reader = SimpleMFRC522()
 
+# the underlying MFRC522 - used directly to get the UID without authenticating or reading blocks
+rfid = reader.READER
 
-def read_card():
+
+def poll_card():
     """
-    read a card and return its id, or None if there was an error, or False if the card was scanned too soon
+    check once for a card and return its UID, or None if there is no card - does not block
+
+    only the request, anticollision, select and halt steps are done (no authentication or block reads)
     """
-    try:
-        # read uid and any data on the card (not used)
-        # this function will block until a card is read
-        id, _ = reader.read()
-        # convert the id to a hex string, remove the '0x' prefix, and remove the last 2 characters - extra data from the library?
-        id = hex(id)[2:-2]
-        return id.upper()
-    except:
-        # if there was an error, return None
+    metrics.count("nfc_polls")
+
+    # request: is there a card in the field?
+    status, _ = rfid.MFRC522_Request(rfid.PICC_REQIDL)
+    if status != rfid.MI_OK:
         return None
+    frame_time = monotonic()
 
+    # anticollision: get the UID - 4 bytes followed by a check byte (BCC)
+    status, uid = rfid.MFRC522_Anticoll()
+    if status != rfid.MI_OK:
+        return None
 
-def read_card_queue(q):
+    # select the card, then halt it so it stops answering idle requests (PICC_REQIDL) until it leaves the field -
+    # a card held in the field is only read once
+    rfid.MFRC522_SelectTag(uid)
+    halt()
+
+    # the UID as 2-char hex per byte (without the check byte), same as the NFC reader at the control app
+    uid = bytes(uid[:4]).hex().upper()
+    metrics.stage(uid, "frame", frame_time, reader_id)
+    metrics.stage(uid, "uid", reader=reader_id)
+    return uid
+
+
+def halt():
+    """
+    send the selected card the HALT command - the library has no method for it (ISO 14443-3 HLTA: 0x50 0x00 and a CRC)
+
+    the card doesn't answer a HALT, so there is no status to check
+    """
+    data = [rfid.PICC_HALT, 0]
+    data += rfid.CalulateCRC(data)
+    rfid.MFRC522_ToCard(rfid.PCD_TRANSCEIVE, data)
+    rfid.MFRC522_StopCrypto1()
+
+
+def read_card():
+    """
+    wait for a card and return its UID, or False if there was an error
+    """
     try:
-        q.put(read_card())
+        # check for a card every POLL_INTERVAL seconds until one is found
+        while True:
+            uid = poll_card()
+            if uid:
+                return uid
+            sleep(POLL_INTERVAL)
     except:
-        q.put(None)
+        # if there was an error, return False
+        return False
+
+
+# maximum number of reads waiting in the queue - the worker waits for the queue to be read once it is full
+QUEUE_SIZE = 5
+
+# reads from the worker thread - see read_card_worker()
+results = Queue(QUEUE_SIZE)
+
+# worker thread reading cards in the background - started by the first read_card_queue_timeout() call
+worker = None
+
+
+# errors in a row after which the worker resets the MFRC522 and sets it up again
+RESET_ERRORS = 5
+
+
+def read_card_worker():
+    """read cards continuously and put the results in the queue (run in the worker thread)"""
+    errors = 0
+    while True:
+        try:
+            card = read_card()
+        except:
+            card = False
+        results.put(card)
+
+        errors = errors + 1 if card is False else 0
+        if errors >= RESET_ERRORS:
+            errors = 0
+            try:
+                rfid.MFRC522_Init()
+            except:
+                pass
+
+
+def start_worker():
+    """start the worker thread if it is not already running"""
+    global worker
+    if worker is None or not worker.is_alive():
+        worker = Thread(target=read_card_worker, daemon=True)
+        worker.start()
 
 
 def read_card_queue_timeout(time):
     """
-    Call read_card() with a timeout
+    Get the next card read by the worker thread, with a timeout
 
     time: float: the time limit in seconds
 
-    Returns None if there was an error, or passes through the return value of read_card()
+    Returns None if no card was read in time, False if there was an error, or the UID of the card
     """
+    # a single long-lived worker thread reads cards (read_card() blocks until a card is present) - this only waits on its queue
+    start_worker()
     try:
-        q = Queue()
-        p = Process(target=read_card_queue, args=(q,))
-        p.start()
-        p.join(time)
-        if p.is_alive():
-            p.terminate()
-            return None
+        val = results.get(timeout=time)
+    except Empty:
+        return None
 
-        val = q.get()
+    return val and val.upper()
 
-        if val is None:
-            return False
 
-        return val.upper()
-    except:
-        return False
+def clear_timestamps():
+    """nothing to clear - cards are only read once per tap (they are halted, see poll_card())"""
+    pass
 
 
 def close():
@@ -0,0 +1,201 @@
+import heapq
+import logging
+from itertools import count
+from time import time
+
+logger = logging.getLogger("alarm")
+
+# alarm states
+CLOSED = "closed"  # door closed
+OPEN_GRANTED = "open_granted"  # door open within the time limit of a card scanned while it was open
+OPEN_OVERDUE = "open_overdue"  # door open past any card's time limit, but within the reader's alarm delay
+ALARM = "alarm"  # door open too long - the alarm is reported to the sheet
+TAGGED_OUT = "tagged_out"  # alarm cleared by a card while the door is still open - it trips again after the card's time limit
+
+STATES = [CLOSED, OPEN_GRANTED, OPEN_OVERDUE, ALARM, TAGGED_OUT]
+
+
+class Alarm:
+    """
+    Door alarm state machine - the door may be open for the reader's alarm delay (alarm_delay_min in the sheet),
+    or longer if a card with a time limit is scanned while it is open.
+
+    The deadlines of the current state are kept in a timer heap, so the state only changes on door changes, card scans
+    and when a deadline passes (expire()) - nothing is re-evaluated in between. Deadlines left over from an earlier
+    state are dropped lazily: each one records the generation it was set in, and any change starts a new generation.
+
+    delay: function: returns the reader's alarm delay in seconds (called whenever deadlines are set, so sheet updates apply).
+    report: function: called with the alarm status (True or False) when the alarm trips or clears.
+    door_open: bool: the door state at startup.
+    now: float: the current time (time.time()), or None for now.
+    """
+
+    def __init__(self, delay, report, door_open=False, now=None):
+        self.delay = delay
+        self.report = report
+
+        self.state = CLOSED
+        self.alarm_status = False  # True while the alarm is tripped (ALARM)
+        self.start = 0  # time the door opened, or the time of the last card scanned while it was open
+        # time limit of the last card scanned while the door was open in seconds
+        self.limit = 0
+
+        self.timers = []  # heap of (deadline, sequence, generation, state to enter)
+        self.sequence = count()  # breaks deadline ties in the order the timers were set
+        self.generation = 0
+
+        if door_open:
+            self.door(True, now)
+
+    @property
+    def door_open(self):
+        return self.state != CLOSED
+
+    def door(self, door_open, now=None):
+        """
+        Handle a door sensor change.
+
+        door_open: bool: True if the door is open.
+        now: float: the time of the change (time.time()), or None for now.
+        """
+        if now is None:
+            now = time()
+        # ignore changes that don't change the state (ex. a bounce)
+        if door_open == self.door_open:
+            return
+
+        if door_open:
+            # opening starts the reader's alarm delay - a card scanned before the door opened doesn't count
+            self.start = now
+            self.limit = 0
+            self.arm(now)
+        else:
+            self.enter(CLOSED)
+            self.set_alarm(False)
+
+    def card(self, limit, now=None):
+        """
+        Handle a card with a time limit (from sheet.scan_uid()) - holds the door open for longer, and clears the alarm.
+
+        limit: float: the card's time limit in seconds.
+        now: float: the time of the scan (time.time()), or None for now.
+        """
+        if now is None:
+            now = time()
+        if self.state == CLOSED:
+            return
+        self.start = now
+        self.limit = limit
+        tagged_out = self.alarm_status
+        self.set_alarm(False)
+        self.arm(now, tagged_out)
+
+    def rearm(self, now=None):
+        """
+        Set the deadlines again - call after the alarm delay may have changed (ex. a sheet update).
+
+        now: float: the current time (time.time()), or None for now.
+        """
+        if self.state in (OPEN_GRANTED, OPEN_OVERDUE, TAGGED_OUT):
+            self.arm(time() if now is None else now, self.state == TAGGED_OUT)
+
+    def snapshot(self):
+        """
+        Get the state, for restoring after a restart (see restore()).
+
+        Returns the state as a dict that can be written as JSON.
+        """
+        return {
+            "state": self.state,
+            "alarm_status": self.alarm_status,
+            "start": self.start,
+            "limit": self.limit,
+        }
+
+    def restore(self, data, now=None):
+        """
+        Continue from a snapshot() - if the door is still open, its timer and alarm carry on where they were,
+        otherwise the alarm clears (and is reported).
+
+        data: dict: the snapshot.
+        now: float: the current time (time.time()), or None for now.
+        """
+        if now is None:
+            now = time()
+        if not self.door_open or data["state"] == CLOSED:
+            # the door closed while the reader was down (or was closed all along)
+            self.alarm_status = data["alarm_status"]
+            self.set_alarm(False)
+            return
+
+        self.start = data["start"]
+        self.limit = data["limit"]
+        self.alarm_status = data["alarm_status"]
+        if data["state"] == ALARM:
+            self.enter(ALARM)
+        else:
+            self.arm(now, data["state"] == TAGGED_OUT)
+
+    def next_deadline(self):
+        """
+        Returns the time (time.time()) of the next deadline, or None if there is none.
+        """
+        self.drop_stale()
+        return self.timers[0][0] if self.timers else None
+
+    def expire(self, now=None):
+        """
+        Enter the states whose deadlines have passed.
+
+        now: float: the current time (time.time()), or None for now.
+        """
+        if now is None:
+            now = time()
+        self.drop_stale()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, _, state = heapq.heappop(self.timers)
+            self.state = state
+            if state == ALARM:
+                self.set_alarm(True)
+            self.drop_stale()
+
+    def arm(self, now, tagged_out=False):
+        # enter the state for the current start and limit, and set the deadlines that follow it
+        grant_end = self.start + self.limit
+        alarm_at = self.start + max(self.limit, self.delay())
+
+        if now >= alarm_at:
+            self.enter(ALARM)
+            self.set_alarm(True)
+            return
+
+        if tagged_out:
+            self.enter(TAGGED_OUT)
+        elif now < grant_end:
+            self.enter(OPEN_GRANTED)
+            if grant_end < alarm_at:
+                self.push(grant_end, OPEN_OVERDUE)
+        else:
+            self.enter(OPEN_OVERDUE)
+        self.push(alarm_at, ALARM)
+
+    def enter(self, state):
+        # change state now - deadlines of the old state no longer apply
+        self.state = state
+        self.generation += 1
+
+    def push(self, deadline, state):
+        heapq.heappush(
+            self.timers, (deadline, next(self.sequence), self.generation, state)
+        )
+
+    def drop_stale(self):
+        while self.timers and self.timers[0][2] != self.generation:
+            heapq.heappop(self.timers)
+
+    def set_alarm(self, status):
+        # report the alarm status if it changed
+        if status != self.alarm_status:
+            self.alarm_status = status
+            logger.info(f"Alarm {'triggered' if status else 'untriggered'}")
+            self.report(status)
@@ -0,0 +1,170 @@
+import importlib
+import json
+import os
+from collections import deque
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Protocol
+
+# repository root
+path = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+)
+
+# config file (or the one named by the ACCESS_CARDS_CONFIG environment variable - see sheet.py) - the "hal" key selects
+# the hardware backend (the reader runs on the Pi unless it is set to "sim")
+CONFIG_FILE = os.path.join(
+    path, os.environ.get("ACCESS_CARDS_CONFIG", "common/ID.json")
+)
+
+RECORDED_FRAMES = 1000  # frames kept per LED strip by the simulated hardware
+
+
+class Hardware(Protocol):
+    """
+    Interface to the reader's hardware - the LED strips and GPIO inputs (the door sensor).
+
+    Pins are GPIO (BCM) numbers.
+    """
+
+    def led_writer(self, pin: int) -> Callable[[bytearray], None]:
+        """Get a function that writes a frame (bytes in the LEDs' byte order) to the LED strip on a pin."""
+        ...
+
+    def setup_input(self, pin: int) -> None:
+        """Set up a pin as an input with a pull-up."""
+        ...
+
+    def read(self, pin: int) -> bool:
+        """Read an input."""
+        ...
+
+    def watch(self, pin: int, callback: Callable[[int], None], bouncetime: int) -> None:
+        """Call callback(pin) (from another thread) when an input changes - edges within bouncetime ms are ignored."""
+        ...
+
+    def cleanup(self) -> None:
+        """Release the pins - called when the program exits."""
+        ...
+
+
+class PiHardware:
+    """
+    The Raspberry Pi - LEDs are written with neopixel_write, inputs use RPi.GPIO edge detection.
+    """
+
+    def __init__(self):
+        # imported here so the reader can run on machines without them (see SimHardware)
+        try:
+            self.GPIO = importlib.import_module("RPi.GPIO")
+        except RuntimeError:
+            print(
+                "Error importing RPi.GPIO!  This is probably because you need superuser privileges.  You can achieve this by using 'sudo' to run your script"
+            )
+            raise
+        self.board = importlib.import_module("board")
+        self.digitalio = importlib.import_module("digitalio")
+        self.neopixel_write = importlib.import_module("neopixel_write").neopixel_write
+
+        self.GPIO.setmode(self.GPIO.BCM)  # set GPIO mode to BCM (GPIO numbering)
+
+    def led_writer(self, pin):
+        led_pin = self.digitalio.DigitalInOut(getattr(self.board, f"D{pin}"))
+        led_pin.direction = self.digitalio.Direction.OUTPUT
+
+        def write(frame):
+            self.neopixel_write(led_pin, frame)
+
+        return write
+
+    def setup_input(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
+
+    def read(self, pin):
+        return bool(self.GPIO.input(pin))
+
+    def watch(self, pin, callback, bouncetime):
+        self.GPIO.add_event_detect(
+            pin, self.GPIO.BOTH, callback=callback, bouncetime=bouncetime
+        )
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+class SimHardware:
+    """
+    Simulated hardware for running the reader off the Pi (ex. benchmarks and load tests) - LED frames are recorded,
+    and inputs are changed with set_input().
+    """
+
+    def __init__(self):
+        # pin -> recent (time.monotonic(), frame) written to the LED strip, and the number of frames written
+        self.frames: Dict[int, deque] = {}
+        self.frame_counts: Dict[int, int] = {}
+        self.inputs: Dict[int, bool] = {}
+        self.callbacks: Dict[int, List[Callable[[int], None]]] = {}
+
+    def led_writer(self, pin):
+        self.frames[pin] = deque(maxlen=RECORDED_FRAMES)
+        self.frame_counts[pin] = 0
+
+        def write(frame):
+            self.frames[pin].append((monotonic(), bytes(frame)))
+            self.frame_counts[pin] += 1
+
+        return write
+
+    def setup_input(self, pin):
+        # inputs start low (for the door sensor: closed)
+        self.inputs.setdefault(pin, False)
+
+    def read(self, pin):
+        return self.inputs.get(pin, False)
+
+    def watch(self, pin, callback, bouncetime):
+        self.callbacks.setdefault(pin, []).append(callback)
+
+    def set_input(self, pin, value):
+        """
+        Change an input, calling its callbacks (from the calling thread) if it changed.
+
+        pin: int: the GPIO pin.
+        value: bool: the new value.
+        """
+        if self.read(pin) == bool(value):
+            return
+        self.inputs[pin] = bool(value)
+        for callback in self.callbacks.get(pin, []):
+            callback(pin)
+
+    def cleanup(self):
+        self.callbacks.clear()
+
+
+# hardware backends, by the name used in the config file
+BACKENDS = {
+    "pi": PiHardware,
+    "sim": SimHardware,
+}
+
+
+def load(default: str = "pi", name: Optional[str] = None) -> Hardware:
+    """
+    Set up the hardware backend selected in the config file.
+
+    default: str: the backend to use if the config file doesn't select one (one of BACKENDS).
+    name: str: the backend to use, overriding the config file.
+
+    Returns the hardware.
+    """
+    try:
+        config = json.load(open(CONFIG_FILE))
+    except FileNotFoundError:
+        config = {}
+
+    name = name or config.get("hal", default)
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown hardware backend {name!r}, expected one of {list(BACKENDS)}"
+        )
+    return BACKENDS[name]()
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import resource
+
+from .. import metrics
+
+# health endpoint - http://<reader>:PORT/ returns the reader's metrics in the Prometheus text format, for the control
+# app (or Prometheus) to scrape
+PORT = 9110
+
+REQUEST_TIMEOUT = 5  # seconds to wait for a request before closing the connection
+
+
+def process_gauges():
+    """
+    Returns the memory and CPU use of this process, and the system load, as gauges.
+    """
+    gauges = {}
+    try:
+        # current resident memory (pages) - Linux only
+        with open("/proc/self/statm") as f:
+            gauges["process_resident_memory_bytes"] = int(
+                f.read().split()[1]
+            ) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    gauges["process_max_resident_memory_bytes"] = usage.ru_maxrss * 1024
+    gauges["process_cpu_seconds_total"] = usage.ru_utime + usage.ru_stime
+    gauges["system_load1"] = os.getloadavg()[0]
+    return gauges
+
+
+async def serve(gauges, port=PORT, host="0.0.0.0"):
+    """
+    Serve the metrics over HTTP until cancelled - every request gets the metrics, whatever its path.
+
+    gauges: function: returns the reader's own gauges (see metrics.exposition()).
+    port: int: the port to listen on.
+    host: str: the address to listen on.
+    """
+
+    async def handle(stream, writer):
+        try:
+            # the request itself doesn't matter - wait for the end of its headers
+            await asyncio.wait_for(stream.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+            body = metrics.exposition({**process_gauges(), **gauges()}).encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(body) + body
+            )
+            await writer.drain()
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
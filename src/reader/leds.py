@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from collections import deque
+from time import monotonic
+
+from .. import metrics
+
+logger = logging.getLogger("leds")
+
+# gamma correction table - LED brightness is not linear, so 8-bit levels are mapped through x^2.6 to look even
+GAMMA = bytes(round(255 * (i / 255) ** 2.6) for i in range(256))
+
+FLASH_TIME = 0.15  # seconds on (and off) per flash
+
+
+class LedEngine:
+    """
+    Draws the reader's LEDs in an asyncio task - breathes while idle, and shows effects (scan colors, flashes) after a scan.
+
+    Every frame is a precomputed, gamma-corrected bytearray in the LEDs' byte order, written to the strip without copying
+    and only if it differs from the frame already shown. Brightness is applied when a frame is computed, never by the
+    LED library. The task awaits an event until the next frame is due, and show()/flash() set it to start an effect
+    immediately.
+
+    write: function: writes a frame (bytearray) to the LEDs (ex. neopixel_write with the LED pin).
+    num_pixels: int: the number of LEDs.
+    order: str: the byte order of the LEDs (ex. "GRB").
+    frame_delay: float: the time between breathe frames in seconds.
+    hold: float: the time to show a scan color in seconds.
+    brightness_low: float: the brightness while breathing.
+    brightness_high: float: the brightness of scan colors and flashes.
+    """
+
+    def __init__(
+        self,
+        write,
+        num_pixels,
+        order,
+        frame_delay,
+        hold,
+        brightness_low,
+        brightness_high,
+    ):
+        self.write = write
+        self.num_pixels = num_pixels
+        self.order = order
+        self.frame_delay = frame_delay
+        self.hold = hold
+        self.brightness_low = brightness_low
+        self.brightness_high = brightness_high
+
+        # frames already computed - by color and brightness, and by content so equal frames are the same object
+        self.frames = {}
+        self.unique_frames = {}
+        self.last_frame = None  # frame on the LEDs
+
+        # breathe cycle - up from black to white and back down in steps of 5
+        self.breathe = [
+            self.frame((level, level, level), brightness_low)
+            for level in list(range(0, 255, 5)) + list(range(255, 0, -5))
+        ]
+
+        # effect state - changed by show()/flash() on the event loop, so no lock is needed
+        self.wake = None  # set to wake the task - created by run() so it belongs to the running loop
+        self.effect = None  # deque of (frame, seconds) left to show, or None to breathe
+        self.effect_until = 0  # time the current effect frame ends
+        self.on_shown = None  # called once the first frame of the effect is on the LEDs
+
+    def frame(self, color, brightness):
+        """
+        Get the frame for a color on every LED.
+
+        color: tuple: the RGB color.
+        brightness: float: the brightness (0-1).
+
+        Returns the frame as a bytearray - the same object for the same frame, so frames can be compared by identity.
+        """
+        key = (color, brightness)
+        if key not in self.frames:
+            # gamma first so the brightness keeps the same peak as linear scaling
+            rgb = dict(zip("RGB", (round(GAMMA[c] * brightness) for c in color)))
+            frame = bytearray(bytes(rgb[c] for c in self.order) * self.num_pixels)
+            self.frames[key] = self.unique_frames.setdefault(bytes(frame), frame)
+        return self.frames[key]
+
+    def fill(self, color, brightness):
+        """
+        Draw a color on every LED now (when the task isn't running - ex. the error color and "off" at exit).
+
+        color: tuple: the RGB color.
+        brightness: float: the brightness (0-1).
+        """
+        self.draw(self.frame(color, brightness))
+
+    def play(self, frames, on_shown=None):
+        """
+        Show a sequence of frames, then go back to breathing.
+
+        frames: list: (frame, seconds) pairs.
+        on_shown: function: called (from the LED task) once the first frame is on the LEDs.
+        """
+        self.effect = deque(frames)
+        self.effect_until = 0
+        self.on_shown = on_shown
+        if self.wake:
+            self.wake.set()
+
+    def show(self, color, on_shown=None):
+        """
+        Show a scan color for hold seconds, then go back to breathing.
+
+        color: tuple: the RGB color.
+        on_shown: function: called (from the LED task) once the color is on the LEDs.
+        """
+        self.play([(self.frame(color, self.brightness_high), self.hold)], on_shown)
+
+    def flash(self, color, times=3, on_shown=None):
+        """
+        Flash a color (ex. no access), then go back to breathing.
+
+        color: tuple: the RGB color.
+        times: int: the number of flashes.
+        on_shown: function: called (from the LED task) once the first flash is on the LEDs.
+        """
+        on = self.frame(color, self.brightness_high)
+        off = self.frame((0, 0, 0), self.brightness_high)
+        self.play([(on, FLASH_TIME), (off, FLASH_TIME)] * times, on_shown)
+
+    async def run(self):
+        """
+        Draw frames until cancelled - run as a task on the event loop.
+        """
+        self.wake = asyncio.Event()
+        step = 0  # index in breathe of the next breathe frame
+        next_frame = monotonic()  # time the next breathe frame is due
+
+        while True:
+            now = monotonic()
+            frame = None
+            on_shown = None
+
+            # next frame of the effect, if the current one has ended
+            if self.effect is not None and now >= self.effect_until:
+                if self.effect:
+                    frame, seconds = self.effect.popleft()
+                    self.effect_until = now + seconds
+                    on_shown, self.on_shown = self.on_shown, None
+                else:
+                    # effect finished - breathe from the start again
+                    self.effect = None
+                    step = 0
+                    next_frame = now
+
+            if self.effect is not None:
+                wake = self.effect_until
+            else:
+                if now >= next_frame:
+                    frame = self.breathe[step]
+                    step = (step + 1) % len(self.breathe)
+                    # keep to the schedule, but don't try to catch up on missed frames
+                    next_frame = max(next_frame + self.frame_delay, now)
+                wake = next_frame
+
+            if frame is not None:
+                try:
+                    self.draw(frame)
+                    if on_shown:
+                        on_shown()
+                except Exception as e:
+                    logger.error(f"Error: {e}")
+
+            # wait until the next frame is due, or until an effect wakes the task
+            # (nothing else runs between the checks above and clear(), so no wake-up is lost)
+            timeout = wake - monotonic()
+            if timeout > 0:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    def draw(self, frame):
+        # skip a frame that is already on the LEDs (equal frames are the same object - see frame())
+        if frame is self.last_frame:
+            return
+        start = monotonic()
+        self.write(frame)
+        metrics.timing("led_frame", monotonic() - start)
+        self.last_frame = frame
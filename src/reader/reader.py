@@ -1,21 +1,18 @@
+import asyncio
 import logging
 import os
-from datetime import datetime, timedelta
-from threading import Thread
-from time import sleep, time
-
-import board  # type: ignore
-import neopixel  # type: ignore
-
-try:
-    import RPi.GPIO as GPIO  # type: ignore
-except RuntimeError:
-    print(
-        "Error importing RPi.GPIO!  This is probably because you need superuser privileges.  You can achieve this by using 'sudo' to run your script"
-    )
-
-from .. import sheet
-from ..nfc import nfc_reader as nfc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from time import monotonic, sleep, time
+
+from .. import metrics, sheet, supervisor
+from ..supervisor import supervise
+from ..nfc import backend
+from ..nfc.debounce import Debouncer
+from . import hal, health, state
+from .alarm import Alarm
+from .leds import LedEngine
 
 # Change directory to repository root
 path = os.path.abspath(
@@ -51,273 +48,482 @@ logger.addHandler(ch)
 
 SHEET_UPDATE_HOUR = 4  # pull new data from sheet at 4am
 CHECKIN_TIMEOUT = 30  # check in every 30 seconds
+REFRESH_CHECK = 60  # seconds between checks for whether the daily sheet update is due
+LOOP_PROBE = 1  # seconds between measurements of the event loop's delay
+SHEET_BACKOFF_MAX = 300  # longest wait in seconds before retrying the sheet after errors (other tasks wait at most 60)
+NFC_BACKOFF_MAX = 5  # longest wait in seconds before reading cards again after NFC reader errors - taps wait meanwhile
 
 SCAN_COLOR_HOLD = 2  # seconds to hold color after scan
+# seconds a card must be away from the reader before it counts as a new scan
+SCAN_DEBOUNCE = 5
 BREATHE_DELAY = 0.05  # seconds to wait between LED brightness changes
 BRIGHTNESS_LOW = 0.2  # low brightness while breathing LEDs
 BRIGHTNESS_HIGH = 0.5  # high brightness while holding color
 
-DOOR_SENSOR_PIN = 16  # GPIO pin for door sensor
-DOOR_SENSOR_DEBOUNCE = 0.5  # seconds to debounce door sensor
+# GPIO pin for door sensor (of the reader's only door - see Channel)
+DOOR_SENSOR_PIN = 16
+DOOR_SENSOR_BOUNCETIME = 500  # milliseconds to debounce door sensor edges
 
-breathe = True  # breathe LEDs when no card is scanned
-scan_time = None  # time of last scan to hold color
-EXIT = False  # exit flag
-alarm_status = False  # True if alarm is triggered - reported back to sheet
-door_open = False  # True if door is open
-door_change_time = time()  # time of last door state change
-door_time_limit = 0  # time limit for door open before alarm based on card scan
+# LEDs and door sensors - the Pi's, or simulated if common/ID.json sets "hal" to "sim" (see hal.py)
+hardware = hal.load("pi")
 
 num_pixels = 30  # 30 LEDs
-pixel_pin = board.D18  # LEDs are on GPIO pin 18
-ORDER = neopixel.GRB  # RGB color order
-pixels = neopixel.NeoPixel(
-    pixel_pin,
-    num_pixels,
-    brightness=BRIGHTNESS_LOW,
-    auto_write=False,
-    pixel_order=ORDER,
-)  # initialize LEDs
-GPIO.setmode(GPIO.BCM)  # set GPIO mode to BCM (GPIO numbering)
-
-
-# thread to breathe LEDs in background
-def breathe_leds():
-    global breathe, scan_time, EXIT
-    # try except for clean exit on keyboard interrupt
-    try:
-        # time of last brightness change
-        last_change_time = 0
-
-        # loop until exit flag is set
-        while not EXIT:
-            # try except to handle errors and continue
-            try:
-                # if breathe flag is set (no card scanned)
-                if breathe:
-                    # increase "brightness" in steps of 5
-                    for i in range(0, 255, 5):
-                        # wait for BREATHE_DELAY seconds
-                        while time() - last_change_time < BREATHE_DELAY:
-                            # if breathe flag is unset, break loop
-                            if not breathe:
-                                break
-
-                        # if breathe flag is unset, break loop
-                        if not breathe:
-                            break
-
-                        # update last change time
-                        last_change_time = time()
-
-                        # set all LEDs to i (gradient from black to white)
-                        pixels.fill((i, i, i))
-
-                        # write pixel values to LEDs
-                        pixels.show()
-
-                    # decrease "brightness" in steps of 5
-                    for i in range(255, 0, -5):
-                        # wait for BREATHE_DELAY seconds
-                        while time() - last_change_time < BREATHE_DELAY:
-                            # if breathe flag is unset, break loop
-                            if not breathe:
-                                break
-
-                        # if breathe flag is unset, break loop
-                        if not breathe:
-                            break
-
-                        # update last change time
-                        last_change_time = time()
-
-                        # set all LEDs to i (gradient from white to black)
-                        pixels.fill((i, i, i))
-
-                        # write pixel values to LEDs
-                        pixels.show()
-                elif scan_time and datetime.now() - scan_time > timedelta(
-                    0, SCAN_COLOR_HOLD, 0, 0, 0, 0, 0
-                ):  # if scan time is set (a card was scanned) and SCAN_COLOR_HOLD seconds have passed
-
-                    # reenable breathe flag
-                    breathe = True
-
-                    # clear scan time
-                    scan_time = None
-
-                    # set LED brightness back to low
-                    pixels.brightness = BRIGHTNESS_LOW
-            except Exception as e:  # catch any exceptions
-                # if exception is KeyboardInterrupt, raise it to exit cleanly
-                if type(e) == KeyboardInterrupt:
-                    raise e
-                # otherwise, print error and sleep for 60 seconds to prevent spamming
-                logger.error(f"Error: {e}")
-                sleep(60)
-    except KeyboardInterrupt:
-        # set exit flag to True - this will exit the main loop and cause the end of this thread
-        EXIT = True
+PIXEL_PIN = 18  # LEDs are on GPIO pin 18 (of the reader's only door - see Channel)
+ORDER = "GRB"  # byte order of the LEDs
+
+NO_ACCESS_COLOR = (255, 0, 0)  # flashed when a card has no access
+
+
+# record that the scan color for a card is on the LEDs of a door - the end of a tap
+def led_shown(card_id, reader_id):
+    metrics.stage(card_id, "led", reader=reader_id)
+    metrics.finish(card_id, reader_id)
+
+
+class Channel:
+    """
+    One door of the reader - its NFC reader, door sensor, LED strip, alarm and debouncing, with its own reader ID in the sheet.
+
+    Each door runs its own tasks:
+
+    - NFC input: waits for cards in a thread of the NFC executor (one per door) and puts them in the cards queue.
+    - scans: debounces cards, looks them up in the sheet data (local) and shows the result on the LEDs.
+    - door events: the door sensor's edge callback puts door changes in the doors queue.
+    - alarm timer: waits for the next deadline of the alarm state machine (see alarm.py).
+    - LED rendering: the LedEngine task.
+
+    config: dict: the door's settings from the "channels" list in common/ID.json, or None for the reader's only door
+    (reader ID "id", the NFC backend set in ID.json, the door sensor on DOOR_SENSOR_PIN and the LEDs on PIXEL_PIN).
+    """
+
+    def __init__(self, config=None):
+        if config is None:
+            self.id = sheet.reader_id
+            # NFC reader - the MFRC522 unless common/ID.json selects another backend
+            self.nfc = backend.load("mfrc522")
+            config = {}
+        else:
+            self.id = config["id"]
+            # each door has its own copy of its NFC backend, so several can run at once
+            self.nfc = backend.load("mfrc522", config=config, separate=True)
+
+        self.door_pin = config.get("door_pin", DOOR_SENSOR_PIN)
+
+        # draws the LEDs in an asyncio task - breathes while idle and shows the scan color after a scan
+        # frames are written straight to the LED pin (the NeoPixel library's brightness scaling and buffer copies are skipped)
+        self.leds = LedEngine(
+            hardware.led_writer(config.get("led_pin", PIXEL_PIN)),
+            config.get("num_pixels", num_pixels),
+            ORDER,
+            BREATHE_DELAY,
+            SCAN_COLOR_HOLD,
+            BRIGHTNESS_LOW,
+            BRIGHTNESS_HIGH,
+        )
+
+        # recently scanned card IDs - debouncing to prevent multiple scans
+        self.debouncer = Debouncer(SCAN_DEBOUNCE)
+
+    def attach(self, app):
+        """
+        Set up the door's queues and alarm on the running event loop.
+
+        app: Reader: the reader running the door.
+        """
+        self.app = app
+        self.cards = asyncio.Queue()  # card IDs read
+        self.doors = asyncio.Queue()  # (open, time) door sensor changes
+
+        # door alarm - trips and clears are reported back to the sheet
+        self.alarm = Alarm(
+            lambda: sheet.reader_info[self.id]["alarm_delay_min"] * 60,
+            self.report_alarm,
+            hardware.read(self.door_pin),
+        )
+        # set when the alarm's deadlines may have changed
+        self.alarm_changed = asyncio.Event()
+
+    def tasks(self):
+        """
+        Returns the door's tasks (coroutines) - see Channel.
+        """
+        # door sensor changes are edge-triggered - the callback (run in another thread) hands them to the loop
+        hardware.watch(self.door_pin, self.door_changed, DOOR_SENSOR_BOUNCETIME)
+        return [
+            supervise(f"leds.{self.id}", self.leds.run),
+            supervise(f"nfc.{self.id}", self.read_card, maximum=NFC_BACKOFF_MAX),
+            supervise(f"scan.{self.id}", self.scan),
+            supervise(f"door.{self.id}", self.door_event),
+            supervise(f"alarm.{self.id}", self.alarm_timer),
+        ]
+
+    async def read_card(self):
+        # wait for a card in a worker thread so the loop keeps running - the NFC executor has a thread per door, so
+        # waiting doors never hold up the sheet and checkpoint tasks' threads (or each other)
+        card_id = await self.app.loop.run_in_executor(
+            self.app.nfc_executor, self.nfc.read_card_queue_timeout, 1
+        )
+        if card_id is False:
+            # a read error - only this door's NFC task backs off (the backend reopens its device after repeated errors)
+            raise RuntimeError(f"NFC reader error (reader {self.id})")
+        elif card_id:
+            await self.cards.put(card_id)
+
+    async def scan(self):
+        card_id = await self.cards.get()
+
+        # if card ID was scanned in the last SCAN_DEBOUNCE seconds - not a new scan
+        self.app.state_changed.set()
+        if not self.debouncer.check(card_id):
+            metrics.discard(card_id, self.id)
+            return
+        metrics.stage(card_id, "debounce", reader=self.id)
+
+        # scan card ID in sheet - returns color and alarm timeout (local, so it doesn't block the loop)
+        response = sheet.scan_uid(card_id, id=self.id)
+        metrics.stage(card_id, "decision", reader=self.id)
+
+        # if response is not a color/alarm timeout tuple
+        if not response:
+            # print an error - likely caused by the card being in the database but not having a color for this room
+            logger.error("error - card not in database or something else")
+            # flash the no access color
+            self.leds.flash(
+                NO_ACCESS_COLOR, on_shown=partial(led_shown, card_id, self.id)
+            )
+            return
+
+        # unpack color and timeout from response
+        color, timeout = response
+
+        # convert color from hex to RGB tuple
+        colors = tuple([int(color[i : i + 2], 16) for i in range(0, len(color), 2)])
+
+        # show the color on the LEDs for SCAN_COLOR_HOLD seconds (wakes the LED task immediately)
+        self.leds.show(colors, partial(led_shown, card_id, self.id))
+
+        if timeout:
+            # hold the door open for longer (and clear the alarm)
+            logger.info(f"Door time limit set to {timeout * 60}s (reader {self.id})")
+            self.alarm.card(timeout * 60)
+            self.alarm_changed.set()
+
+    def door_changed(self, channel):
+        # door sensor edge callback - runs in another thread (ex. RPi.GPIO's), so hand the new state to the loop
+        self.app.loop.call_soon_threadsafe(
+            self.doors.put_nowait, (hardware.read(channel), time())
+        )
+        # edges are dropped for DOOR_SENSOR_BOUNCETIME after this one, so the read above may have caught the contact
+        # mid-bounce - read the pin again once the bounce time has passed, so a wrong read doesn't stand until the next edge
+        self.app.loop.call_soon_threadsafe(
+            self.app.loop.call_later, DOOR_SENSOR_BOUNCETIME / 1000, self.read_door
+        )
+
+    def read_door(self):
+        # queue the door sensor's state as it is now
+        self.doors.put_nowait((hardware.read(self.door_pin), time()))
+
+    async def door_event(self):
+        input_state, change_time = await self.doors.get()
+
+        # ignore edges that don't change the state (ex. a bounce)
+        if input_state == self.alarm.door_open:
+            return
+        logger.info(f"Door {'opened' if input_state else 'closed'} (reader {self.id})")
+        self.alarm.door(input_state, change_time)
+        self.alarm_changed.set()
+        self.app.state_changed.set()
+
+    async def alarm_timer(self):
+        # wait for the alarm's next deadline (or a change to its deadlines), then enter the states that are due
+        deadline = self.alarm.next_deadline()
+        timeout = None if deadline is None else max(deadline - time(), 0)
+        self.alarm_changed.clear()
+        try:
+            await asyncio.wait_for(self.alarm_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        before = self.alarm.state
+        self.alarm.expire()
+        if self.alarm.state != before:
+            self.app.state_changed.set()
+
+    def report_alarm(self, alarm_status):
+        # alarm tripped or cleared (logged by the alarm) - queue a check-in to report it
+        self.app.check_in()
+
+    def rearm(self):
+        # the alarm delay may have changed
+        self.alarm.rearm()
+        self.alarm_changed.set()
+
+    def gauges(self):
+        # the door's state, for the health endpoint
+        return {
+            f'alarm{{reader="{self.id}"}}': self.alarm.alarm_status,
+            f'door_open{{reader="{self.id}"}}': self.alarm.door_open,
+            f'debounce_cards{{reader="{self.id}"}}': len(self.debouncer),
+        }
+
+    def snapshot(self):
+        # the state to save - see state.py
+        return {"alarm": self.alarm.snapshot(), "debounce": self.debouncer.snapshot()}
+
+    def restore(self, data, elapsed):
+        # carry on from a snapshot() taken elapsed seconds ago
+        self.alarm.restore(data["alarm"])
+        self.debouncer.restore(data["debounce"], elapsed)
+
+
+def load_channels():
+    """
+    Set up the doors listed in "channels" in common/ID.json, or the reader's only door if there is no list.
+
+    Returns a list of Channel.
+    """
+    configs = sheet.reader_file.get("channels")
+    if not configs:
+        return [Channel()]
+    return [Channel(config) for config in configs]
+
+
+class Reader:
+    """
+    The reader as an asyncio application - the tasks of each door (see Channel), and tasks shared by the doors,
+    all communicating over queues:
+
+    - check-in and data refresh: put requests in the sheet queue every CHECKIN_TIMEOUT seconds and once a day.
+    - sheet: runs the sheet requests one at a time in a worker thread (the Google API client isn't thread-safe),
+      so a slow or failing request never holds up a tap. All doors share the sheet data and check in together.
+    - health: serves the reader's metrics over HTTP (see health.py), measures the event loop's delay, and writes the
+      tap latency histograms every metrics.DUMP_INTERVAL seconds.
+    - checkpoint: saves the alarms, door timers and debouncing when they change (see state.py), so a restarted reader
+      carries on where it was.
+
+    Each task is supervised on its own (see supervisor.py) - an error only makes that task back off and retry.
+    The doors' state (alarms, debouncing, queues) is only changed on the event loop, so it needs no locks. The sheet data
+    is the exception - it is downloaded in the sheet worker thread and swapped in under sheet.data_lock, which card
+    lookups hold too, so a tap during a refresh sees either the old data or the new data.
+
+    channels: list: the doors (Channel).
+    restored: bool: True if the sheet data was restored from its last save rather than downloaded.
+    """
+
+    def __init__(self, channels, restored=False):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()  # set to exit
+
+        self.sheet_requests = asyncio.Queue()  # "check_in" or "refresh"
+        # requests in the queue - so they don't pile up while the sheet is down
+        self.pending_requests = set()
+        self.state_changed = asyncio.Event()  # set when there is state to save
+
+        # threads waiting for cards - one per door (see Channel.read_card())
+        self.nfc_executor = ThreadPoolExecutor(len(channels), "nfc")
+
+        self.channels = channels
+        for channel in channels:
+            channel.attach(self)
+
+        # carry on from the state saved before a restart
+        saved = state.load_json(state.STATE_FILE)
+        if saved:
+            for channel in channels:
+                try:
+                    data = saved["channels"].get(str(channel.id))
+                    if data:
+                        channel.restore(data, time() - saved["saved"])
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.error(f"Error restoring state: {e}")
+
+        # update time of the sheet data last saved
+        self.saved_sheet_time = sheet.last_update_time if restored else None
+        if restored:
+            # the sheet data is from before the restart - report in without holding up taps
+            self.check_in()
+
+    async def run(self):
+        """
+        Run every task until stop() is called.
+        """
+        tasks = [
+            asyncio.create_task(coro)
+            for coro in [c for channel in self.channels for c in channel.tasks()]
+            + [
+                supervise("sheet", self.sheet_request, maximum=SHEET_BACKOFF_MAX),
+                supervise("check_in", self.every(CHECKIN_TIMEOUT, self.check_in)),
+                supervise("refresh", self.every(REFRESH_CHECK, self.refresh)),
+                supervise("health", partial(health.serve, self.gauges)),
+                supervise("loop", self.measure_loop),
+                supervise("metrics", self.dump_metrics),
+                supervise("checkpoint", self.checkpoint),
+            ]
+        ]
+        try:
+            await self.stopped.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # waits in progress end within their timeout
+            self.nfc_executor.shutdown(wait=False)
+            state.write_json(state.STATE_FILE, self.snapshot())
+            metrics.dump()
+
+    def stop(self):
+        self.stopped.set()
+
+    def every(self, seconds, step):
+        # a task step that runs step every few seconds
+        async def wait_and_step():
+            await asyncio.sleep(seconds)
+            step()
+
+        return wait_and_step
+
+    def request(self, request):
+        # queue a sheet request, unless the same request is already waiting
+        if request not in self.pending_requests:
+            self.pending_requests.add(request)
+            self.sheet_requests.put_nowait(request)
+
+    def check_in(self):
+        # queue a check-in (reports the alarm statuses)
+        self.request("check_in")
+
+    def refresh(self):
+        # queue a sheet update if sheet data is older than today and it is past SHEET_UPDATE_HOUR
+        if (
+            not sheet.last_update_time
+            or datetime.now().date() > sheet.last_update_time.date()
+        ) and datetime.now().hour >= SHEET_UPDATE_HOUR:
+            self.request("refresh")
+
+    async def measure_loop(self):
+        # how late a sleep wakes up - the time tasks wait for the loop when something holds it up
+        start = monotonic()
+        await asyncio.sleep(LOOP_PROBE)
+        metrics.timing("loop_delay", max(monotonic() - start - LOOP_PROBE, 0))
+
+    async def dump_metrics(self):
+        # write the tap latency histograms - on a timer, so the last taps are written even if no more come
+        await asyncio.sleep(metrics.DUMP_INTERVAL)
+        await asyncio.to_thread(metrics.dump)
+
+    def gauges(self):
+        # the reader's state and the supervisor's error counts, for the health endpoint
+        now = datetime.now()
+        gauges = {
+            "sheet_requests_pending": self.sheet_requests.qsize(),
+            "snapshot_age_seconds": sheet.last_update_time
+            and (now - sheet.last_update_time).total_seconds(),
+            "checkin_age_seconds": sheet.last_checkin_time
+            and (now - sheet.last_checkin_time).total_seconds(),
+        }
+        for channel in self.channels:
+            gauges.update(channel.gauges())
+        for name, status in supervisor.status().items():
+            gauges[f'errors_total{{subsystem="{name}"}}'] = status["errors"]
+            gauges[f'backoff_seconds{{subsystem="{name}"}}'] = status["retry_in"]
+        return gauges
+
+    async def sheet_request(self):
+        request = await self.sheet_requests.get()
+        self.pending_requests.discard(request)
+
+        if request == "refresh":
+            # update sheet data - the check-in below also reports the new data was pulled
+            logger.info("Updating sheet...")
+            start = monotonic()
+            updated = await asyncio.to_thread(sheet.get_sheet_data)
+            metrics.timing("sheet_refresh", monotonic() - start)
+            if not updated:
+                # try again once the sheet task has backed off
+                self.request(request)
+                raise RuntimeError("Sheet update failed")
+        else:
+            logger.info("Checking in...")
+
+        # report the alarm statuses as they are now, not as they were when the request was queued - all doors at once
+        start = monotonic()
+        checked_in = await asyncio.to_thread(
+            sheet.check_in,
+            alarm_statuses={
+                channel.id: channel.alarm.alarm_status for channel in self.channels
+            },
+        )
+        metrics.timing("sheet_check_in", monotonic() - start)
+        if not checked_in:
+            # the alarm statuses weren't reported - try again once the sheet task has backed off
+            self.check_in()
+            raise RuntimeError("Sheet check-in failed")
+
+        # the alarm delays may have changed
+        for channel in self.channels:
+            channel.rearm()
+
+        # save new sheet data (a check-in can update it too) - done here so it can't change while it is saved
+        if sheet.last_update_time != self.saved_sheet_time:
+            await asyncio.to_thread(state.save_sheet, sheet)
+            self.saved_sheet_time = sheet.last_update_time
+
+    def snapshot(self):
+        # the state to save - see state.py
+        return {
+            "saved": time(),
+            "channels": {channel.id: channel.snapshot() for channel in self.channels},
+        }
+
+    async def checkpoint(self):
+        # save the state when it changes - at most every SAVE_INTERVAL seconds, to spare the SD card
+        await self.state_changed.wait()
+        self.state_changed.clear()
+        await asyncio.to_thread(state.write_json, state.STATE_FILE, self.snapshot())
+        await asyncio.sleep(state.SAVE_INTERVAL)
+
+
+async def main(channels, restored=False):
+    reader = Reader(channels, restored)
+    await reader.run()
 
 
 if __name__ == "__main__":
+    # the doors this reader drives
+    channels = load_channels()
+
     # try except for red error LED on exception
     try:
-        # get sheet data and check in
-        sheet.get_sheet_data(limited=True)
-        sheet.check_in(alarm_status=alarm_status)
-
-        # start breathe LEDs thread
-        Thread(target=breathe_leds).start()
+        # use the sheet data saved before a restart if there is some, so taps are served right away
+        restored = state.load_sheet(sheet)
+        if not restored:
+            # get sheet data and check in
+            sheet.get_sheet_data(limited=True)
+            sheet.check_in(alarm_statuses={channel.id: False for channel in channels})
+        started = True
     except Exception as e:
-        # print error, set red LEDs, sleep for 5 seconds, and set exit flag
+        # print error, set red LEDs, sleep for 5 seconds, and exit
         logger.error(e)
-        pixels.fill((255, 0, 0))
-        pixels.show()
+        for channel in channels:
+            channel.leds.fill((255, 0, 0), BRIGHTNESS_HIGH)
         sleep(5)
-        EXIT = True
+        started = False
 
-    GPIO.setup(DOOR_SENSOR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    for channel in channels:
+        hardware.setup_input(channel.door_pin)
 
     # try except for clean exit on keyboard interrupt
     try:
-        # list of last 5 card IDs scanned - debouncing to prevent multiple scans
-        last_ids = [None] * 5
-
-        # loop until exit flag is set
-        while not EXIT:
-            # try except to handle errors and continue
-            try:
-                # if sheet has never been updated or sheet data is older than today and it is past SHEET_UPDATE_HOUR
-                if (
-                    not sheet.last_update_time
-                    or datetime.now().date() > sheet.last_update_time.date()
-                ) and datetime.now().hour >= SHEET_UPDATE_HOUR:
-                    # update sheet data and check in
-                    logger.info("Updating sheet...")
-                    sheet.get_sheet_data()
-                    sheet.check_in(alarm_status=alarm_status)
-                elif not sheet.last_checkin_time or datetime.now() - sheet.last_checkin_time > timedelta(
-                    0, CHECKIN_TIMEOUT, 0, 0, 0, 0, 0
-                ):  # if last checkin time is not set or it has been CHECKIN_TIMEOUT seconds since last checkin
-                    # check in
-                    logger.info("Checking in...")
-                    sheet.check_in(alarm_status=alarm_status)
-
-                # read card ID from NFC reader with a timeout of 1 second
-                # print("Hold a tag near the reader")
-                card_id = nfc.read_card_queue_timeout(1)
-                # print(card_id)
-                # if card ID is not None and it is not in the last 5 IDs scanned - a new card has been scanned
-                if card_id and card_id not in last_ids:
-                    # add card ID to last IDs scanned and remove the oldest one
-                    last_ids.append(card_id)
-                    last_ids.pop(0)
-
-                    # scan card ID in sheet - returns color and alarm timeout
-                    response = sheet.scan_uid(card_id)
-
-                    # if response is not a color/alarm timeout tuple
-                    if not response:
-                        # print an error - likely caused by the card being in the database but not having a color for this room
-                        logger.error("error - card not in database or something else")
-                        # TODO: flash no access color or some other unique indication
-                        pass
-                    else:  # a response was received
-                        # unpack color and timeout from response
-                        color, timeout = response
-
-                        # print color and timeout for debugging
-                        # print(color, timeout)
-
-                        # convert color from hex to RGB tuple
-                        colors = tuple(
-                            [int(color[i : i + 2], 16) for i in range(0, len(color), 2)]
-                        )
-
-                        # print colors for debugging
-                        # print(colors)
-
-                        # stop breathing LEDs, set scan time, and sleep to give the breathing thread time to stop
-                        breathe = False
-                        scan_time = datetime.now()
-                        sleep(BREATHE_DELAY * 2)
-
-                        # set LED brightness to high, fill LEDs with color, and show LEDs
-                        pixels.brightness = BRIGHTNESS_HIGH
-                        pixels.fill(colors)
-                        pixels.show()
-
-                        if timeout:
-                            door_change_time = time()
-                            door_time_limit = timeout * 60
-                            print("Door time limit set to", door_time_limit)
-
-                            if alarm_status:
-                                alarm_status = False
-                                sheet.check_in(alarm_status=alarm_status)
-                                print("Alarm untriggered")
-
-                elif card_id is None:  # scanned too soon or no card scanned
-                    # add None to last IDs scanned and remove the oldest one (if we didn't do this, the same person could never scan twice in a row, even if they waited a long time)
-                    last_ids.append(None)
-                    last_ids.pop(0)
-                elif card_id is False:  # some error occurred, exit loop
-                    EXIT = True
-
-                # check if door sensor is open
-                input_state = bool(GPIO.input(DOOR_SENSOR_PIN))
-                if (
-                    input_state != door_open
-                    and time() - door_change_time > DOOR_SENSOR_DEBOUNCE
-                ):
-                    door_open = input_state
-                    door_change_time = time()
-                    door_time_limit = 0
-                    print(door_open)
-
-                    if not door_open and alarm_status:
-                        alarm_status = False
-                        sheet.check_in(alarm_status=alarm_status)
-                        print("Alarm untriggered")
-
-                if (
-                    door_open
-                    and not alarm_status
-                    and time() - door_change_time > door_time_limit
-                    and time() - door_change_time
-                    > sheet.this_reader["alarm_delay_min"] * 60
-                ):
-                    door_time_limit = 0
-                    alarm_status = True
-                    sheet.check_in(alarm_status=alarm_status)
-                    print("Alarm triggered")
-
-            except Exception as e:  # catch any exceptions
-                # if exception is KeyboardInterrupt, raise it to exit cleanly
-                if type(e) == KeyboardInterrupt:
-                    raise e
-
-                # otherwise, print error and sleep for 60 seconds to prevent spamming
-                logger.error(f"Error: {e}")
-                sleep(60)
-
-    except KeyboardInterrupt:  # if KeyboardInterrupt is raised, set exit flag to True
-        EXIT = True
-
-    # if here, exit flag is set so breathing should stop
-    if breathe:
-        breathe = False
-
-    # wait until breathing thread has stopped
-    sleep(BREATHE_DELAY * 2)
-
-    # set LEDs to black and show them - this is the "off" state
-    pixels.fill((0, 0, 0))
-    pixels.show()
-
-    # close NFC reader - needed to prevent errors on next run
-    nfc.close()
+        if started:
+            asyncio.run(main(channels, restored))
+    except KeyboardInterrupt:
+        pass
+
+    for channel in channels:
+        # set LEDs to black - this is the "off" state
+        channel.leds.fill((0, 0, 0), BRIGHTNESS_LOW)
+
+        # close NFC reader - needed to prevent errors on next run
+        channel.nfc.close()
 
     # cleanup GPIO
-    GPIO.cleanup()
+    hardware.cleanup()
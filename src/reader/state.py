@@ -0,0 +1,75 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+# repository root
+path = os.path.abspath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+)
+
+# reader runtime state, restored at startup so a restarted reader serves taps right away
+# (mount a tmpfs here to spare the SD card - the state then survives crashes and restarts, but not reboots)
+STATE_DIR = path + "/data/reader"
+STATE_FILE = (
+    STATE_DIR + "/state.json"
+)  # alarm, door timer and debouncing - small, saved often
+SHEET_FILE = STATE_DIR + "/sheet.json"  # sheet data - saved after each sheet update
+
+SAVE_INTERVAL = 5  # seconds between saves of the state, at most
+SHEET_MAX_AGE_HOURS = 24  # sheet data older than this is downloaded again at startup
+
+
+# write a json file atomically - a crash mid-write leaves the previous file intact
+def write_json(file, data):
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    with open(file + ".tmp", "w") as f:
+        json.dump(data, f)
+    os.replace(file + ".tmp", file)
+
+
+# load a json file, or None if there isn't one (or it is unreadable)
+def load_json(file):
+    try:
+        return json.load(open(file))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def load_sheet(sheet):
+    """
+    Restore the sheet data saved by save_sheet(), if it isn't too old.
+
+    sheet: module: the sheet module.
+
+    Returns True if the data was restored, or False if it has to be downloaded.
+    """
+    data = load_json(SHEET_FILE)
+    if not data or not data.get("last_update_time"):
+        return False
+    if datetime.now() - datetime.fromisoformat(data["last_update_time"]) > timedelta(
+        hours=SHEET_MAX_AGE_HOURS
+    ):
+        return False
+    # the data must cover every door this reader drives now - "channels" in common/ID.json may have changed since it
+    # was saved, and a door missing from it would fail every lookup until the next download
+    # (reader IDs are strings in JSON, and only readers, not the control app, have access data)
+    info = data.get("reader_info") or {}
+    access = data.get("reader_access_data") or {}
+    for id in sheet.reader_ids:
+        if str(id) not in info or (id > 0 and str(id) not in access):
+            return False
+    try:
+        sheet.restore(data)
+    except (KeyError, TypeError, ValueError):
+        return False
+    return True
+
+
+def save_sheet(sheet):
+    """
+    Save the sheet data in memory.
+
+    sheet: module: the sheet module.
+    """
+    write_json(SHEET_FILE, sheet.snapshot())
@@ -2,7 +2,8 @@ import datetime
 import json
 import logging
 import os.path
-from threading import Thread
+import re
+from threading import Lock, Thread
 from typing import Any, Callable, Iterable, Mapping
 
 import pandas as pd
@@ -24,14 +25,32 @@ if not os.path.exists(path + "/logs/sheet"):
 logger = logging.getLogger("sheet")
 logger.setLevel(logging.DEBUG)
 
+# config file - common/ID.json, or the file named by the ACCESS_CARDS_CONFIG environment variable (ex. the test
+# reader's, src/test/sim/ID.json)
+CONFIG_FILE = os.path.join(
+    path, os.environ.get("ACCESS_CARDS_CONFIG", "common/ID.json")
+)
+
 # get reader id (0 is the control pi, any other number is a reader pi zero)
 try:
-    reader_file = json.load(open("common/ID.json"))
+    reader_file = json.load(open(CONFIG_FILE))
 except FileNotFoundError:
-    logger.error("No ID.json file found.")
+    logger.error(f"No {CONFIG_FILE} file found.")
     exit(1)
 reader_id = reader_file["id"]
 
+# reader IDs served by this device - reader_id, and the reader ID of each door if it drives several ("channels", see reader.py)
+reader_ids = list(
+    dict.fromkeys(
+        [reader_id] + [channel["id"] for channel in reader_file.get("channels", [])]
+    )
+)
+
+# offline sheet data - "sheet_snapshot" in ID.json names a snapshot() file (path from the repository root, ex.
+# data/reader/sheet.json) to load instead of the Google Sheets document, so a reader runs without credentials or a
+# network (ex. load tests with simulated hardware). Nothing is written back, so only the reader can run offline.
+snapshot_file = reader_file.get("sheet_snapshot")
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
@@ -39,7 +58,7 @@ SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 SPREADSHEET_ID = "1X7VJ9jRQGx0ZryXbvbmff09eOawymLg-DvTY7FYxN2E"
 STUDENTS_SHEET = "Students"
 STAFF_SHEET = "Staff"
-MODULES_SHEET = "Modules"  # contains a mapping from room accesses to combinations of modules ("AND(5, 6, OR(7, 8))" etc)
+MODULES_SHEET = "Modules"  # contains a mapping from room accesses to combinations of modules ("AND(5, 6, OR(7, 8))" etc), modules in other courses are "course_id:module" ("5 AND 12345:2")
 ACCESSES_SHEET = (
     "Accesses"  # contains a mapping from room accesses to reader ID numbers
 )
@@ -52,6 +71,10 @@ SEND_BLOCK = 500
 
 ENABLE_SCAN_LOGS = False  # disable scan logs - considered P3 data due to tracking locations of students (can add back in for testing or when a secure logging system is implemented)
 
+# held while new sheet data is swapped in and while a card is looked up - the data is downloaded in another thread
+# (ex. the reader's sheet worker) while cards are looked up, and a lookup must not see part of the old data and part of the new
+data_lock = Lock()
+
 # Dataframes/dictionaries to store the sheet data
 student_data = None
 staff_data = None
@@ -80,6 +103,10 @@ reader_headers = [
 # status/alarm/etc info for this reader
 this_reader = None
 
+# access data and status/alarm/etc info of every reader ID in reader_ids, by reader ID (includes access_data and this_reader)
+reader_access_data = dict()
+reader_info = dict()
+
 # headers for access_data dataframe
 access_headers = None
 
@@ -104,34 +131,38 @@ student_sheet_read_len = 0
 staff_sheet_read_len = 0
 
 creds = None
-# The file token.json stores the user's access and refresh tokens, and is
-# created automatically when the authorization flow completes for the first
-# time.
-if os.path.exists("common/token.json"):
-    creds = Credentials.from_authorized_user_file("common/token.json", SCOPES)
-elif not os.path.exists("common/credentials.json"):
-    logger.error("No credentials.json file found.")
-    exit(1)
-# If there are no (valid) credentials available, let the user log in (assuming credentials.json exists).
-if not creds or not creds.valid:
-    if creds and creds.expired and creds.refresh_token:
-        creds.refresh(Request())
-    else:
-        flow = InstalledAppFlow.from_client_secrets_file(
-            "common/credentials.json", SCOPES
-        )
-        creds = flow.run_local_server(port=44649)
-    # Save the credentials for the next run
-    with open("common/token.json", "w") as token:
-        token.write(creds.to_json())
+g_sheets = None
+if snapshot_file:
+    logger.info(f"Offline - sheet data is loaded from {snapshot_file}")
+else:
+    # The file token.json stores the user's access and refresh tokens, and is
+    # created automatically when the authorization flow completes for the first
+    # time.
+    if os.path.exists("common/token.json"):
+        creds = Credentials.from_authorized_user_file("common/token.json", SCOPES)
+    elif not os.path.exists("common/credentials.json"):
+        logger.error("No credentials.json file found.")
+        exit(1)
+    # If there are no (valid) credentials available, let the user log in (assuming credentials.json exists).
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file(
+                "common/credentials.json", SCOPES
+            )
+            creds = flow.run_local_server(port=44649)
+        # Save the credentials for the next run
+        with open("common/token.json", "w") as token:
+            token.write(creds.to_json())
 
-try:
-    # Call the Sheets API
-    service = build("sheets", "v4", credentials=creds)
-    g_sheets = service.spreadsheets()
-except HttpError as e:
-    logger.error(e)
-    exit(1)
+    try:
+        # Call the Sheets API
+        service = build("sheets", "v4", credentials=creds)
+        g_sheets = service.spreadsheets()
+    except HttpError as e:
+        logger.error(e)
+        exit(1)
 
 
 def get_sheet_data(limited=None):
@@ -142,20 +173,24 @@ def get_sheet_data(limited=None):
 
     Returns True if the data was retrieved, or False if it was not.
     """
-    global student_data, staff_data, module_data, access_data, rooms, limited_data, last_update_time, student_sheet_read_len, staff_sheet_read_len
+    global student_data, staff_data, module_data, access_data, reader_access_data, rooms, limited_data, last_update_time, student_sheet_read_len, staff_sheet_read_len
 
-    # set limited data mode
-    if limited is not None:
-        limited_data = limited
+    if snapshot_file:
+        # offline - the snapshot has all the data (reader data included)
+        return load_snapshot()
+
+    # limited data mode - kept as it is unless set
+    if limited is None:
+        limited = limited_data
     try:
-        # set the last update time to now
-        last_update_time = datetime.datetime.now()
+        # the time the data was pulled
+        update_time = datetime.datetime.now()
         # get the students sheet - skip the first 4 columns if in limited data mode
         students = (
             g_sheets.values()
             .get(
                 spreadsheetId=SPREADSHEET_ID,
-                range=STUDENTS_SHEET + ("!E1:ZZ" if limited_data else ""),
+                range=STUDENTS_SHEET + ("!E1:ZZ" if limited else ""),
             )
             .execute()
         )
@@ -168,24 +203,24 @@ def get_sheet_data(limited=None):
         # fill in empty cells - this is necessary for the dataframes to be created
         values = [r + [""] * (len(values[0]) - len(r)) for r in values]
 
-        # set the length of the sheet read
-        student_sheet_read_len = len(values)
+        # the length of the sheet read
+        student_read_len = len(values)
 
         # create the student data dataframe - first row is the headers
-        student_data = pd.DataFrame(
+        student_frame = pd.DataFrame(
             values[1:] if len(values) > 1 else None,
             columns=values[0],
         )
 
         # get the rooms from the headers
-        rooms = student_data.columns.tolist()[(1 if limited_data else 5) :]
+        room_names = student_frame.columns.tolist()[(1 if limited else 5) :]
 
         # get the staff sheet, get only the first column if in limited data mode
         staff = (
             g_sheets.values()
             .get(
                 spreadsheetId=SPREADSHEET_ID,
-                range=STAFF_SHEET + ("!A1:A" if limited_data else ""),
+                range=STAFF_SHEET + ("!A1:A" if limited else ""),
             )
             .execute()
         )
@@ -193,11 +228,11 @@ def get_sheet_data(limited=None):
 
         # fill in empty cells - this is necessary for the dataframes to be created
         values = [r + [""] * (len(values[0]) - len(r)) for r in values]
-        # set the length of the sheet read
-        staff_sheet_read_len = len(values)
+        # the length of the sheet read
+        staff_read_len = len(values)
 
         # create the staff data dataframe - first row is the headers
-        staff_data = pd.DataFrame(
+        staff_frame = pd.DataFrame(
             values[1:] if len(values) > 1 else None,
             columns=values[0],
         )
@@ -217,47 +252,49 @@ def get_sheet_data(limited=None):
         values = [r + [""] * (len(values[0]) - len(r)) for r in values]
 
         # create the modules data dataframe - first row is the headers
-        module_data = pd.DataFrame(
+        module_frame = pd.DataFrame(
             values[1:] if len(values) > 1 else None,
             columns=values[0],
         )
 
         # if this is not the control pi, get the reader data
-        if reader_id > 0:
+        accesses_by_reader = reader_access_data
+        ids = [i for i in reader_ids if i > 0]
+        if ids:
             # create the access headers - column names for the access data
-            access_headers = ["id", "staff"] + rooms + ["no_access"]
+            access_headers = ["id", "staff"] + room_names + ["no_access"]
 
-            # get the accesses sheet - get only the row for this reader, and number of columns is based on the length of the access headers
+            # get the accesses sheet - get only the rows for this device's readers (in one request), and number of columns is based on the length of the access headers
             # start at 'A' and go to the character corresponding to the length of the access headers
             accesses = (
                 g_sheets.values()
                 .get(
                     spreadsheetId=SPREADSHEET_ID,
                     range=ACCESSES_SHEET
-                    + f"!A{reader_id+1}:{str(chr(ord('A') + len(access_headers)))}{reader_id+1}",
+                    + f"!A{min(ids)+1}:{str(chr(ord('A') + len(access_headers)))}{max(ids)+1}",
                 )
                 .execute()
             )
             values = accesses.get("values", [])
 
-            # initialize the access data dictionary
-            access_data = dict()
-            # fill in the dict with the values from the sheet row
-            for i, r in enumerate(values[0]):
-                if access_headers[i] == "id":
-                    # if the column is the id, convert it to an int (0 if empty)
-                    access_data["id"] = int(0 if not r else r)
-                elif not r:
-                    # if the value is empty, set it to None
-                    access_data[access_headers[i]] = None
-                else:
-                    # if the value is not empty, split it by the comma and space - color code and alarm timeout
-                    r = r.split(", ")
-                    # if the alarm timeout is not empty, convert it to an int
-                    if r[1]:
-                        r[1] = int(r[1])
-                    # set the value in the access data dict as a tuple
-                    access_data[access_headers[i]] = tuple(r)
+            # fill in the access data dictionary of each reader from its row
+            accesses_by_reader = {
+                i: parse_accesses(access_headers, values[i - min(ids)]) for i in ids
+            }
+
+        # swap the new data in all at once - cards are looked up (scan_uid()) while this runs in another thread,
+        # and the rooms must always match the access data
+        with data_lock:
+            limited_data = limited
+            last_update_time = update_time
+            student_sheet_read_len = student_read_len
+            staff_sheet_read_len = staff_read_len
+            student_data = student_frame
+            staff_data = staff_frame
+            module_data = module_frame
+            rooms = room_names
+            reader_access_data = accesses_by_reader
+            access_data = reader_access_data.get(reader_id)
 
         # call get_reader_data() and return its result (True if successful, False if not) - presumably get_sheet_data has succeeded
         return get_reader_data()
@@ -266,13 +303,49 @@ def get_sheet_data(limited=None):
         return False
 
 
+def parse_accesses(access_headers, row):
+    """
+    Parse a reader's row of the accesses sheet.
+
+    access_headers: list: the column names.
+    row: list: the row.
+
+    Returns the access data dictionary - the reader ID, and the color code and alarm timeout for each room (None if there is no access).
+    """
+    # initialize the access data dictionary
+    data = dict()
+    # fill in the dict with the values from the sheet row
+    for i, r in enumerate(row):
+        if access_headers[i] == "id":
+            # if the column is the id, convert it to an int (0 if empty)
+            data["id"] = int(0 if not r else r)
+        elif not r:
+            # if the value is empty, set it to None
+            data[access_headers[i]] = None
+        else:
+            # if the value is not empty, split it by the comma and space - color code and alarm timeout
+            r = r.split(", ")
+            # if the alarm timeout is not empty, convert it to an int
+            if r[1]:
+                r[1] = int(r[1])
+            # set the value in the access data dict as a tuple
+            data[access_headers[i]] = tuple(r)
+    return data
+
+
 def get_reader_data():
     """
     Get the reader data from the Google Sheets document.
 
     Returns True if the data was retrieved, or False if it was not.
     """
-    global reader_data, this_reader
+    global reader_data, this_reader, reader_info
+    if snapshot_file:
+        # offline - the reader data was loaded with the rest of the snapshot (see load_snapshot()), and there is never
+        # newer data to pull
+        for info in reader_info.values():
+            info["needs_update"] = False
+        return True
     try:
         # get the readers sheet
         readers = (
@@ -285,27 +358,32 @@ def get_reader_data():
         )
         values = readers.get("values", [])
         values = [r + [""] * (len(values[0]) - len(r)) for r in values]
-        reader_data = pd.DataFrame(
+        reader_frame = pd.DataFrame(
             values[1:] if len(values) > 1 else None,
             columns=reader_headers,
         )
 
-        this_reader = dict()
-        for i, r in enumerate(values[reader_id + 1]):
-            this_reader[reader_headers[i]] = r
+        info_by_reader = dict()
+        for id in reader_ids:
+            info = dict()
+            for i, r in enumerate(values[id + 1]):
+                info[reader_headers[i]] = r
 
-        this_reader["id"] = 0 if not len(this_reader["id"]) else int(this_reader["id"])
-        this_reader["alarm"] = (
-            False if not len(this_reader["alarm"]) else this_reader["alarm"] == "ENABLE"
-        )
-        this_reader["alarm_delay_min"] = (
-            0
-            if not len(this_reader["alarm_delay_min"])
-            else int(this_reader["alarm_delay_min"])
-        )
-        this_reader["needs_update"] = this_reader["needs_update"] == "PENDING"
+            info["id"] = 0 if not len(info["id"]) else int(info["id"])
+            info["alarm"] = (
+                False if not len(info["alarm"]) else info["alarm"] == "ENABLE"
+            )
+            info["alarm_delay_min"] = (
+                0 if not len(info["alarm_delay_min"]) else int(info["alarm_delay_min"])
+            )
+            info["needs_update"] = info["needs_update"] == "PENDING"
+            info_by_reader[id] = info
 
-        get_canvas_status_sheet()
+        # swap the new data in all at once (see get_sheet_data())
+        with data_lock:
+            reader_data = reader_frame
+            reader_info = info_by_reader
+            this_reader = reader_info[reader_id]
 
         return True
     except HttpError as e:
@@ -313,44 +391,60 @@ def get_reader_data():
         return False
 
 
-def check_in(alarm_status=False):
+def check_in(alarm_status=False, alarm_statuses=None):
     global last_checkin_time, this_reader
     """
     Update the reader's last checked in time and needs update status.
 
     alarm_status: bool: the alarm status (True if the alarm was triggered, False if it was not, and None if it's tagged out).
+    alarm_statuses: dict: reader ID -> alarm status, to check in several of this device's readers at once (one read and one write) instead of only reader_id.
 
     Returns True if the data was updated, or False if it was not.
     """
+    if alarm_statuses is None:
+        alarm_statuses = {reader_id: alarm_status}
+
     if not get_reader_data():
         return False
-    if this_reader["alarm"] == "DISABLE":
-        this_reader["alarm_status"] = "DISABLED"
-    else:
-        if reader_id == 0:
-            this_reader["alarm_status"] = ""
-        elif alarm_status is None:
-            this_reader["alarm_status"] = "TAGGED OUT"
-        elif alarm_status:
-            this_reader["alarm_status"] = "ALARM"
-        else:
-            this_reader["alarm_status"] = "OK"
-
-    last_checkin_time = datetime.datetime.now()
-    this_reader["last_checked_in"] = str(last_checkin_time)
-    if this_reader["needs_update"]:
+    # pull new data first if any of the readers needs an update - this reloads the reader info too
+    if any(reader_info[id]["needs_update"] for id in alarm_statuses):
         logger.info("Update needed...")
         get_sheet_data()
-    this_reader["needs_update"] = "DONE"
 
+    last_checkin_time = datetime.datetime.now()
+    data = []
+    for id, status in alarm_statuses.items():
+        info = reader_info[id]
+        if info["alarm"] == "DISABLE":
+            info["alarm_status"] = "DISABLED"
+        else:
+            if id == 0:
+                info["alarm_status"] = ""
+            elif status is None:
+                info["alarm_status"] = "TAGGED OUT"
+            elif status:
+                info["alarm_status"] = "ALARM"
+            else:
+                info["alarm_status"] = "OK"
+
+        info["last_checked_in"] = str(last_checkin_time)
+        info["needs_update"] = "DONE"
+        data.append(
+            {
+                "range": READERS_SHEET + f"!F{id+2}:H{id+2}",
+                "values": [list(info.values())[-3:]],
+            }
+        )
+
+    if snapshot_file:
+        # offline - the statuses are only kept in reader_info
+        return True
     try:
         _ = (
             g_sheets.values()
-            .update(
+            .batchUpdate(
                 spreadsheetId=SPREADSHEET_ID,
-                range=READERS_SHEET + f"!F{reader_id+2}:H{reader_id+2}",
-                valueInputOption="USER_ENTERED",
-                body={"values": [list(this_reader.values())[-3:]]},
+                body={"valueInputOption": "USER_ENTERED", "data": data},
             )
             .execute()
         )
@@ -360,6 +454,87 @@ def check_in(alarm_status=False):
     return True
 
 
+def snapshot():
+    """
+    Get the sheet data loaded in memory, for restoring after a restart without downloading it again (see restore()).
+
+    Returns the data as a dict that can be written as JSON.
+    """
+
+    def frame(df):
+        return (
+            None
+            if df is None
+            else {"columns": df.columns.tolist(), "data": df.values.tolist()}
+        )
+
+    return {
+        "limited_data": limited_data,
+        "last_update_time": last_update_time and last_update_time.isoformat(),
+        "student_data": frame(student_data),
+        "staff_data": frame(staff_data),
+        "module_data": frame(module_data),
+        "reader_data": frame(reader_data),
+        "reader_access_data": reader_access_data,
+        "reader_info": reader_info,
+        "rooms": rooms,
+        "student_sheet_read_len": student_sheet_read_len,
+        "staff_sheet_read_len": staff_sheet_read_len,
+    }
+
+
+def restore(data):
+    """
+    Load sheet data from a snapshot() instead of the Google Sheets document.
+
+    data: dict: the snapshot.
+    """
+    global student_data, staff_data, module_data, reader_data, access_data, this_reader, reader_access_data, reader_info, rooms, limited_data, last_update_time, student_sheet_read_len, staff_sheet_read_len
+
+    def frame(f):
+        return (
+            None if f is None else pd.DataFrame(f["data"] or None, columns=f["columns"])
+        )
+
+    limited_data = data["limited_data"]
+    last_update_time = data["last_update_time"] and datetime.datetime.fromisoformat(
+        data["last_update_time"]
+    )
+    student_data = frame(data["student_data"])
+    staff_data = frame(data["staff_data"])
+    module_data = frame(data["module_data"])
+    reader_data = frame(data["reader_data"])
+    # reader IDs are strings in JSON, and color/alarm timeout pairs are tuples, as read from the sheet
+    reader_access_data = {
+        int(id): {k: tuple(v) if isinstance(v, list) else v for k, v in access.items()}
+        for id, access in data["reader_access_data"].items()
+    }
+    reader_info = {int(id): info for id, info in data["reader_info"].items()}
+    access_data = reader_access_data.get(reader_id)
+    this_reader = reader_info.get(reader_id)
+    rooms = data["rooms"]
+    student_sheet_read_len = data["student_sheet_read_len"]
+    staff_sheet_read_len = data["staff_sheet_read_len"]
+
+
+def load_snapshot():
+    """
+    Load the sheet data from snapshot_file instead of the Google Sheets document (offline - see snapshot_file).
+
+    Returns True if the data was loaded, or False if it was not.
+    """
+    try:
+        with open(os.path.join(path, snapshot_file)) as f:
+            data = json.load(f)
+        # swap the data in all at once (see get_sheet_data())
+        with data_lock:
+            restore(data)
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        logger.error(f"Error loading {snapshot_file}: {e}")
+        return False
+    return True
+
+
 def get_canvas_status_sheet():
     global last_canvas_update_time, canvas_is_updating, canvas_needs_update
     """
@@ -397,7 +572,7 @@ def set_canvas_status_sheet(updating_now, update_time=None):
 
     Returns True if the data was set, or False if it was not.
     """
-    global last_canvas_update_time
+    global last_canvas_update_time, canvas_is_updating, canvas_needs_update
     try:
         _ = (
             g_sheets.values()
@@ -421,6 +596,9 @@ def set_canvas_status_sheet(updating_now, update_time=None):
             .execute()
         )
         last_canvas_update_time = update_time
+        # the status is now UPDATING or DONE - no longer PENDING
+        canvas_is_updating = updating_now
+        canvas_needs_update = False
         return True
     except HttpError as e:
         logger.error(e)
@@ -892,7 +1070,8 @@ def write_student_sheet():
     """
 
     try:
-        student_data.sort_values(by=["Last Name"], inplace=True)
+        # renumber the rows after sorting, so each row's index is its position again (see new_student())
+        student_data.sort_values(by=["Last Name"], inplace=True, ignore_index=True)
         vals = student_data.values.tolist()
         vals.insert(0, student_data.columns.tolist())
         length = len(vals)
@@ -932,7 +1111,7 @@ def write_staff_sheet():
     """
 
     try:
-        staff_data.sort_values(by=["Last Name"], inplace=True)
+        staff_data.sort_values(by=["Last Name"], inplace=True, ignore_index=True)
         vals = staff_data.values.tolist()
         vals.insert(0, staff_data.columns.tolist())
         length = len(vals)
@@ -976,18 +1155,72 @@ def write_student_staff_sheets():
     return write_student_sheet() and write_staff_sheet()
 
 
+def write_student_rows(cruzids):
+    """
+    Write only the given students' rows to the Google Sheets document.
+
+    Only valid if no students were added, removed, or reordered since the sheet was last read or written, so each row's position still matches its row in the sheet.
+
+    cruzids: list: the CruzIDs of the students to write.
+
+    Returns True if the data was written, or False if it was not.
+    """
+
+    try:
+        # last column letter of the student sheet
+        last_col = str(chr(ord("A") + len(student_data.columns) - 1))
+
+        # one range per student row - the row at position i of the dataframe is row i+2 of the sheet (after the header row)
+        # positions, not index labels, since the index may no longer count from 0 (ex. after a sort or a dropped row)
+        rows = student_data.reset_index(drop=True)
+        data = [
+            {
+                "range": STUDENTS_SHEET + f"!A{i+2}:{last_col}{i+2}",
+                "values": [rows.loc[i].tolist()],
+            }
+            for i in rows.index[rows["CruzID"].isin(cruzids)]
+        ]
+
+        for i in range(0, len(data), SEND_BLOCK):
+            _ = (
+                g_sheets.values()
+                .batchUpdate(
+                    spreadsheetId=SPREADSHEET_ID,
+                    body={
+                        "valueInputOption": "USER_ENTERED",
+                        "data": data[i : i + SEND_BLOCK],
+                    },
+                )
+                .execute()
+            )
+        return True
+    except HttpError as e:
+        logger.error(e)
+        return False
+
+
 def evaluate_modules(completed_modules, cruzid=None, uid=None, num_modules=None):
     """
     Evaluate a student's completed modules and update their room accesses.
 
-    completed_modules: list: the student's completed modules.
+    completed_modules: list: the student's completed modules - module numbers (int) in the primary course, and "course_id:module" (str) in any course.
     cruzid: str: the student's CruzID.
     uid: str: the student's card UID.
+    num_modules: int: the number of modules in the primary course.
     """
 
     if not num_modules:
         num_modules = 1000
 
+    completed_modules = set(completed_modules)
+
+    # replace a module reference with "t" if it was completed, or "f" if not
+    def completed(match):
+        if match.group(1):
+            return "t" if match.group(0) in completed_modules else "f"
+        m = int(match.group(2))
+        return "t" if m <= num_modules and m in completed_modules else "f"
+
     for i in range(len(module_data)):
         exp = str(module_data.loc[i, "Modules"])
         exp = exp.lower()
@@ -995,8 +1228,8 @@ def evaluate_modules(completed_modules, cruzid=None, uid=None, num_modules=None)
         exp = exp.replace("or", "|")
         exp = exp.replace(" ", "")
 
-        for m in range(num_modules, 0, -1):
-            exp = exp.replace(str(m), "t" if m in completed_modules else "f")
+        # module references are a module number, optionally prefixed with a course ID ("5" or "12345:5")
+        exp = re.sub(r"(\d+:)?(\d+)", completed, exp)
 
         for l in exp:
             if l not in "tf&|()":
@@ -1277,50 +1510,54 @@ def need_updating():
     )
 
 
-def scan_uid(uid, alarm_status=False):
+def scan_uid(uid, alarm_status=False, id=None):
     """
     Return the LED color and alarm delay time for a given card UID.
 
     uid: str: the card UID.
     alarm_status: bool: the alarm status (True if the alarm was triggered, False if it was not).
+    id: int: the reader ID the card was scanned at (one of reader_ids), or None for reader_id.
 
     Returns the LED hex color and alarm delay time in minutes, or False if no "No Access" value is specified, or None if the uid does not exist.
     """
+    # look the card up in one version of the data - see data_lock
+    with data_lock:
+        access = access_data if id is None else reader_access_data[id]
 
-    if is_staff(uid=uid):
-        if access_data["staff"]:
-            if ENABLE_SCAN_LOGS:
-                log(uid, "Staff", alarm_status, access_data["staff"][1])
-            return access_data["staff"]
-        elif access_data["no_access"]:
-            if ENABLE_SCAN_LOGS:
-                log(uid, "Staff", alarm_status, access_data["no_access"][1])
-            return access_data["no_access"]
-        else:
-            if ENABLE_SCAN_LOGS:
-                log(uid, "Staff (Not Found)", alarm_status, 0)
-            return False
+        if is_staff(uid=uid):
+            if access["staff"]:
+                if ENABLE_SCAN_LOGS:
+                    log(uid, "Staff", alarm_status, access["staff"][1])
+                return access["staff"]
+            elif access["no_access"]:
+                if ENABLE_SCAN_LOGS:
+                    log(uid, "Staff", alarm_status, access["no_access"][1])
+                return access["no_access"]
+            else:
+                if ENABLE_SCAN_LOGS:
+                    log(uid, "Staff (Not Found)", alarm_status, 0)
+                return False
 
-    elif student_exists(uid=uid):
-        for i in range(len(rooms)):
-            if get_access(rooms[i], uid=uid) and access_data[rooms[i]]:
+        elif student_exists(uid=uid):
+            for i in range(len(rooms)):
+                if get_access(rooms[i], uid=uid) and access[rooms[i]]:
+                    if ENABLE_SCAN_LOGS:
+                        log(uid, rooms[i], alarm_status, access[rooms[i]][1])
+                    return access[rooms[i]]
+
+            if access["no_access"]:
+                if ENABLE_SCAN_LOGS:
+                    log(uid, "No Access", alarm_status, access["no_access"][1])
+                return access["no_access"]
+            else:
                 if ENABLE_SCAN_LOGS:
-                    log(uid, rooms[i], alarm_status, access_data[rooms[i]][1])
-                return access_data[rooms[i]]
+                    log(uid, "Student (Not Found)", alarm_status, 0)
+                return False
 
-        if access_data["no_access"]:
-            if ENABLE_SCAN_LOGS:
-                log(uid, "No Access", alarm_status, access_data["no_access"][1])
-            return access_data["no_access"]
         else:
             if ENABLE_SCAN_LOGS:
-                log(uid, "Student (Not Found)", alarm_status, 0)
-            return False
-
-    else:
-        if ENABLE_SCAN_LOGS:
-            log(uid, "Unknown", alarm_status, 0)
-        return access_data["no_access"]
+                log(uid, "Unknown", alarm_status, 0)
+            return access["no_access"]
 
 
 def run_in_thread(
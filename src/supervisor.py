@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import random
+from threading import Lock
+from time import time
+
+logger = logging.getLogger("supervisor")
+
+
+class Backoff:
+    """
+    Bounded exponential backoff for one subsystem - after each consecutive error the wait before retrying doubles
+    (with some jitter so subsystems don't retry in lockstep), up to a maximum, and a success resets it.
+
+    name: str: the subsystem (ex. "sheet").
+    initial: float: the wait after the first error in seconds.
+    maximum: float: the longest wait in seconds.
+    factor: float: how much the wait grows after each consecutive error.
+    jitter: float: the fraction of the wait that is randomized.
+    """
+
+    def __init__(self, name, initial=1, maximum=60, factor=2, jitter=0.1):
+        self.name = name
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+        self.errors = 0  # errors since startup
+        self.consecutive = 0  # errors since the last success
+        self.last_error = None  # message of the last error
+        self.last_error_time = None  # time of the last error (time.time())
+        # time the subsystem retries (time.time()), while backing off
+        self.retry_time = None
+
+        # register for status()
+        with lock:
+            backoffs[name] = self
+
+    def failure(self, error):
+        """
+        Record an error.
+
+        error: Exception: the error.
+
+        Returns the time to wait before retrying in seconds.
+        """
+        self.errors += 1
+        self.consecutive += 1
+        self.last_error = str(error)
+        self.last_error_time = time()
+
+        delay = min(self.initial * self.factor ** (self.consecutive - 1), self.maximum)
+        delay *= 1 - self.jitter * random.random()
+        self.retry_time = self.last_error_time + delay
+        return delay
+
+    def success(self):
+        """
+        Record a success - the next error waits the initial time again.
+        """
+        self.consecutive = 0
+        self.retry_time = None
+
+    def status(self):
+        """
+        Returns the error counts and backoff state.
+        """
+        return {
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive,
+            "last_error": self.last_error,
+            "last_error_time": self.last_error_time,
+            "backing_off": self.retry_time is not None and self.retry_time > time(),
+            "retry_in": max(self.retry_time - time(), 0) if self.retry_time else 0,
+        }
+
+
+# subsystem name -> its backoff
+backoffs = {}
+lock = Lock()
+
+
+def status():
+    """
+    Returns the error counts and backoff state of every subsystem, by name - for monitoring.
+    """
+    with lock:
+        return {name: backoff.status() for name, backoff in backoffs.items()}
+
+
+async def supervise(name, step, **kwargs):
+    """
+    Run one step of a subsystem after another, forever - an error only stops this subsystem, which retries with
+    bounded exponential backoff.
+
+    name: str: the subsystem.
+    step: function: returns a coroutine running one step (ex. handling one event).
+    kwargs: the Backoff settings (initial, maximum, factor, jitter).
+    """
+    backoff = Backoff(name, **kwargs)
+    while True:
+        try:
+            await step()
+        except Exception as e:
+            delay = backoff.failure(e)
+            logger.error(
+                f"Error in {name}: {e} - retrying in {delay:.1f}s ({backoff.consecutive} in a row)"
+            )
+            await asyncio.sleep(delay)
+        else:
+            backoff.success()
@@ -0,0 +1,10 @@
+import os
+
+# unit tests run from the repository root with: python3 -m pytest src/test
+# the other scripts in this folder test the hardware on a Pi (run them directly) - pytest skips them
+collect_ignore = ["blinkatest.py", "door_sensor_test.py", "neopixeltest.py"]
+
+# the reader runs offline in the tests - simulated hardware, a scan trace and sheet data from a snapshot (see sim/ID.json)
+os.environ.setdefault(
+    "ACCESS_CARDS_CONFIG", os.path.join(os.path.dirname(__file__), "sim", "ID.json")
+)
@@ -0,0 +1,175 @@
+import pytest
+
+from src.reader.alarm import (
+    ALARM,
+    CLOSED,
+    OPEN_GRANTED,
+    OPEN_OVERDUE,
+    TAGGED_OUT,
+    Alarm,
+)
+
+DELAY = 60  # the reader's alarm delay in seconds
+
+
+@pytest.fixture
+def reports():
+    return []
+
+
+@pytest.fixture
+def alarm(reports):
+    return Alarm(lambda: DELAY, reports.append, now=0)
+
+
+def test_closed_has_no_deadline(alarm):
+    assert alarm.state == CLOSED
+    assert alarm.next_deadline() is None
+
+
+def test_trips_after_delay(alarm, reports):
+    alarm.door(True, now=100)
+    assert alarm.state == OPEN_OVERDUE
+    assert alarm.next_deadline() == 100 + DELAY
+
+    alarm.expire(now=100 + DELAY - 1)
+    assert alarm.state == OPEN_OVERDUE
+    assert reports == []
+
+    alarm.expire(now=100 + DELAY)
+    assert alarm.state == ALARM
+    assert alarm.alarm_status
+    assert reports == [True]
+    assert alarm.next_deadline() is None
+
+
+def test_closing_clears_alarm(alarm, reports):
+    alarm.door(True, now=0)
+    alarm.expire(now=DELAY)
+    alarm.door(False, now=DELAY + 5)
+    assert alarm.state == CLOSED
+    assert reports == [True, False]
+    # the old deadline no longer applies
+    assert alarm.next_deadline() is None
+
+
+def test_closing_before_delay_never_trips(alarm, reports):
+    alarm.door(True, now=0)
+    alarm.door(False, now=30)
+    alarm.expire(now=1000)
+    assert alarm.state == CLOSED
+    assert reports == []
+
+
+def test_repeated_door_changes_are_ignored(alarm):
+    alarm.door(True, now=0)
+    # a bounce - the door was already open, so its timer doesn't restart
+    alarm.door(True, now=50)
+    assert alarm.next_deadline() == DELAY
+
+
+def test_card_extends_time(alarm, reports):
+    alarm.door(True, now=0)
+    alarm.card(300, now=10)
+    assert alarm.state == OPEN_GRANTED
+    assert alarm.next_deadline() == 10 + 300
+
+    alarm.expire(now=10 + DELAY)
+    assert alarm.state == OPEN_GRANTED
+    alarm.expire(now=10 + 300)
+    assert alarm.state == ALARM
+    assert reports == [True]
+
+
+def test_card_shorter_than_delay(alarm):
+    alarm.door(True, now=0)
+    alarm.card(20, now=10)
+    assert alarm.state == OPEN_GRANTED
+    # the card's time limit ends first, but the alarm delay still applies from the scan
+    alarm.expire(now=30)
+    assert alarm.state == OPEN_OVERDUE
+    alarm.expire(now=10 + DELAY)
+    assert alarm.state == ALARM
+
+
+def test_card_while_closed_is_ignored(alarm):
+    alarm.card(300, now=0)
+    alarm.door(True, now=10)
+    # the card was scanned before the door opened
+    assert alarm.next_deadline() == 10 + DELAY
+
+
+def test_tag_out(alarm, reports):
+    alarm.door(True, now=0)
+    alarm.expire(now=DELAY)
+    alarm.card(120, now=100)
+    assert alarm.state == TAGGED_OUT
+    assert not alarm.alarm_status
+    assert reports == [True, False]
+
+    # trips again after the card's time limit
+    alarm.expire(now=100 + 120)
+    assert alarm.state == ALARM
+    assert reports == [True, False, True]
+
+
+def test_rearm_applies_new_delay(reports):
+    delay = [DELAY]
+    alarm = Alarm(lambda: delay[0], reports.append, door_open=True, now=0)
+    delay[0] = 30
+    alarm.rearm(now=10)
+    assert alarm.next_deadline() == 30
+    # a delay that has already passed trips the alarm at once
+    delay[0] = 5
+    alarm.rearm(now=10)
+    assert alarm.state == ALARM
+    assert reports == [True]
+
+
+def test_restore_door_still_open(reports):
+    old = Alarm(lambda: DELAY, lambda status: None, door_open=True, now=0)
+    old.card(300, now=10)
+    snapshot = old.snapshot()
+
+    # restarted 100 seconds later - the card's time carries on from the scan, not the restart
+    alarm = Alarm(lambda: DELAY, reports.append, door_open=True, now=110)
+    alarm.restore(snapshot, now=110)
+    assert alarm.state == OPEN_GRANTED
+    assert alarm.next_deadline() == 10 + 300
+    assert reports == []
+
+
+def test_restore_alarm_door_still_open(reports):
+    old = Alarm(lambda: DELAY, lambda status: None, door_open=True, now=0)
+    old.expire(now=DELAY)
+    snapshot = old.snapshot()
+
+    alarm = Alarm(lambda: DELAY, reports.append, door_open=True, now=100)
+    alarm.restore(snapshot, now=100)
+    assert alarm.state == ALARM
+    assert alarm.alarm_status
+    # already reported before the restart
+    assert reports == []
+
+
+def test_restore_door_closed_while_down(reports):
+    old = Alarm(lambda: DELAY, lambda status: None, door_open=True, now=0)
+    old.expire(now=DELAY)
+    snapshot = old.snapshot()
+
+    alarm = Alarm(lambda: DELAY, reports.append, door_open=False, now=100)
+    alarm.restore(snapshot, now=100)
+    assert alarm.state == CLOSED
+    # the alarm clears, and that is reported
+    assert reports == [False]
+
+
+def test_restore_deadline_passed_while_down(reports):
+    old = Alarm(lambda: DELAY, lambda status: None, door_open=True, now=0)
+    snapshot = old.snapshot()
+
+    # the door stayed open past the alarm delay while the reader was down
+    alarm = Alarm(lambda: DELAY, reports.append, door_open=True, now=100)
+    alarm.restore(snapshot, now=100)
+    assert alarm.state == ALARM
+    assert reports == [True]
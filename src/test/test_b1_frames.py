@@ -0,0 +1,66 @@
+from src.nfc import b1
+
+# frames built by src/nfc/command.c, the C encoder b1.encode() replaced - data -> frame
+COMMAND_C_FRAMES = {
+    "00": "020300AFF700F0E1",  # dummy
+    "010100010001": "020800552B010100010001F0C6",  # write "get UID and type" to the command register
+    "0214000B00": "0207006B3B0214000B002358",  # read the UID and tag type
+}
+
+
+def test_encode_matches_command_c():
+    for data, frame in COMMAND_C_FRAMES.items():
+        assert b1.encode(bytes.fromhex(data)) == bytes.fromhex(frame)
+
+
+def test_crc():
+    # CRC-16/CCITT-FALSE check value
+    assert b1.crc(b"123456789") == 0x29B1
+    assert b1.crc(b"") == 0
+
+
+def test_parse_whole_frame():
+    parser = b1.FrameParser()
+    assert parser.feed(b1.encode(b"\x00\x01\x02\x03")) == [(0x00, b"\x01\x02\x03")]
+    assert parser.buffer == bytearray()
+
+
+def test_parse_split_frame():
+    parser = b1.FrameParser()
+    frame = b1.encode(b"\x08\x20")
+    # one byte at a time - nothing until the last byte, and needed() counts down to it
+    for i in range(len(frame) - 1):
+        assert parser.feed(frame[i : i + 1]) == []
+        assert parser.needed() >= 1
+    assert parser.feed(frame[-1:]) == [(0x08, b"\x20")]
+
+
+def test_parse_several_frames_in_one_read():
+    parser = b1.FrameParser()
+    data = b1.encode(b"\x00") + b1.encode(b"\x08\x02") + b1.encode(b"\x00\xaa")[:4]
+    assert parser.feed(data) == [(0x00, b""), (0x08, b"\x02")]
+    # the start of the third frame is kept for the next read
+    assert parser.feed(b1.encode(b"\x00\xaa")[4:]) == [(0x00, b"\xaa")]
+
+
+def test_parse_skips_garbage():
+    parser = b1.FrameParser()
+    # noise before the frame, including a 0x02 that isn't the start of a frame (its header CRC is wrong)
+    data = b"\xff\x13\x02\x05\x00\x00\x00" + b1.encode(b"\x00\x01")
+    assert parser.feed(data) == [(0x00, b"\x01")]
+
+
+def test_parse_drops_bad_data_crc():
+    parser = b1.FrameParser()
+    bad = bytearray(b1.encode(b"\x00\x01\x02"))
+    bad[-1] ^= 0xFF
+    # the bad frame is dropped whole, and the next frame still parses
+    assert parser.feed(bytes(bad) + b1.encode(b"\x00\x03")) == [(0x00, b"\x03")]
+
+
+def test_frames_built_at_import():
+    # the commands sent on every card read are sent from FRAMES, not encoded again
+    for data, frame in COMMAND_C_FRAMES.items():
+        data = bytes.fromhex(data)
+        assert b1.FRAMES[data] == bytes.fromhex(frame)
+        assert b1.frame(data) is b1.FRAMES[data]
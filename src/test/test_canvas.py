@@ -0,0 +1,178 @@
+import json
+
+import pandas as pd
+import pytest
+
+from src import sheet
+from src.canvas import canvas
+
+# primary course first - unqualified module numbers refer to it
+COURSES = ["111", "222"]
+
+
+@pytest.fixture
+def students(monkeypatch):
+    """
+    Two students in the sheet data, with access to Room A for modules 1 and 2 of the primary course, and to Room B for
+    module 1 of the second course.
+    """
+    monkeypatch.setattr(sheet, "limited_data", False)
+    monkeypatch.setattr(sheet, "rooms", ["Room A", "Room B"])
+    monkeypatch.setattr(
+        sheet,
+        "student_data",
+        pd.DataFrame(
+            [
+                ["Alice", "A", "alice", 1, "", "No Access", "No Access"],
+                ["Bob", "B", "bob", 2, "", "No Access", "No Access"],
+            ],
+            columns=[
+                "First Name",
+                "Last Name",
+                "CruzID",
+                "Canvas ID",
+                "Card UID",
+                "Room A",
+                "Room B",
+            ],
+        ),
+    )
+    monkeypatch.setattr(
+        sheet,
+        "staff_data",
+        pd.DataFrame(columns=["Card UID", "First Name", "Last Name", "CruzID"]),
+    )
+    monkeypatch.setattr(
+        sheet,
+        "module_data",
+        pd.DataFrame(
+            [["Room A", "1 and 2"], ["Room B", "222:1"]],
+            columns=["Access Levels", "Modules"],
+        ),
+    )
+
+
+def access(cruzid, room):
+    return sheet.get_access(room, cruzid=cruzid)
+
+
+def test_primary_course_modules(students):
+    sheet.evaluate_modules([1, 2], cruzid="alice", num_modules=3)
+    assert access("alice", "Room A")
+    assert not access("alice", "Room B")
+
+
+def test_course_qualified_modules(students):
+    # module 1 of the second course - not module 1 of the primary course
+    sheet.evaluate_modules([1], cruzid="alice", num_modules=3)
+    assert not access("alice", "Room B")
+    sheet.evaluate_modules(["222:1"], cruzid="alice", num_modules=3)
+    assert access("alice", "Room B")
+    assert not access("alice", "Room A")
+
+
+def test_primary_course_qualified(students):
+    # the primary course's modules can also be referenced with its course ID
+    sheet.module_data.loc[0, "Modules"] = "111:1 and 2"
+    sheet.evaluate_modules([1, 2, "111:1", "111:2"], cruzid="alice", num_modules=3)
+    assert access("alice", "Room A")
+
+
+def test_modules_above_num_modules(students):
+    # a module past the end of the primary course can't be completed, even if Canvas reports it
+    sheet.evaluate_modules([1, 2], cruzid="alice", num_modules=1)
+    assert not access("alice", "Room A")
+
+
+@pytest.fixture
+def canvas_sync(students, tmp_path, monkeypatch):
+    """
+    Runs canvas.sync() against a fake Canvas - both students are enrolled in both courses, with the completed modules in
+    completions ({course: {canvas ID: [module positions]}}) - and records the sheet writes.
+    """
+    keys = tmp_path / "canvas.json"
+    keys.write_text(json.dumps({"auth_token": "token", "course_ids": COURSES}))
+    monkeypatch.setattr(canvas, "KEYS_FILE", str(keys))
+    monkeypatch.setattr(canvas, "CACHE_FILE", str(tmp_path / "cache.json"))
+    monkeypatch.setattr(canvas, "CHECKPOINT_FILE", str(tmp_path / "checkpoint.json"))
+
+    roster = [
+        {"id": 1, "login_id": "alice@ucsc.edu", "sortable_name": "A, Alice"},
+        {"id": 2, "login_id": "bob@ucsc.edu", "sortable_name": "B, Bob"},
+    ]
+    completions = {c: {1: [], 2: []} for c in COURSES}
+
+    def get_completed_modules(url, headers, canvas_id, num_modules):
+        completed = completions[url.split("/")[-2]][canvas_id]
+        return canvas.completed_to_bits(completed), completed, 3
+
+    monkeypatch.setattr(canvas, "get_roster", lambda url, headers: ([], roster))
+    monkeypatch.setattr(canvas, "get_completed_modules", get_completed_modules)
+
+    writes = []
+    monkeypatch.setattr(sheet, "get_sheet_data", lambda limited=None: True)
+    monkeypatch.setattr(sheet, "log", lambda *args: True)
+    monkeypatch.setattr(
+        sheet, "write_student_sheet", lambda: writes.append("students") or True
+    )
+    monkeypatch.setattr(
+        sheet, "write_staff_sheet", lambda: writes.append("staff") or True
+    )
+    monkeypatch.setattr(
+        sheet, "write_student_rows", lambda cruzids: writes.append(cruzids) or True
+    )
+
+    def sync():
+        writes.clear()
+        assert canvas.sync()
+        return writes
+
+    sync.completions = completions
+    return sync
+
+
+def test_first_sync_writes_everything(canvas_sync):
+    # no cache yet - every student is evaluated and the sheets are rewritten in full
+    assert canvas_sync() == ["students", "staff"]
+
+
+def test_unchanged_completions_not_written(canvas_sync):
+    canvas_sync()
+    assert canvas_sync() == []
+
+
+def test_changed_student_rewritten(canvas_sync):
+    canvas_sync()
+    canvas_sync.completions["111"][2] = [1, 2]
+    assert canvas_sync() == [["bob"]]
+    assert access("bob", "Room A")
+
+
+def test_change_in_second_course_rewritten(canvas_sync):
+    # only the second course changed - the primary course's completions are the same
+    canvas_sync.completions["111"][1] = [1]
+    canvas_sync()
+    canvas_sync.completions["222"][1] = [1]
+    assert canvas_sync() == [["alice"]]
+    assert access("alice", "Room B")
+    assert not access("alice", "Room A")
+
+
+def test_same_modules_in_other_course_rewritten(canvas_sync):
+    # the same module completed in a different course is a different bitset
+    canvas_sync.completions["111"][1] = [1]
+    canvas_sync()
+    canvas_sync.completions["111"][1] = []
+    canvas_sync.completions["222"][1] = [1]
+    assert canvas_sync() == [["alice"]]
+    assert access("alice", "Room B")
+
+
+def test_module_rules_changed(canvas_sync):
+    # every student is evaluated again with the new rules
+    canvas_sync.completions["111"][1] = [2]
+    canvas_sync()
+    assert not access("alice", "Room A")
+    sheet.module_data.loc[0, "Modules"] = "1 or 2"
+    assert canvas_sync() == ["students", "staff"]
+    assert access("alice", "Room A")
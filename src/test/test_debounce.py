@@ -0,0 +1,69 @@
+from src.nfc.debounce import Debouncer
+
+
+def test_new_card_is_a_tap():
+    debouncer = Debouncer(5)
+    assert debouncer.check("AA", now=0)
+    assert debouncer.check("BB", now=1)
+
+
+def test_repeat_within_window_is_suppressed():
+    debouncer = Debouncer(5)
+    assert debouncer.check("AA", now=0)
+    assert not debouncer.check("AA", now=4.9)
+
+
+def test_window_expiry():
+    debouncer = Debouncer(5)
+    assert debouncer.check("AA", now=0)
+    assert debouncer.check("AA", now=5)
+    # expired cards are forgotten
+    debouncer.check("BB", now=20)
+    assert len(debouncer) == 1
+
+
+def test_held_card_restarts_window():
+    debouncer = Debouncer(5)
+    assert debouncer.check("AA", now=0)
+    # read every 2 seconds while held - never a new tap
+    for t in range(2, 20, 2):
+        assert not debouncer.check("AA", now=t)
+    # away for the whole window
+    assert debouncer.check("AA", now=18 + 5)
+
+
+def test_size_bound():
+    debouncer = Debouncer(60, max_size=3)
+    for i, uid in enumerate(["AA", "BB", "CC", "DD"]):
+        debouncer.check(uid, now=i)
+    assert len(debouncer) == 3
+    # the least recently read card was forgotten, so it counts as a new tap
+    assert debouncer.check("AA", now=5)
+    assert not debouncer.check("DD", now=5)
+
+
+def test_snapshot_restore():
+    debouncer = Debouncer(5)
+    debouncer.check("AA", now=100)
+    debouncer.check("BB", now=103)
+    snapshot = debouncer.snapshot(now=104)
+    assert snapshot == {"AA": 4, "BB": 1}
+
+    # restored 2 seconds later, on a clock that restarted - AA's window has passed, BB's hasn't
+    restored = Debouncer(5)
+    restored.restore(snapshot, elapsed=2, now=10)
+    assert len(restored) == 1
+    assert restored.check("AA", now=10)
+    assert not restored.check("BB", now=11.9)
+
+    # BB was last read 3 seconds before the restore, so its window ends 2 seconds after it
+    restored = Debouncer(5)
+    restored.restore(snapshot, elapsed=2, now=10)
+    assert restored.check("BB", now=12)
+
+
+def test_clear():
+    debouncer = Debouncer(5)
+    debouncer.check("AA", now=0)
+    debouncer.clear()
+    assert debouncer.check("AA", now=1)
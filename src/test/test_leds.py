@@ -0,0 +1,52 @@
+import asyncio
+
+from src.reader.leds import GAMMA, LedEngine
+
+
+def engine(written, frame_delay=0.01, hold=0.05):
+    return LedEngine(written.append, 3, "GRB", frame_delay, hold, 0.2, 0.5)
+
+
+def test_frame_byte_order_and_gamma():
+    leds = engine([])
+    frame = leds.frame((255, 128, 0), 1.0)
+    assert frame == bytearray([GAMMA[128], 255, 0] * 3)
+    # brightness is applied after gamma
+    assert leds.frame((255, 0, 0), 0.5)[1] == round(255 * 0.5)
+
+
+def test_equal_frames_are_one_object():
+    leds = engine([])
+    assert leds.frame((10, 10, 10), 0.5) is leds.frame((10, 10, 10), 0.5)
+    # black at any brightness is the same frame
+    assert leds.frame((0, 0, 0), 0.2) is leds.frame((0, 0, 0), 0.5)
+
+
+def test_unchanged_frames_are_skipped():
+    written = []
+    leds = engine(written)
+    leds.fill((255, 0, 0), 0.5)
+    leds.fill((255, 0, 0), 0.5)
+    leds.fill((0, 255, 0), 0.5)
+    assert len(written) == 2
+
+
+def test_show_interrupts_breathing():
+    written = []
+    shown = []
+    leds = engine(written)
+
+    async def run():
+        task = asyncio.create_task(leds.run())
+        await asyncio.sleep(0.05)
+        leds.show((0, 255, 0), lambda: shown.append(len(written)))
+        await asyncio.sleep(0.02)
+        # the scan color is on the LEDs right away
+        assert written[-1] == leds.frame((0, 255, 0), 0.5)
+        assert shown == [len(written)]
+        await asyncio.sleep(0.1)
+        # then breathing starts again from black (the dimmest breathe levels are black too, so they aren't written again)
+        assert written[-1] is leds.breathe[0]
+        task.cancel()
+
+    asyncio.run(run())
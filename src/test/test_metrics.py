@@ -0,0 +1,68 @@
+import pytest
+
+from src import metrics
+from src.metrics import Histogram
+
+
+def test_empty():
+    h = Histogram()
+    assert h.percentile(50) is None
+    assert h.summary()["count"] == 0
+
+
+def test_exact_below_128_microseconds():
+    h = Histogram()
+    for us in range(1, 101):
+        h.record(us / 1_000_000)
+    assert h.percentile(50) == pytest.approx(50e-6)
+    assert h.percentile(99) == pytest.approx(99e-6)
+    assert h.percentile(100) == pytest.approx(100e-6)
+
+
+def test_relative_error():
+    # values from microseconds to minutes land in buckets within 1% of them
+    h = Histogram()
+    for seconds in (0.0005, 0.0123, 0.25, 3.7, 95.0):
+        us = int(seconds * 1_000_000)
+        assert h.value(h.index(us)) == pytest.approx(us, rel=0.01)
+
+
+def test_percentiles():
+    h = Histogram()
+    # 1 to 1000 ms
+    for ms in range(1, 1001):
+        h.record(ms / 1000)
+    assert h.count == 1000
+    assert h.percentile(50) == pytest.approx(0.5, rel=0.01)
+    assert h.percentile(90) == pytest.approx(0.9, rel=0.01)
+    assert h.percentile(99) == pytest.approx(0.99, rel=0.01)
+    # never above the largest value recorded
+    assert h.percentile(100) == pytest.approx(1.0)
+
+
+def test_summary_buckets_merge():
+    a, b = Histogram(), Histogram()
+    a.record(0.001)
+    b.record(0.001)
+    b.record(0.002)
+    merged = a.summary()["buckets"]
+    for i, c in b.summary()["buckets"].items():
+        merged[i] = merged.get(i, 0) + c
+    assert sum(merged.values()) == 3
+
+
+def test_taps_per_reader():
+    metrics.histograms.clear()
+    metrics.pending.clear()
+    # the same card tapped on two doors at once is two taps
+    metrics.stage("AA", "frame", 0.0, reader=3)
+    metrics.stage("AA", "frame", 0.0, reader=4)
+    metrics.stage("AA", "led", 0.010, reader=3)
+    metrics.stage("AA", "led", 0.020, reader=4)
+    metrics.finish("AA", 3)
+    metrics.finish("AA", 4)
+    assert metrics.histograms[3]["led"].percentile(50) == pytest.approx(0.010, rel=0.01)
+    assert metrics.histograms[4]["led"].percentile(50) == pytest.approx(0.020, rel=0.01)
+    assert 'tap_latency_seconds_count{reader="4",stage="led"} 1' in (
+        metrics.exposition()
+    )
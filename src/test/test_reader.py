@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from src import metrics, sheet
+from src.reader import reader, state
+from src.reader.alarm import ALARM, CLOSED, OPEN_OVERDUE
+
+DOOR_PIN = 16  # see sim/ID.json
+LED_PIN = 18
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # the reader's saved state and metrics go to a temporary folder
+    monkeypatch.setattr(state, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(state, "STATE_FILE", str(tmp_path / "state.json"))
+    monkeypatch.setattr(state, "SHEET_FILE", str(tmp_path / "sheet.json"))
+    monkeypatch.setattr(metrics, "METRICS_FILE", str(tmp_path / "taps.json"))
+    metrics.histograms.clear()
+    metrics.pending.clear()
+    yield
+    # the simulated hardware is shared - drop the finished reader's door callbacks, and close the door
+    reader.hardware.cleanup()
+    reader.hardware.inputs.clear()
+
+
+def frames():
+    # the frames written to the door's LEDs
+    return [frame for _, frame in reader.hardware.frames[LED_PIN]]
+
+
+def test_tap_and_door_alarm(data_dir):
+    assert sheet.get_sheet_data()
+    channels = reader.load_channels()
+    channel = channels[0]
+    for c in channels:
+        reader.hardware.setup_input(c.door_pin)
+
+    async def run():
+        app = reader.Reader(channels)
+        task = asyncio.create_task(app.run())
+
+        # the trace taps a student with access to Room A at 0.2 seconds - Room A's color is shown
+        await asyncio.sleep(0.35)
+        blue = bytes(channel.leds.frame((0, 0, 255), reader.BRIGHTNESS_HIGH))
+        assert blue in frames()
+        assert metrics.histograms[3]["led"].count == 1
+
+        # then an unknown card at 0.4 seconds - the no access color
+        await asyncio.sleep(0.2)
+        red = bytes(channel.leds.frame((255, 0, 0), reader.BRIGHTNESS_HIGH))
+        assert frames()[-1] == red
+
+        # the door opens - the alarm trips after the alarm delay (0.3 seconds) and is reported
+        reader.hardware.set_input(DOOR_PIN, True)
+        await asyncio.sleep(0.1)
+        assert channel.alarm.state == OPEN_OVERDUE
+        await asyncio.sleep(0.4)
+        assert channel.alarm.state == ALARM
+        assert sheet.reader_info[3]["alarm_status"] == "ALARM"
+
+        # the door closes - the alarm clears and that is reported too
+        reader.hardware.set_input(DOOR_PIN, False)
+        await asyncio.sleep(0.1)
+        assert channel.alarm.state == CLOSED
+        assert sheet.reader_info[3]["alarm_status"] == "OK"
+
+        app.stop()
+        await task
+
+    asyncio.run(run())
+    # the state was saved at exit
+    saved = state.load_json(state.STATE_FILE)["channels"]["3"]
+    assert saved["alarm"] == channel.alarm.snapshot()
+
+
+def test_door_read_again_after_bounce_time(data_dir):
+    assert sheet.get_sheet_data()
+    channels = reader.load_channels()
+    channel = channels[0]
+    for c in channels:
+        reader.hardware.setup_input(c.door_pin)
+
+    async def run():
+        app = reader.Reader(channels)
+        task = asyncio.create_task(app.run())
+        await asyncio.sleep(0.05)
+
+        # the door opens, but its contact is still bouncing when the edge callback reads it - it reads closed, and the
+        # edge as it settles open comes within the bounce time, so it is dropped
+        channel.door_changed(DOOR_PIN)
+        reader.hardware.inputs[DOOR_PIN] = True
+        await asyncio.sleep(0.1)
+        assert not channel.alarm.door_open
+
+        # the pin is read again once the bounce time has passed
+        await asyncio.sleep(reader.DOOR_SENSOR_BOUNCETIME / 1000)
+        assert channel.alarm.door_open
+        assert channel.alarm.state == OPEN_OVERDUE
+
+        app.stop()
+        await task
+
+    asyncio.run(run())
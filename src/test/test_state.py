@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from src.reader import state
+
+
+@pytest.fixture
+def sheet_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(state, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(state, "SHEET_FILE", str(tmp_path / "sheet.json"))
+
+
+def sheet(reader_ids):
+    """
+    Stands in for the sheet module - records the data restored.
+    """
+    module = SimpleNamespace(reader_ids=reader_ids, restored=None)
+    module.restore = lambda data: setattr(module, "restored", data)
+    return module
+
+
+def snapshot(reader_ids, age=timedelta(0)):
+    return {
+        "last_update_time": (datetime.now() - age).isoformat(),
+        "reader_access_data": {str(id): {"id": id} for id in reader_ids if id > 0},
+        "reader_info": {str(id): {"id": id} for id in reader_ids},
+    }
+
+
+def test_restores_saved_data(sheet_file):
+    state.write_json(state.SHEET_FILE, snapshot([3, 4]))
+    module = sheet([3, 4])
+    assert state.load_sheet(module)
+    assert module.restored["reader_info"]["4"] == {"id": 4}
+
+
+def test_no_saved_data(sheet_file):
+    assert not state.load_sheet(sheet([3]))
+
+
+def test_too_old(sheet_file):
+    age = timedelta(hours=state.SHEET_MAX_AGE_HOURS + 1)
+    state.write_json(state.SHEET_FILE, snapshot([3], age))
+    assert not state.load_sheet(sheet([3]))
+
+
+def test_door_added_since_saved(sheet_file):
+    # a door was added to "channels" after the data was saved - it has to be downloaded again
+    state.write_json(state.SHEET_FILE, snapshot([3]))
+    module = sheet([3, 4])
+    assert not state.load_sheet(module)
+    assert module.restored is None
+
+
+def test_control_app_has_no_access_data(sheet_file):
+    state.write_json(state.SHEET_FILE, snapshot([0]))
+    assert state.load_sheet(sheet([0]))